@@ -0,0 +1,205 @@
+"""Benchmark memory and latency of the compact conversation state against the dict layout.
+
+Usage:
+    python bench_conversation_state.py [--users 100000,1000000] [--turns 4] [--ops 200000]
+
+For every population size each layout runs in a fresh process that creates that
+many synthetic users (a few turns each, mixed English/Gujarati, some with shared
+canned replies) and reports the growth in resident memory per user plus the
+latency of a store lookup and of a lookup followed by a turn and flag update.
+"dict" is the six-key dict with a history ring and booking dict the store used
+to keep; "compact" is whatsapp_bot.ConversationState in ConversationStore.
+"""
+import os
+import gc
+import sys
+import time
+import random
+import resource
+import argparse
+import threading
+import subprocess
+import collections
+
+os.environ.setdefault("OUTBOX_PATH", "")
+
+import whatsapp_bot as bot
+
+CANNED_REPLIES = [
+    "📄 Here is the Brookstone brochure. Would you like to book a site visit? 🏠",
+    "📍 Brookstone is off Shela-Bopal Road. Here is the Google Maps location.",
+    "💰 *3BHK* at Brookstone: *1.66 Cr* (2650 sq ft)\n\nWould you like the brochure or to book a site visit? 🏠",
+]
+
+
+class DictLayoutStore:
+    """The store's previous memory layout: (state dict, last_seen) entries in an LRU"""
+
+    def __init__(self, max_users, idle_ttl, history_turns):
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.history_turns = history_turns
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def new_state(self, from_phone):
+        return {
+            'chat_history': collections.deque(maxlen=self.history_turns),
+            'lead_capture_mode': None,
+            'user_phone': from_phone,
+            'language': 'english',
+            'asked_about_brochure': False,
+            'booking_info': {}
+        }
+
+    def _expire(self, now):
+        while self._entries:
+            _, last_seen = next(iter(self._entries.values()))
+            if now - last_seen <= self.idle_ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, from_phone):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.pop(from_phone, None)
+            if entry is None:
+                state = self.new_state(from_phone)
+                while len(self._entries) >= self.max_users:
+                    self._entries.popitem(last=False)
+            else:
+                state = entry[0]
+            self._entries[from_phone] = (state, now)
+            return state
+
+
+def dict_update(state, text, is_user, language):
+    state['chat_history'].append((text, is_user))
+    state['language'] = language
+    state['asked_about_brochure'] = not is_user
+
+
+def compact_update(state, text, is_user, language):
+    state.add_turn(text, is_user)
+    state.language = language
+    state.asked_about_brochure = not is_user
+
+
+LAYOUTS = {
+    'dict': (DictLayoutStore, dict_update),
+    'compact': (bot.ConversationStore, compact_update),
+}
+
+
+def make_store(layout, users):
+    store_class, update = LAYOUTS[layout]
+    kwargs = {'max_users': users + 1, 'idle_ttl': 86400, 'history_turns': bot.CONV_HISTORY_TURNS}
+    if store_class is bot.ConversationStore:
+        kwargs['backend'] = None
+    return store_class(**kwargs), update
+
+
+def synthetic_turns(i, turns):
+    """Alternating user/bot turns; user texts are unique, half the replies are shared canned ones"""
+    language = 'gujarati' if i % 5 == 0 else 'english'
+    for turn in range(turns):
+        if turn % 2 == 0:
+            yield f"what is the price of {i % 3 + 2}bhk, user {i} question {turn}", True, language
+        elif i % 2:
+            yield CANNED_REPLIES[(i + turn) % len(CANNED_REPLIES)], False, language
+        else:
+            yield f"Answer {turn} for user {i}: possession is planned for May 2027.", False, language
+
+
+def phone(i):
+    return f"91{9000000000 + i}"
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_child(layout, users, turns, ops):
+    gc.collect()
+    before = rss_bytes()
+    store, update = make_store(layout, users)
+    started = time.perf_counter()
+    for i in range(users):
+        state = store.get(phone(i))
+        for text, is_user, language in synthetic_turns(i, turns):
+            update(state, text, is_user, language)
+    load_seconds = time.perf_counter() - started
+    gc.collect()
+    grown = rss_bytes() - before
+
+    rng = random.Random(7)
+    keys = [phone(rng.randrange(users)) for _ in range(ops)]
+    started = time.perf_counter()
+    for key in keys:
+        store.get(key)
+    lookup = (time.perf_counter() - started) / ops
+
+    started = time.perf_counter()
+    for n, key in enumerate(keys):
+        update(store.get(key), CANNED_REPLIES[n % len(CANNED_REPLIES)], False, 'english')
+    updated = (time.perf_counter() - started) / ops
+
+    print(f"{layout} {users} {grown} {load_seconds:.3f} {lookup:.9f} {updated:.9f}")
+
+
+def check_equivalent(turns):
+    """Both layouts must hold the same turns and fields for the same users"""
+    old, old_update = make_store('dict', 100)
+    new, new_update = make_store('compact', 100)
+    for i in range(100):
+        a, b = old.get(phone(i)), new.get(phone(i))
+        for text, is_user, language in synthetic_turns(i, turns + 9):
+            old_update(a, text, is_user, language)
+            new_update(b, text, is_user, language)
+        if list(a['chat_history']) != b.chat_history() or a['language'] != b.language or \
+                a['asked_about_brochure'] != b.asked_about_brochure:
+            return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default='100000,1000000', help="comma separated population sizes")
+    parser.add_argument('--turns', type=int, default=4, help="turns per synthetic user")
+    parser.add_argument('--ops', type=int, default=200000, help="timed lookups and updates per run")
+    parser.add_argument('--layouts', default='dict,compact')
+    parser.add_argument('--child', nargs=2, metavar=('LAYOUT', 'USERS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.turns, args.ops)
+        return 0
+
+    if not check_equivalent(args.turns):
+        print("compact state differs from the dict layout")
+        return 1
+
+    print(f"{'layout':<8} {'users':>9} {'RSS MB':>8} {'B/user':>7} {'load s':>7} {'lookup µs':>10} {'update µs':>10}")
+    for users in [int(n) for n in args.users.split(',')]:
+        for layout in args.layouts.split(','):
+            out = subprocess.run(
+                [sys.executable, __file__, '--child', layout, str(users), '--turns', str(args.turns), '--ops', str(args.ops)],
+                capture_output=True, text=True, check=True
+            ).stdout.split()[-6:]
+            grown, load_seconds, lookup, updated = int(out[2]), float(out[3]), float(out[4]), float(out[5])
+            print(f"{layout:<8} {users:>9} {grown / 2**20:>8.1f} {grown / users:>7.0f} {load_seconds:>7.2f} "
+                  f"{lookup * 1e6:>10.2f} {updated * 1e6:>10.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Benchmark the single-pass intent router against the original keyword cascade.
+
+Usage:
+    python bench_intent_router.py [messages.txt] [--repeat 500] [--extra-intents 0]
+
+Every message (a built-in mixed English/Gujarati corpus, or one message per line
+from the given file) is classified by both implementations: the canned-reply
+intents of plan_incoming_message plus the phone and budget entities. The script
+fails if any result differs and prints the per-message time of each.
+--extra-intents adds synthetic keyword intents to both, to show how each scales.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+os.environ.setdefault("OUTBOX_PATH", "")
+
+import whatsapp_bot as bot
+
+SAMPLE_MESSAGES = [
+    "hi",
+    "Hello, I am interested in Brookstone",
+    "please send the brochure",
+    "can you share brochure and floor plan pdf",
+    "yes",
+    "ok sure",
+    "What is the price of 3BHK?",
+    "my budget is 1.5 cr for a 3 bhk",
+    "budget around 90 lakhs",
+    "₹ 2.25 crore is my limit, is 4bhk possible",
+    "where is the site, send google map location",
+    "how do I reach there",
+    "what is the address",
+    "I want to talk to agent",
+    "give me agent whatsapp number",
+    "book site visit for sunday",
+    "can I schedule visit tomorrow",
+    "my number is 9876543210",
+    "+91 98765 43210",
+    "+91-9876543210 please call",
+    "contact me on 09876543210",
+    "Is there a gym and swimming pool?",
+    "When is possession?",
+    "tell me about the amenities",
+    "need more details about parking",
+    "is the booking amount refundable",
+    "ત્રણ બીએચકે ની કિંમત શું છે?",
+    "મને બ્રોશર મોકલો",
+    "સાઇટ વિઝિટ બુક કરવી છે",
+    "મુલાકાત માટે ક્યારે આવી શકું?",
+    "એપોઇન્ટમેન્ટ જોઈએ છે",
+    "સાઇટ જોવા આવવું છે, સરનામું શું છે?",
+    "મારું બજેટ 1.2 cr છે",
+    "હા",
+    "location પાઠવો",
+    "પાર્કિંગ અને લિફ્ટ વિશે જણાવો",
+    "okay, what about the 4 bhk carpet area and the download link",
+    "I need the whatsapp chat of your agent and a site visit",
+]
+
+
+def legacy_route(message_text, extra_intents=()):
+    """The keyword cascade and budget/phone regexes plan_incoming_message used to run, verbatim"""
+    user_lower = message_text.lower().strip()
+    intents = []
+
+    brochure_keywords = ['brochure', 'pdf', 'download', 'send brochure', 'share brochure', 'floor plan', 'send pdf']
+    if any(kw in user_lower for kw in brochure_keywords):
+        intents.append('brochure')
+
+    affirmative_patterns = ['yes', 'yeah', 'yup', 'sure', 'ok', 'okay', 'please', 'send', 'want', 'need']
+    if any(a in user_lower for a in affirmative_patterns):
+        intents.append('brochure_affirmative')
+
+    location_keywords = ['location', 'address', 'site address', 'google map', 'map', 'direction', 'where is', 'reach']
+    if any(kw in user_lower for kw in location_keywords):
+        intents.append('location')
+
+    contact_patterns = ['whatsapp chat', 'whatsapp number', 'agent whatsapp', 'contact agent', 'agent contact', 'talk to agent']
+    if any(phrase in user_lower for phrase in contact_patterns):
+        intents.append('contact')
+
+    booking_keywords_english = ['book site visit', 'schedule visit', 'site visit', 'book appointment', 'visit booking']
+    booking_keywords_gujarati = ['સાઇટ વિઝિટ', 'એપોઇન્ટમેન્ટ', 'વિઝિટ બુક', 'મુલાકાત', 'સાઇટ જોવા']
+    if any(kw in user_lower for kw in booking_keywords_english + booking_keywords_gujarati):
+        intents.append('site_visit')
+
+    for name, keywords in extra_intents:
+        if any(kw in user_lower for kw in keywords):
+            intents.append(name)
+
+    phone_pattern = r'\b(?:\+91[\s-]?)?[6-9]\d{9}\b'
+    phone_match = re.search(phone_pattern, message_text)
+    phone = phone_match.group().replace(' ', '').replace('-', '') if phone_match else None
+
+    patterns = [
+        r'(\d+\.?\d*)\s*(?:cr|crore|crores)',
+        r'(\d+\.?\d*)\s*(?:lakh|lakhs)',
+        r'₹\s*(\d+\.?\d*)\s*(?:cr|crore|crores)',
+        r'₹\s*(\d+\.?\d*)\s*(?:lakh|lakhs)',
+    ]
+    budget = None
+    text_lower = message_text.lower()
+    for pattern in patterns:
+        match = re.search(pattern, text_lower)
+        if match:
+            amount = float(match.group(1))
+            budget = f"{amount} Cr" if 'cr' in pattern or 'crore' in pattern else f"{amount} Lakh"
+            break
+
+    return intents, phone, budget
+
+
+def synthetic_intents(count):
+    """count extra intents of six keywords each that never match the corpus"""
+    return [(f"extra_{i}", [f"zq{i}x{j}" for j in range(6)]) for i in range(count)]
+
+
+def timed(fn, messages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            fn(message)
+    return (time.perf_counter() - started) / (repeat * len(messages))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('messages', nargs='?', help="file with one message per line")
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--extra-intents', type=int, default=0, help="synthetic intents added to both implementations")
+    args = parser.parse_args(argv)
+
+    messages = SAMPLE_MESSAGES
+    if args.messages:
+        with open(args.messages, encoding='utf-8') as f:
+            messages = [line.strip() for line in f if line.strip()]
+
+    extra = synthetic_intents(args.extra_intents)
+    router = bot.IntentRouter({**bot.MESSAGE_INTENTS, **dict(extra)}, bot.MESSAGE_ENTITIES)
+
+    mismatches = 0
+    for message in messages:
+        old = legacy_route(message, extra)
+        route = router.route(message)
+        new = ([name for name, _ in route.intents], route.entities.get('phone'), route.budget)
+        if old != new:
+            mismatches += 1
+            print(f"MISMATCH {message!r}: {old} != {new}")
+    print(f"{len(messages)} messages compared, {mismatches} mismatches")
+
+    legacy = timed(lambda message: legacy_route(message, extra), messages, args.repeat)
+    routed = timed(router.route, messages, args.repeat)
+    print(f"intents: {len(router.order)}, keywords: {len(router.credit)}")
+    print(f"legacy cascade + budget/phone regexes: {legacy * 1e6:8.1f} µs/message")
+    print(f"single-pass router:                    {routed * 1e6:8.1f} µs/message  ({legacy / routed:.1f}x)")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
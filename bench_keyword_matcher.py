@@ -0,0 +1,391 @@
+"""Benchmark extract_relevant_data's compiled keyword matcher against the original any(...) scans.
+
+Usage:
+    python bench_keyword_matcher.py [questions.txt] [--repeat 200]
+
+Runs every question (a built-in sample set, or one question per line from the
+given file) through both implementations in English and Gujarati, fails if any
+selected section differs, and prints the per-message time of each. The current
+implementation returns frozen SECTION_STORE fragments, which are compared by value.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+os.environ.setdefault("OUTBOX_PATH", "")
+
+import whatsapp_bot as bot
+
+SAMPLE_QUESTIONS = [
+    "What is the price of 3BHK?",
+    "Tell me about the 4 bhk carpet area and balcony",
+    "Which amenities are there? Is there a gym or pool?",
+    "Where is the project located, any metro nearby?",
+    "How many lifts are in block a and block b?",
+    "Is there car parking for 2 cars?",
+    "what is on the ground floor near the foyer and the toddler area",
+    "When is possession? What is the completion timeline?",
+    "Who is the developer, tell me about Shatranj group",
+    "kitchen and dining size in three bedroom flat",
+    "what flooring and electrical specifications are provided",
+    "is there a security cabin on the right side",
+    "central lawn, sand pit and fountain",
+    "hello",
+    "yes please send details",
+    "ok",
+    "ત્રણ બીએચકે ની કિંમત શું છે?",
+    "ગ્રાઉન્ડ ફ્લોર પર જીમ અને લાઇબ્રેરી છે?",
+    "પાર્કિંગ અને લિફ્ટ વિશે જણાવો",
+    "ચાર બેડરૂમ ફ્લેટ નો એરિયા",
+    "બાળકો માટે રમત વિસ્તાર છે?",
+    "Looking for a 4-bhk apartment with good connectivity and a club house, what is the cost and size?",
+]
+
+
+def legacy_extract_relevant_data(user_question, faq_data, language='english'):
+    """extract_relevant_data as it was before the compiled matcher, kept verbatim for comparison"""
+    lang_data = faq_data.get(language, faq_data.get('english', {}))
+    relevant_data = {}
+    user_question_lower = user_question.lower()
+    
+    # Always include basic project info
+    if 'project_info' in lang_data:
+        relevant_data['project_info'] = lang_data['project_info']
+        
+    # Check for ground floor and general facility queries
+    ground_floor_keywords = [
+        'ground floor', 'ground level', 'ground', 'facility', 'amenity', 
+        'foyer', 'entrance', 'gym', 'library', 'toddler', 'children', 'play',
+        'lift', 'elevator', 'stair', 'parking', 'society office', 'reception'
+    ]
+    
+    # Convert to Gujarati keywords for better matching
+    gujarati_keywords = [
+        'ગ્રાઉન્ડ', 'નીચલો માળ', 'ફોયર', 'પ્રવેશ', 'જીમ', 'લાઇબ્રેરી', 
+        'બાળકો', 'રમત', 'લિફ્ટ', 'એલિવેટર', 'સીડી', 'પાર્કિંગ', 
+        'સોસાયટી ઓફિસ', 'રિસેપ્શન', 'સુવિધા'
+    ]
+    
+    # Add keywords for flat configurations
+    flat_keywords = [
+        '3bhk', '3 bhk', '3-bhk', 'three bedroom', 'three bed', 
+        '4bhk', '4 bhk', '4-bhk', 'four bedroom', 'four bed'
+    ]
+    
+    # Gujarati flat keywords
+    gujarati_flat_keywords = [
+        'ત્રણ બેડરૂમ', '૩ બીએચકે', 'ત્રણ બીએચકે',
+        'ચાર બેડરૂમ', '૪ બીએચકે', 'ચાર બીએચકે'
+    ]
+    
+    all_keywords = ground_floor_keywords + gujarati_keywords + flat_keywords + gujarati_flat_keywords
+    
+    if any(word in user_question_lower for word in all_keywords):
+        if any(k in user_question_lower for k in ['3bhk', '3 bhk', '3-bhk', 'three bedroom', 'ત્રણ બેડરૂમ', '૩ બીએચકે', 'ત્રણ બીએચકે']):
+            if '3bhk_unit_plan' in lang_data:
+                relevant_data['unit_plan'] = lang_data['3bhk_unit_plan']
+                relevant_data['pricing'] = {'3bhk': lang_data.get('pricing', {}).get('box_price_2650')}
+                relevant_data['parking'] = {'3bhk': lang_data.get('parking', {}).get('3bhk_parking')}
+        
+        elif any(k in user_question_lower for k in ['4bhk', '4 bhk', '4-bhk', 'four bedroom', 'ચાર બેડરૂમ', '૪ બીએચકે', 'ચાર બીએચકે']):
+            if '4bhk_unit_plan' in lang_data:
+                relevant_data['unit_plan'] = lang_data['4bhk_unit_plan']
+                relevant_data['pricing'] = {'4bhk': lang_data.get('pricing', {}).get('box_price_3850')}
+                relevant_data['parking'] = {'4bhk': lang_data.get('parking', {}).get('4bhk_parking')}
+        
+        if 'ground_floor_plan' in lang_data:
+            relevant_data['ground_floor_plan'] = lang_data['ground_floor_plan']
+        if 'construction_specifications' in lang_data and 'elevator' in lang_data['construction_specifications']:
+            relevant_data['elevator'] = lang_data['construction_specifications']['elevator']
+    
+    # Check for ground floor related queries
+    if any(word in user_question_lower for word in ['ground floor', 'ground level', 'ground', 'foyer', 'entrance', 'multipurpose', 'court', 'gym', 'library', 'toddler', 'society', 'seating', 'lift', 'stair', 'amenity', 'facility', 'drop']):
+        if 'ground_floor_plan' in lang_data:
+            # Add overall ground floor summary
+            relevant_data['ground_floor_summary'] = lang_data['ground_floor_plan'].get('summary', '')
+            relevant_data['ground_floor_overview'] = lang_data['ground_floor_plan'].get('site_overview', {})
+            
+            # Always include zone-specific details for comprehensive ground floor queries
+            block_a_zone = lang_data['ground_floor_plan'].get('block_a_zone', {})
+            block_b_zone = lang_data['ground_floor_plan'].get('block_b_zone', {})
+            central_zone = lang_data['ground_floor_plan'].get('central_amenities', {})
+            
+            # Right Side (Block A Zone) Details
+            if 'block a' in user_question_lower or any(word in user_question_lower for word in ['society', 'toddler', 'right side', 'security']):
+                relevant_data['block_a_zone'] = {
+                    'foyer': {
+                        'size': '14\'-9\" × 14\'-6\"',
+                        'function': 'Entry point into Block A',
+                        'features': 'Staircases (UP & DN) on both sides'
+                    },
+                    'lift_lobby': {
+                        'size': '8\'-5\" × 6\'-8\"',
+                        'lifts_count': '2 lifts'
+                    },
+                    'seating_space': {
+                        'size': '44\'-0\" × 21\'-7\"',
+                        'function': 'Large sitting lounge outside Block A'
+                    },
+                    'society_office': {
+                        'size': '10\'-3\" × 16\'-3\"',
+                        'location': 'Beside the seating lounge'
+                    },
+                    'store_society': {
+                        'size': '10\'-3\" × 5\'-0\"',
+                        'location': 'Near the Society Office'
+                    },
+                    'toddlers_space': {
+                        'size': '16\'-4\" × 15\'-9\"',
+                        'function': 'Play area for toddlers'
+                    },
+                    'store_toddlers': {
+                        'size': '11\'-0\" × 5\'-7\"',
+                        'location': 'Near the Toddler\'s Space'
+                    },
+                    'toilet_toddlers': {
+                        'size': '6\'-0\" × 6\'-7\"',
+                        'location': 'Near the Toddler\'s Space'
+                    },
+                    'other_utilities': {
+                        'security': 'Security Cabin with toilet at entry/exit gate',
+                        'meter_room': 'Dedicated space for electrical meters',
+                        'parking': 'Car parking spaces available',
+                        'drop_off': 'Kids drop-off area',
+                        'ramp': 'Basement ramp near Block A foyer',
+                        'water_feature': 'Decorative water body beside walkway'
+                    }
+                }
+            
+            # Left Side (Block B Zone) Details
+            if 'block b' in user_question_lower or any(word in user_question_lower for word in ['gym', 'library', 'left side']):
+                relevant_data['block_b_zone'] = {
+                    'foyer': {
+                        'size': '14\'-0\" × 19\'-6\"',
+                        'function': 'Entry point into Block B',
+                        'features': 'Staircases (UP & DN) on both sides'
+                    },
+                    'lift_lobby': {
+                        'size': '6\'-8\" × 8\'-0\"',
+                        'lifts_count': '2 lifts'
+                    },
+                    'gym': {
+                        'size': '17\'-9\" × 19\'-3\"',
+                        'function': 'Fitness and exercise area'
+                    },
+                    'library_lounge': {
+                        'size': '18\'-9\" × 26\'-5\"',
+                        'function': 'Library, Lounge, and Multi-Purpose Room'
+                    },
+                    'other_utilities': {
+                        'sand_pit': 'Children\'s play area',
+                        'postal': 'Dedicated space for postal services'
+                    }
+                }
+            
+            # Central Amenities Details
+            if any(word in user_question_lower for word in ['central', 'amenity', 'court', 'sand pit', 'lawn', 'facility', 'fountain']):
+                relevant_data['central_amenities'] = {
+                    'multipurpose_court': {
+                        'size': '40\'-8\" × 18\'-11\"',
+                        'location': 'Center of complex',
+                        'features': 'Surrounded by walkways'
+                    },
+                    'sand_pit': {
+                        'location': 'Adjacent to multipurpose court',
+                        'function': 'Children\'s play area'
+                    },
+                    'other_facilities': [
+                        'Internal Roads',
+                        'Drop-Off Plaza',
+                        'Lawn Area',
+                        'DG Set',
+                        'Seating Blocks',
+                        'Ramp Down to Basement',
+                        'Water Fountain with sculpture'
+                    ]
+                }
+
+    # Check for unit configurations and sizes
+    if any(word in user_question_lower for word in ['3bhk', '3 bhk', 'price', 'cost', 'bhk', 'bedroom', 'size', 'sqft', 'configuration', 'apartment', 'flat', 'carpet', 'area', 'dimension']):
+        # Always include both configurations
+        if 'unit_configurations' in lang_data:
+            configs = lang_data['unit_configurations']
+            relevant_data['unit_details'] = {
+                '3bhk': {
+                    'total_size': next((config['size_sqft'] for config in configs if config['type'] == '3BHK'), ''),
+                    'carpet_area': next((config['carpet_area'] for config in configs if config['type'] == '3BHK'), ''),
+                    'size_yard': next((config['size_sq_yard'] for config in configs if config['type'] == '3BHK'), ''),
+                    'price': next((config['price_cr'] for config in configs if config['type'] == '3BHK'), '')
+                },
+                '4bhk': {
+                    'total_size': next((config['size_sqft'] for config in configs if config['type'] == '4BHK'), ''),
+                    'carpet_area': next((config['carpet_area'] for config in configs if config['type'] == '4BHK'), ''),
+                    'size_yard': next((config['size_sq_yard'] for config in configs if config['type'] == '4BHK'), ''),
+                    'price': next((config['price_cr'] for config in configs if config['type'] == '4BHK'), '')
+                }
+            }
+        
+        # For detailed floor plans
+        if '3bhk_unit_plan' in lang_data and ('3bhk' in user_question_lower or '3 bhk' in user_question_lower or 'carpet' in user_question_lower):
+            relevant_data['3bhk_details'] = {
+                'overview': lang_data['3bhk_unit_plan']['overview'],
+                'special_features': lang_data['3bhk_unit_plan']['special_features'],
+                'area_breakdown': lang_data['3bhk_unit_plan']['area_breakdown']
+            }
+        
+        if '4bhk_unit_plan' in lang_data and ('4bhk' in user_question_lower or '4 bhk' in user_question_lower or 'carpet' in user_question_lower):
+            relevant_data['4bhk_details'] = {
+                'overview': lang_data['4bhk_unit_plan']['overview'],
+                'special_features': lang_data['4bhk_unit_plan']['special_features'],
+                'area_breakdown': lang_data['4bhk_unit_plan']['area_breakdown']
+            }
+        
+        if 'pricing' in lang_data:
+            relevant_data['pricing'] = lang_data['pricing']
+    
+    if any(word in user_question_lower for word in ['kitchen', 'room', 'bedroom', 'living', 'dining', 'bathroom', 'toilet', 'balcony']):
+        if '3bhk_unit_plan' in lang_data:
+            relevant_data['3bhk_unit_plan'] = lang_data['3bhk_unit_plan']
+        if '4bhk_unit_plan' in lang_data:
+            relevant_data['4bhk_unit_plan'] = lang_data['4bhk_unit_plan']
+    
+    # Check for elevator related queries
+    if any(word in user_question_lower for word in ['elevator', 'lift']):
+        if 'elevator' in lang_data:
+            relevant_data['elevator'] = lang_data['elevator']
+
+    # Check for parking related queries
+    if any(word in user_question_lower for word in ['parking', 'car park', 'vehicle']):
+        if 'parking' in lang_data:
+            relevant_data['parking'] = lang_data['parking']
+
+    # Check for specifications from the image
+    if any(word in user_question_lower for word in ['structure', 'flooring', 'bathroom', 'kitchen', 'elevator', 'electrical', 'doors', 'windows', 'security', 'water', 'specifications', 'features']):
+        if 'specifications' in lang_data:
+            relevant_data['specifications'] = lang_data['specifications']
+
+    # Check for elevator related queries
+    if any(word in user_question_lower for word in ['elevator', 'lift', 'lifts']):
+        if 'construction_specifications' in lang_data and 'elevator' in lang_data['construction_specifications']:
+            relevant_data['elevator'] = lang_data['construction_specifications']['elevator']
+        if 'ground_floor_plan' in lang_data:
+            block_a_lifts = lang_data['ground_floor_plan']['block_a_zone'].get('lift_lobby', {})
+            block_b_lifts = lang_data['ground_floor_plan']['block_b_zone'].get('lift_lobby', {})
+            relevant_data['elevators_detail'] = {
+                'block_a': block_a_lifts,
+                'block_b': block_b_lifts
+            }
+
+    # Check for parking related queries
+    if any(word in user_question_lower for word in ['parking', 'car park', 'vehicle', 'cars']):
+        if 'parking' in lang_data:
+            relevant_data['parking'] = lang_data['parking']
+
+    # Check for specifications from the image
+    if any(word in user_question_lower for word in ['structure', 'flooring', 'bathroom', 'kitchen', 'electrical', 'doors', 'windows', 'security', 'water', 'specifications', 'features']):
+        if 'construction_specifications' in lang_data:
+            relevant_data['specifications'] = lang_data['construction_specifications']
+
+    if any(word in user_question_lower for word in ['amenity', 'amenities', 'facility', 'gym', 'pool', 'park', 'club']):
+        if 'amenities' in lang_data:
+            relevant_data['amenities'] = lang_data['amenities']
+    
+    if any(word in user_question_lower for word in ['location', 'address', 'connectivity', 'metro', 'nearby', 'landmark']):
+        if 'location_details' in lang_data:
+            relevant_data['location_details'] = lang_data['location_details']
+    
+    if any(word in user_question_lower for word in ['possession', 'ready', 'completion', 'timeline', 'delivery']):
+        if 'possession_details' in lang_data:
+            relevant_data['possession_details'] = lang_data['possession_details']
+    
+    if any(word in user_question_lower for word in ['developer', 'shatranj', 'aarat', 'group', 'company', 'builder']):
+        if 'developer_portfolio' in lang_data:
+            relevant_data['developer_portfolio'] = lang_data['developer_portfolio']
+    
+    # If minimal data, add more sections
+    if len(relevant_data) <= 2:
+        for section in ['unit_configurations', 'pricing', '3bhk_unit_plan', '4bhk_unit_plan', 'amenities', 'location_details']:
+            if section in lang_data:
+                relevant_data[section] = lang_data[section]
+    
+    return relevant_data
+
+
+def thaw(value):
+    """Plain dicts and lists again, for comparing frozen fragments with the legacy output"""
+    if isinstance(value, bot.Fragment):
+        value = value.value
+    if isinstance(value, bot.Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def timed(fn, questions, languages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for question in questions:
+            for language in languages:
+                fn(question, bot.FAQ_DATA, language)
+    return (time.perf_counter() - started) / (repeat * len(questions) * len(languages))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('questions', nargs='?', help="file with one question per line")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+    # The prompt packer logs every trimmed prompt
+    logging.getLogger().setLevel(logging.WARNING)
+
+    questions = SAMPLE_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+    languages = [language for language in ('english', 'gujarati') if bot.FAQ_DATA.get(language)]
+
+    mismatches = 0
+    for question in questions:
+        for language in languages:
+            old = legacy_extract_relevant_data(question, bot.FAQ_DATA, language)
+            new = thaw(bot.extract_relevant_data(question, language))
+            if old != new or list(old) != list(new):
+                mismatches += 1
+                print(f"MISMATCH [{language}] {question!r}: {list(old)} != {list(new)}")
+    print(f"{len(questions) * len(languages)} selections compared, {mismatches} mismatches")
+
+    # Same call shape as the legacy function, which still reads the raw FAQ data
+    def compiled_extract(question, faq_data, language):
+        return bot.extract_relevant_data(question, language)
+
+    legacy = timed(legacy_extract_relevant_data, questions, languages, args.repeat)
+    compiled = timed(compiled_extract, questions, languages, args.repeat)
+    print(f"legacy any() scans: {legacy * 1e6:8.1f} µs/message")
+    print(f"compiled matcher:   {compiled * 1e6:8.1f} µs/message  ({legacy / compiled:.1f}x)")
+
+    lowered = [question.lower() for question in questions]
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for question in lowered:
+            bot.RELEVANCE_MATCHER.match(question)
+    scan = (time.perf_counter() - started) / (args.repeat * len(lowered))
+    print(f"  of which the single keyword scan: {scan * 1e6:.1f} µs/message")
+
+    # Prompt data assembly: serializing the legacy dicts vs concatenating pre-serialized fragments
+    def assemble(fn):
+        def run(question, faq_data, language):
+            bot.PROMPT_PACKER.pack(fn(question, faq_data, language), language, question)
+        return run
+
+    legacy_packed = timed(assemble(legacy_extract_relevant_data), questions, languages, args.repeat // 10 or 1)
+    store_packed = timed(assemble(compiled_extract), questions, languages, args.repeat // 10 or 1)
+    print(f"prompt data, legacy dicts serialized: {legacy_packed * 1e6:8.1f} µs/message")
+    print(f"prompt data, store fragments joined:  {store_packed * 1e6:8.1f} µs/message  ({legacy_packed / store_packed:.1f}x)")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Measure how often the local FAQ answer engine serves a question and how often it should not have.
+
+Usage:
+    python eval_local_answers.py [--min-confidence 0.8] [--verbose]
+
+Answerable questions are labelled with the intents the engine should serve them
+with; the negative set holds questions that mention the same words (price, cost,
+loan, RERA, ...) but ask something no template answers, so they must fall through
+to Gemini. The script reports the local-serve fraction, intent accuracy and the
+false-positive rate, plus how well follow-ups (which skip the engine and the
+response cache) are told apart from standalone questions that use a pronoun.
+"""
+import os
+import sys
+import argparse
+
+os.environ.setdefault("OUTBOX_PATH", "")
+
+import whatsapp_bot as bot
+
+# (question, language, intents the engine should answer it with)
+ANSWERABLE_SET = [
+    ("What is the price of 3BHK?", 'english', ['unit_price']),
+    ("3bhk price", 'english', ['unit_price']),
+    ("how much is the 4 bhk flat", 'english', ['unit_price']),
+    ("what is the flat price", 'english', ['unit_price']),
+    ("what is the rate per sq ft", 'english', ['price_per_sqft']),
+    ("carpet area of 4bhk", 'english', ['unit_size']),
+    ("how big is the 3 bhk", 'english', ['unit_size']),
+    ("when is possession", 'english', ['possession_date']),
+    ("possession date", 'english', ['possession_date']),
+    ("how many units are there", 'english', ['total_units']),
+    ("how many towers", 'english', ['towers']),
+    ("is the project rera registered", 'english', ['rera']),
+    ("is it vastu compliant", 'english', ['vastu']),
+    ("how many car parking for 4bhk", 'english', ['parking_count']),
+    ("do you have 2bhk", 'english', ['bhk_options']),
+    ("is loan available", 'english', ['loan']),
+    ("are there floor rise charges", 'english', ['floor_rise']),
+    ("ત્રણ બીએચકે ની કિંમત શું છે", 'gujarati', ['unit_price']),
+    ("પઝેશન ક્યારે છે", 'gujarati', ['possession_date']),
+    ("કેટલા ટાવર છે", 'gujarati', ['towers']),
+]
+
+# (question, language) that must fall through to Gemini
+NEGATIVE_SET = [
+    ("what is the maintenance cost", 'english'),
+    ("how much is the down payment", 'english'),
+    ("what is the booking amount for 3bhk", 'english'),
+    ("what is the price of parking", 'english'),
+    ("is stamp duty cost included", 'english'),
+    ("gst on price", 'english'),
+    ("cost of interiors", 'english'),
+    ("club house membership cost", 'english'),
+    ("which banks give loan", 'english'),
+    ("rera number", 'english'),
+    ("what is the rera number of the project", 'english'),
+    ("how much time to reach the airport", 'english'),
+    ("what is the price difference between 3bhk and 4bhk", 'english'),
+    ("how big is the 4bhk kitchen", 'english'),
+    ("what is the size of the gym", 'english'),
+    ("are there possession charges", 'english'),
+    ("is there visitor parking", 'english'),
+    ("ev charging for parking cost", 'english'),
+    ("મેન્ટેનન્સ કેટલું છે", 'gujarati'),
+    ("કઈ બેંક લોન આપે છે", 'gujarati'),
+    ("રેરા નંબર શું છે", 'gujarati'),
+]
+
+# (question, language, whether it depends on the previous turns) asked two turns into a chat
+FOLLOW_UP_SET = [
+    ("how big is it", 'english', True),
+    ("what is the price of it", 'english', True),
+    ("tell me more", 'english', True),
+    ("yes please", 'english', True),
+    ("what about that", 'english', True),
+    ("એની કિંમત શું છે", 'gujarati', True),
+    ("is it vastu compliant", 'english', False),
+    ("what is this project's possession date", 'english', False),
+    ("does it have a gym", 'english', False),
+    ("is this project rera registered", 'english', False),
+    ("3bhk price", 'english', False),
+    ("પઝેશન ક્યારે મળશે એ જણાવો", 'gujarati', False),
+    ("તે પ્રોજેક્ટમાં પાર્કિંગ છે", 'gujarati', False),
+]
+
+
+def evaluate_follow_ups(verbose=False):
+    history = ['previous question', 'previous answer']
+    wrong = 0
+    for question, language, expected in FOLLOW_UP_SET:
+        got = bot.depends_on_history(bot.normalize_question(question), history)
+        if got != expected:
+            wrong += 1
+            if verbose:
+                print(f"  follow-up {question!r}: expected {expected}, got {got}")
+    return 1 - wrong / len(FOLLOW_UP_SET)
+
+
+def evaluate(engine, verbose=False):
+    served = correct = 0
+    for question, language, intents in ANSWERABLE_SET:
+        normalized = bot.normalize_question(question)
+        got, _, confidence = engine.classify(normalized)
+        answer = engine.answer(normalized, bot.FAQ_DATA, language)
+        served += answer is not None
+        correct += answer is not None and got == intents
+        if verbose and (answer is None or got != intents):
+            print(f"  missed {question!r}: expected {intents}, got {got} at {confidence}")
+
+    false_positives = 0
+    for question, language in NEGATIVE_SET:
+        normalized = bot.normalize_question(question)
+        if engine.answer(normalized, bot.FAQ_DATA, language) is not None:
+            false_positives += 1
+            if verbose:
+                got, _, confidence = engine.classify(normalized)
+                print(f"  false positive {question!r}: {got} at {confidence}")
+
+    return {
+        'served': served / len(ANSWERABLE_SET),
+        'intent_accuracy': correct / len(ANSWERABLE_SET),
+        'false_positives': false_positives,
+        'false_positive_rate': false_positives / len(NEGATIVE_SET),
+        'follow_up_accuracy': evaluate_follow_ups(verbose)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-confidence', type=float, default=bot.LOCAL_ANSWER_MIN_CONFIDENCE)
+    parser.add_argument('--verbose', action='store_true', help="list every miss and false positive")
+    args = parser.parse_args(argv)
+
+    engine = bot.LocalAnswerEngine(args.min_confidence)
+    result = evaluate(engine, args.verbose)
+    print(f"{len(ANSWERABLE_SET)} answerable and {len(NEGATIVE_SET)} negative questions, "
+          f"min_confidence={args.min_confidence}")
+    print(f"served locally:      {result['served']:>7.1%}")
+    print(f"intent accuracy:     {result['intent_accuracy']:>7.1%}")
+    print(f"false positives:     {result['false_positive_rate']:>7.1%}  ({result['false_positives']})")
+    print(f"follow-up accuracy:  {result['follow_up_accuracy']:>7.1%}  ({len(FOLLOW_UP_SET)} questions)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Compare the prompt data selected by the keyword rules and by the BM25 chunk retriever.
+
+Usage:
+    python eval_retriever.py [--modes rules,bm25,hybrid] [--top-k 6] [--max-chars 6000] [--verbose]
+
+For every labelled question the selection is serialized the way the prompt packer
+sends it, and the script checks whether the facts needed to answer are present
+(recall) and how much data was sent (characters and estimated tokens).
+"""
+import os
+import sys
+import argparse
+
+os.environ.setdefault("OUTBOX_PATH", "")
+
+import whatsapp_bot as bot
+
+# (question, language, facts the selected data must contain to answer it)
+EVAL_SET = [
+    ("What is the price of 3BHK?", 'english', ['1.66 Cr']),
+    ("price of 4 bhk flat", 'english', ['2.41 Cr']),
+    ("what is the carpet area of 3bhk", 'english', ['1440 sq ft']),
+    ("how big is the 4bhk kitchen", 'english', ["13'0\" × 11'0\""]),
+    ("3bhk kitchen size", 'english', ["10'6\" × 11'0\""]),
+    ("how many car parking spaces do I get with a 4bhk", 'english', ['3 dedicated covered car parking']),
+    ("is there visitor parking", 'english', ['visitor parking spaces']),
+    ("when is possession", 'english', ['May 2027']),
+    ("which schools are nearby", 'english', ['DPS - Bopal']),
+    ("any good hospitals close by?", 'english', ['Zydus Hospital']),
+    ("which malls are near the site", 'english', ['Palladium Mall']),
+    ("what tiles are used for flooring", 'english', ['800x1600']),
+    ("which brand are the bathroom fittings", 'english', ['KOHLER']),
+    ("what is the kitchen platform made of", 'english', ['Granite Platform']),
+    ("is the structure earthquake resistant", 'english', ['earthquake resistant']),
+    ("is there a gym", 'english', ['gym']),
+    ("do you have EV charging", 'english', ['EV charging']),
+    ("what is the size of the gym", 'english', ["17'-9\" × 19'-3\""]),
+    ("how many years of experience does Shatranj group have", 'english', ['58 years']),
+    ("what is the rate per sq ft", 'english', ['5300']),
+    ("is the price negotiable", 'english', ['negotiable']),
+    ("are there floor rise charges", 'english', ['No floor rise charges']),
+    ("do banks give a loan for this", 'english', ['loan_facility: Yes']),
+    ("can I see a sample flat", 'english', ['VR']),
+    ("which road is the main entry on", 'english', ['12M TP Road']),
+    ("how many lifts are there in block a", 'english', ['2 lifts']),
+    ("how many bathrooms in 4bhk", 'english', ['bathrooms: 5']),
+    ("ત્રણ બીએચકે ની કિંમત શું છે", 'gujarati', ['1.66 કરોડ']),
+    ("ચાર બીએચકે માં કેટલા પાર્કિંગ મળે", 'gujarati', ['3 સમર્પિત કવર કાર પાર્કિંગ']),
+    ("નજીકમાં કઈ હોસ્પિટલ છે", 'gujarati', ['ઝાયડસ હોસ્પિટલ']),
+    ("નજીકની સ્કૂલ કઈ છે", 'gujarati', ['દિવ્યા જ્યોત સ્કૂલ']),
+    ("ફ્લોરિંગ માટે કઈ ટાઇલ્સ", 'gujarati', ['800x1600']),
+    ("ત્રણ બીએચકે માં કિચન કેટલું મોટું છે", 'gujarati', ["10'6\" × 11'0\""]),
+    ("જીમ છે?", 'gujarati', ['જિમ']),
+    ("EV ચાર્જિંગ છે?", 'gujarati', ['EV ચાર્જિંગ']),
+]
+
+
+def select(mode, question, language, top_k, max_chars):
+    if mode == 'bm25':
+        return bot.RETRIEVER.relevant_data(question, language, top_k, max_chars)
+    if mode == 'hybrid':
+        relevant_data = bot.extract_relevant_data(question, language, broad_fallback=False)
+        if len(relevant_data) <= 2:
+            relevant_data.update(bot.RETRIEVER.relevant_data(question, language, top_k, max_chars))
+        return relevant_data
+    return bot.extract_relevant_data(question, language)
+
+
+def evaluate(mode, top_k, max_chars, verbose=False):
+    found = total = chars = tokens = sections = 0
+    for question, language, facts in EVAL_SET:
+        relevant_data = select(mode, question, language, top_k, max_chars)
+        text = bot.serialize_compact(relevant_data)
+        hits = [fact for fact in facts if fact in text]
+        found += len(hits)
+        total += len(facts)
+        chars += len(text)
+        tokens += bot.PROMPT_PACKER.estimate_tokens(text, language, calibrated=False)
+        sections += len(relevant_data)
+        if verbose and len(hits) < len(facts):
+            print(f"  [{mode}] missed {sorted(set(facts) - set(hits))} for {question!r}: {list(relevant_data)}")
+    count = len(EVAL_SET)
+    return {
+        'recall': found / total,
+        'avg_chars': chars / count,
+        'avg_tokens': tokens / count,
+        'avg_sections': sections / count
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='rules,bm25,hybrid')
+    parser.add_argument('--top-k', type=int, default=bot.RETRIEVER_TOP_K)
+    parser.add_argument('--max-chars', type=int, default=bot.RETRIEVER_MAX_CHARS)
+    parser.add_argument('--verbose', action='store_true', help="list every missed fact")
+    args = parser.parse_args(argv)
+
+    print(f"{len(EVAL_SET)} labelled questions, top_k={args.top_k}, max_chars={args.max_chars}")
+    print(f"{'mode':<8} {'recall':>7} {'chars':>8} {'tokens':>8} {'sections':>9}")
+    for mode in args.modes.split(','):
+        result = evaluate(mode.strip(), args.top_k, args.max_chars, args.verbose)
+        print(f"{mode:<8} {result['recall']:>7.1%} {result['avg_chars']:>8.0f} "
+              f"{result['avg_tokens']:>8.0f} {result['avg_sections']:>9.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
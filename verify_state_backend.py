@@ -0,0 +1,153 @@
+"""Check that a shared conversation-state backend loses no turns when several processes write one user.
+
+Usage:
+    python verify_state_backend.py [--backend sqlite|redis|fakeredis] [--processes 4] [--messages 50]
+
+Every worker process opens its own ConversationStore on the backend and, for
+--messages rounds, fetches the same user, appends one tagged turn and commits,
+so the saves race on one record and go through the compare-and-set and rebase
+path. The first worker also sets the brochure flag once. The parent then reads
+the user back and checks that every turn is there exactly once, in each
+worker's order, and that the flag survived. A commit that gives up after too
+many conflicts keeps its changes on the cached state, and the store rebases
+them onto the record it loads for the next message; each worker ends with
+empty messages until its leftovers are saved, as the user's next message
+would. "fakeredis" serves the Redis protocol from an in-process fakeredis TCP
+server, so no Redis server is needed (the redis and fakeredis packages still
+are).
+"""
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+os.environ.setdefault("OUTBOX_PATH", "")
+os.environ["CONV_BACKEND"] = "memory"
+
+import whatsapp_bot as bot
+
+USER = "919000000000"
+
+
+def open_backend(backend, target, prefix):
+    if backend == 'sqlite':
+        return bot.SQLiteStateBackend(target)
+    return bot.RedisStateBackend(target, prefix=prefix)
+
+
+def run_child(backend, target, prefix, worker, messages, history_turns):
+    store = bot.ConversationStore(open_backend(backend, target, prefix), history_turns=history_turns)
+    given_up = 0
+    for n in range(messages):
+        state = store.get(USER)
+        state.add_turn(f"w{worker}-m{n}", True)
+        if worker == 0 and n == 0:
+            state.asked_about_brochure = True
+        if not store.commit(USER, state):
+            given_up += 1
+    # A real worker would carry leftovers with the user's next message; here that is an empty one
+    for _ in range(messages):
+        state = store.get(USER)
+        if not state.has_unsaved_changes() or store.commit(USER, state):
+            break
+    stats = store.stats()
+    print(json.dumps({'saves': stats['saves'], 'conflicts': stats['conflicts'], 'errors': stats['errors'],
+                      'given_up': given_up, 'unflushed': int(state.has_unsaved_changes())}))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_fakeredis():
+    from fakeredis import TcpFakeServer
+    port = free_port()
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    # Connection handler threads must not keep the process alive at exit
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+def check(backend, target, prefix, processes, messages, history_turns):
+    """List of problems with the stored user after all workers finished"""
+    state = bot.ConversationStore(open_backend(backend, target, prefix), history_turns=history_turns).get(USER)
+    turns = [text for text, _ in state.chat_history()]
+    problems = []
+    expected = {f"w{w}-m{n}" for w in range(processes) for n in range(messages)}
+    if len(turns) != len(set(turns)):
+        problems.append(f"{len(turns) - len(set(turns))} duplicated turns")
+    if expected - set(turns):
+        problems.append(f"{len(expected - set(turns))} lost turns")
+    for w in range(processes):
+        own = [int(t.split('-m')[1]) for t in turns if t.startswith(f"w{w}-")]
+        if own != sorted(own):
+            problems.append(f"worker {w}'s turns out of order")
+    if not state.asked_about_brochure:
+        problems.append("brochure flag lost")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=('sqlite', 'redis', 'fakeredis'), default='sqlite')
+    parser.add_argument('--target', help="SQLite path or Redis URL (default: a temp file / CONV_REDIS_URL)")
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=50, help="turns appended per process")
+    parser.add_argument('--child', nargs=2, metavar=('WORKER', 'PREFIX'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    history_turns = args.processes * args.messages
+
+    if args.child:
+        run_child(args.backend, args.target, args.child[1], int(args.child[0]), args.messages, history_turns)
+        return 0
+
+    backend, target = args.backend, args.target
+    if backend == 'fakeredis':
+        backend, target = 'redis', start_fakeredis()
+    elif backend == 'redis':
+        target = target or bot.CONV_REDIS_URL
+    elif target is None:
+        target = os.path.join(tempfile.mkdtemp(), 'conversations.db')
+    # A fresh prefix per run, so a shared Redis never mixes in an earlier run's turns
+    prefix = f"verify:{os.getpid()}:"
+    # Create the SQLite schema once, before the workers race to do it
+    open_backend(backend, target, prefix)
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, __file__, '--backend', backend, '--target', target, '--messages', str(args.messages),
+             '--processes', str(args.processes), '--child', str(w), prefix],
+            stdout=subprocess.PIPE, text=True
+        )
+        for w in range(args.processes)
+    ]
+    totals = {'saves': 0, 'conflicts': 0, 'errors': 0, 'given_up': 0, 'unflushed': 0}
+    for worker in workers:
+        out, _ = worker.communicate()
+        if worker.returncode != 0:
+            print(f"worker exited with {worker.returncode}")
+            return 1
+        for key, value in json.loads(out.strip().splitlines()[-1]).items():
+            totals[key] += value
+
+    print(f"{args.backend}: {args.processes} processes x {args.messages} turns on one user, "
+          f"{totals['saves']} saves, {totals['conflicts']} conflicts rebased, "
+          f"{totals['errors']} errors, {totals['given_up']} commits given up, "
+          f"{totals['unflushed']} workers left with unsaved changes")
+    problems = check(backend, target, prefix, args.processes, args.messages, history_turns)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: every turn stored once, in order, and the brochure flag kept")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
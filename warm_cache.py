@@ -0,0 +1,213 @@
+"""Pre-generate Gemini answers for common questions so a fresh deploy starts with a warm answer cache.
+
+Usage:
+    python warm_cache.py questions.txt [more.jsonl ...] [--output warm_cache.json]
+        [--min-count 2] [--limit 500] [--concurrency 4] [--rate 2] [--dry-run]
+
+Input files hold past user questions in English and/or Gujarati, one per line
+(.jsonl lines may instead be objects with a "text" or "question" field).
+Exact duplicates (after normalization) and near duplicates are clustered; one
+answer is generated per cluster and stored under the cache key of every question
+in it. The bot loads the output file from WARM_CACHE_PATH at startup.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import collections
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# The warm-up never sends WhatsApp messages, so it leaves the bot's outbox alone
+os.environ.setdefault("OUTBOX_PATH", "")
+
+import whatsapp_bot as bot
+
+
+def read_questions(paths):
+    """Yield question texts from plain-text or JSONL files"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if path.endswith('.jsonl'):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    line = str(record.get('text') or record.get('question') or '').strip()
+                    if not line:
+                        continue
+                yield line
+
+
+def similarity(tokens_a, text_a, tokens_b, text_b):
+    """Best of word-set overlap and character similarity (catches typos)"""
+    jaccard = len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+    if jaccard >= 0.99:
+        return jaccard
+    return max(jaccard, SequenceMatcher(None, text_a, text_b).ratio())
+
+
+def cluster_questions(questions, threshold=0.85):
+    """Group questions into clusters of exact and near duplicates, most frequent first.
+
+    Near duplicates must share the language, every number in the question ("3 bhk"
+    never merges with "4 bhk") and the FAQ sections the bot would select for them.
+    """
+    counts = collections.Counter()
+    samples = {}
+    for text in questions:
+        normalized = bot.normalize_question(text)
+        if not normalized:
+            continue
+        key = (bot.detect_language(text), normalized)
+        counts[key] += 1
+        samples.setdefault(key, text)
+
+    clusters = []
+    by_token = collections.defaultdict(list)
+    for (language, normalized), count in counts.most_common():
+        text = samples[(language, normalized)]
+        tokens = set(normalized.split())
+        numbers = frozenset(t for t in tokens if any(c.isdigit() for c in t))
+        sections = frozenset(bot.select_relevant_data(text, language))
+        signature = (language, numbers, sections)
+
+        match = None
+        for index in sorted({i for t in tokens for i in by_token[(language, t)]}):
+            cluster = clusters[index]
+            if cluster['signature'] == signature and \
+                    similarity(tokens, normalized, cluster['tokens'], cluster['normalized']) >= threshold:
+                match = cluster
+                break
+
+        if match is None:
+            clusters.append({
+                'signature': signature,
+                'language': language,
+                'normalized': normalized,
+                'tokens': tokens,
+                'questions': [text],
+                'count': count
+            })
+            for t in tokens:
+                by_token[(language, t)].append(len(clusters) - 1)
+        else:
+            match['questions'].append(text)
+            match['count'] += count
+
+    clusters.sort(key=lambda c: c['count'], reverse=True)
+    return clusters
+
+
+def plan_cluster(cluster, phone):
+    """Gemini prompt for the cluster's representative plus the cache key of every member.
+
+    Returns None when the bot would not ask Gemini for it (greetings, brochure and
+    booking flows, local FAQ answers).
+    """
+    prompt = None
+    keys = []
+    for i, text in enumerate(cluster['questions']):
+        sender = f"{phone}-{i}"
+        plan = bot.plan_incoming_message(sender, text)
+        bot.CONV_STORE.pop(sender)
+        if plan['prompt'] is None or not plan.get('cache_key'):
+            continue
+        if prompt is None:
+            prompt = (plan['prompt'], plan['language'], plan.get('cached_content'))
+        keys.append(plan['cache_key'])
+    if prompt is None:
+        return None
+    return prompt, sorted(set(keys))
+
+
+def generate(jobs, concurrency, rate, timeout):
+    """Run the Gemini calls with at most `concurrency` in flight and `rate` starts per second"""
+    bucket = bot.TokenBucket(rate, 1)
+    answers = []
+    failed = 0
+
+    def run(job):
+        (prompt, language, cached_content), keys = job
+        bucket.acquire()
+        return bot.GEMINI.generate(prompt, language, cached_content, bot.Deadline(timeout)), keys
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            answer, keys = future.result()
+            if bot.is_cacheable_answer(answer):
+                answers.append([answer, keys])
+            else:
+                failed += 1
+            if done % 25 == 0 or done == len(futures):
+                logging.info(f"🔥 Generated {done}/{len(futures)} ({failed} failed)")
+    return answers, failed
+
+
+def write_warm_cache(path, answers):
+    data = {
+        'format': bot.WARM_CACHE_FORMAT,
+        'faq_version': bot.FAQ_VERSION,
+        'created_at': int(time.time()),
+        'answers': answers
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate answers for the bot's warm answer cache")
+    parser.add_argument('corpus', nargs='+', help="question files (.txt: one per line, .jsonl: text/question field)")
+    parser.add_argument('--output', default=bot.WARM_CACHE_PATH or 'warm_cache.json')
+    parser.add_argument('--min-count', type=int, default=2, help="only warm clusters asked at least this often")
+    parser.add_argument('--limit', type=int, default=500, help="maximum number of clusters to generate")
+    parser.add_argument('--threshold', type=float, default=0.85, help="near-duplicate similarity threshold")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=2.0, help="maximum Gemini requests started per second")
+    parser.add_argument('--timeout', type=float, default=60.0, help="latency budget per answer in seconds")
+    parser.add_argument('--dry-run', action='store_true', help="print the clusters without calling Gemini")
+    args = parser.parse_args(argv)
+
+    # Plan against an empty cache, otherwise already-warm questions look answered
+    bot.RESPONSE_CACHE.clear()
+
+    questions = list(read_questions(args.corpus))
+    clusters = [c for c in cluster_questions(questions, args.threshold) if c['count'] >= args.min_count]
+    clusters = clusters[:args.limit]
+    logging.info(f"📚 {len(questions)} questions -> {len(clusters)} clusters asked at least {args.min_count} times")
+
+    jobs = []
+    for i, cluster in enumerate(clusters):
+        planned = plan_cluster(cluster, f"warmup-{i}")
+        if planned is None:
+            continue
+        jobs.append(planned)
+        if args.dry_run:
+            print(f"{cluster['count']:>6}  {cluster['language']:<8}  {cluster['questions'][0]}"
+                  f"  (+{len(cluster['questions']) - 1} variants)")
+    logging.info(f"🧠 {len(jobs)} clusters need Gemini; the rest are answered without it")
+    if args.dry_run or not jobs:
+        return 0
+    if not bot.GEMINI_API_KEY:
+        logging.error("❌ GEMINI_API_KEY is not set")
+        return 1
+
+    started = time.monotonic()
+    answers, failed = generate(jobs, args.concurrency, args.rate, args.timeout)
+    write_warm_cache(args.output, answers)
+    logging.info(f"✅ Wrote {len(answers)} answers covering {sum(len(keys) for _, keys in answers)} questions "
+                 f"to {args.output} in {time.monotonic() - started:.1f}s ({failed} failed)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,50 @@
 import os
+import sys
 import json
 import time
 import re
 import logging
+import queue
+import threading
+import zlib
+import hashlib
+import math
+import random
+import heapq
+import sqlite3
+import socket
+import uuid
+import collections
+import types
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from collections.abc import Mapping
+from urllib.parse import parse_qs
 from flask import Flask, request, jsonify
 import requests
 from dotenv import load_dotenv
 import gspread
 from google.oauth2.service_account import Credentials
 
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # Needed for SERVING_MODE=asgi, and for HTTP/2 to the Graph API
+except ImportError:
+    httpx = None
+
+try:
+    import redis  # Needed for CONV_BACKEND=redis
+except ImportError:
+    redis = None
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = httpx is not None
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -18,40 +54,721 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
+# Base URL and model are overridable so the bot can be pointed at a local stand-in for Gemini
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip('/')
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_API_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent"
 
 # Google Sheets Configuration
 GOOGLE_CREDENTIALS = os.getenv("GOOGLE_CREDENTIALS")  # Service account credentials JSON
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "brookstone_verify_token_2024")
 LEADS_SHEET_NAME = os.getenv("LEADS_SHEET_NAME", "Brookstone Leads")
 SITE_VISITS_SHEET_NAME = os.getenv("SITE_VISITS_SHEET_NAME", "Brookstone Site Visits")
-BROCHURE_MEDIA_ID = os.getenv("BROCHURE_MEDIA_ID", "1562506805130847")
+# Site visit bookings are read incrementally; the cursor file remembers the next unread row
+BOOKING_CHECK_INTERVAL = int(os.getenv("BOOKING_CHECK_INTERVAL", "300"))
+BOOKING_CURSOR_PATH = os.getenv("BOOKING_CURSOR_PATH", "booking_cursor.json")
+BOOKING_READ_BATCH = int(os.getenv("BOOKING_READ_BATCH", "500"))  # rows fetched per range read
+BOOKING_PENDING_TTL = int(os.getenv("BOOKING_PENDING_TTL", "86400"))  # how long incomplete rows are re-read
+BROCHURE_MEDIA_ID = os.getenv("BROCHURE_MEDIA_ID", "")  # a pre-uploaded ID; lapses 30 days after upload
+
+# Webhook processing: "inline" answers inside the POST handler, "background" acks
+# immediately and hands messages to the worker pool
+WEBHOOK_PROCESSING_MODE = os.getenv("WEBHOOK_PROCESSING_MODE", "inline").lower()
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "4"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+
+# Shared Graph API connection pool
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "3.05"))
+GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "15"))
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "20"))
+
+# Outbound send scheduler (token bucket + retries with jittered exponential backoff)
+OUTBOUND_RATE_PER_SECOND = float(os.getenv("OUTBOUND_RATE_PER_SECOND", "20"))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "40"))
+OUTBOUND_SENDERS = int(os.getenv("OUTBOUND_SENDERS", "4"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "5000"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "4"))
+OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", "1.0"))
+OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", "30"))
+OUTBOUND_RETRY_WINDOW = float(os.getenv("OUTBOUND_RETRY_WINDOW", "60"))  # stop retrying this long after a message was queued
+# Longest a caller (e.g. an inline webhook request) waits for the outcome; the
+# message stays queued and keeps retrying within OUTBOUND_RETRY_WINDOW after that
+OUTBOUND_SEND_TIMEOUT = float(os.getenv("OUTBOUND_SEND_TIMEOUT", "15"))
+
+# Local assets uploaded once to WhatsApp and sent by media ID
+BROCHURE_PATH = os.getenv("BROCHURE_PATH", "static/Brookstone.pdf")
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", "media_cache.json")
+MEDIA_TTL_SECONDS = int(os.getenv("MEDIA_TTL_SECONDS", str(30 * 86400)))  # WhatsApp keeps uploads for 30 days
+MEDIA_REFRESH_MARGIN = int(os.getenv("MEDIA_REFRESH_MARGIN", str(2 * 86400)))
+
+# Read receipts are batched per conversation and sent off the reply path
+READ_RECEIPT_DELAY = float(os.getenv("READ_RECEIPT_DELAY", "0.5"))
+
+# Gemini answer cache for repeated questions
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(6 * 3600)))
+
+# Pre-generated answers (written by warm_cache.py) loaded into the answer cache at startup
+WARM_CACHE_PATH = os.getenv("WARM_CACHE_PATH", "warm_cache.json")
+WARM_CACHE_TTL_SECONDS = int(os.getenv("WARM_CACHE_TTL_SECONDS", str(7 * 86400)))
+
+# Factual questions answered from the FAQ data when the intent match is at least this confident
+LOCAL_ANSWER_MIN_CONFIDENCE = float(os.getenv("LOCAL_ANSWER_MIN_CONFIDENCE", "0.8"))
+
+# Register the system instruction + common FAQ sections as Gemini cached content
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+GEMINI_CACHED_SECTIONS = [s.strip() for s in os.getenv(
+    "GEMINI_CACHED_SECTIONS", "project_info,unit_configurations,pricing,parking,amenities,location_details"
+).split(',') if s.strip()]
+
+# Gemini resilience: per-message latency budget, circuit breaker and optional hedged requests
+GEMINI_MESSAGE_BUDGET = float(os.getenv("GEMINI_MESSAGE_BUDGET", "20"))
+GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "12"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "2"))
+GEMINI_BREAKER_WINDOW = int(os.getenv("GEMINI_BREAKER_WINDOW", "20"))
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "5"))
+GEMINI_BREAKER_FAILURE_RATIO = float(os.getenv("GEMINI_BREAKER_FAILURE_RATIO", "0.5"))
+GEMINI_BREAKER_SLOW_SECONDS = float(os.getenv("GEMINI_BREAKER_SLOW_SECONDS", "8"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() == "true"
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "1.0"))
+
+# Prompt data selection: "rules" (keyword if-chains), "bm25" (ranked FAQ chunks) or "hybrid"
+# (rules, with ranked chunks instead of the broad six-section fallback when the rules find little)
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "rules").lower()
+RETRIEVER_TOP_K = int(os.getenv("RETRIEVER_TOP_K", "6"))
+RETRIEVER_MAX_CHARS = int(os.getenv("RETRIEVER_MAX_CHARS", "6000"))
+RETRIEVER_CHUNK_CHARS = int(os.getenv("RETRIEVER_CHUNK_CHARS", "1200"))
+
+# FAQ files are polled this often (seconds) and hot-reloaded when they change (0 disables)
+FAQ_RELOAD_INTERVAL = float(os.getenv("FAQ_RELOAD_INTERVAL", "30"))
+
+# Conversation store: users kept in memory, idle time before a user is forgotten, turns of history kept
+# (the prompt uses the last 4 turns and follow-up detection the 2 before the current message)
+CONV_MAX_USERS = int(os.getenv("CONV_MAX_USERS", "20000"))
+CONV_IDLE_TTL_SECONDS = int(os.getenv("CONV_IDLE_TTL_SECONDS", str(2 * 86400)))
+CONV_HISTORY_TURNS = int(os.getenv("CONV_HISTORY_TURNS", "8"))
+# Where conversation state lives: "memory" (this process only), "sqlite" (shared by the workers
+# of one host) or "redis" (shared across hosts; needs the redis package)
+CONV_BACKEND = os.getenv("CONV_BACKEND", "memory").lower()
+CONV_SQLITE_PATH = os.getenv("CONV_SQLITE_PATH", "conversations.db")
+CONV_REDIS_URL = os.getenv("CONV_REDIS_URL", "redis://localhost:6379/0")
+CONV_REDIS_PREFIX = os.getenv("CONV_REDIS_PREFIX", "brookstone:conv:")
+# Seconds a locally cached state is trusted without checking its version in the shared backend
+CONV_CACHE_TTL = float(os.getenv("CONV_CACHE_TTL", "0"))
+
+# Per-message prompt budget (estimated tokens for project data + conversation + question)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+
+# Durable outbox: every outbound message is logged here before it is sent ("" disables)
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+OUTBOX_REPLAY_MAX_AGE = int(os.getenv("OUTBOX_REPLAY_MAX_AGE", "86400"))
+OUTBOX_RETENTION_SECONDS = int(os.getenv("OUTBOX_RETENTION_SECONDS", "3600"))
+OUTBOX_COMPACT_INTERVAL = int(os.getenv("OUTBOX_COMPACT_INTERVAL", "600"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))  # how long a crashed process keeps its rows
+
+# Serving: "wsgi" runs the Flask app, "asgi" runs the non-blocking asgi_app under uvicorn
+SERVING_MODE = os.getenv("SERVING_MODE", "wsgi").lower()
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "500"))
+
+# Redelivered webhooks are dropped by message ID for this long
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "20000"))
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+
+# Fraction of webhook payloads logged (at DEBUG) when debug logging is enabled
+WEBHOOK_LOG_SAMPLE_RATE = float(os.getenv("WEBHOOK_LOG_SAMPLE_RATE", "0.1"))
 
 # ===== LOAD FAQ DATA =====
+FAQ_FILES = {'english': 'faq_data_english.json', 'gujarati': 'faq_data_gujarati.json'}
+PROMPT_VIEWS_PATH = 'faq_data_prompt_views.json'
+
 def load_faq_data():
     """Load FAQ data from JSON files for both languages"""
     data = {}
-    try:
-        with open('faq_data_english.json', 'r', encoding='utf-8') as f:
-            data['english'] = json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading English FAQ: {e}")
-        data['english'] = {}
+    for language, path in FAQ_FILES.items():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data[language] = json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading {language.capitalize()} FAQ: {e}")
+            data[language] = {}
     
+    return data
+
+def load_prompt_views():
+    """Load the hand-written prompt views (e.g. ground floor zone summaries) shared by both languages"""
     try:
-        with open('faq_data_gujarati.json', 'r', encoding='utf-8') as f:
-            data['gujarati'] = json.load(f)
+        with open(PROMPT_VIEWS_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
     except Exception as e:
-        logging.error(f"Error loading Gujarati FAQ: {e}")
-        data['gujarati'] = {}
-    
-    return data
+        logging.error(f"Error loading prompt views: {e}")
+        return {}
+
+def faq_fingerprint(data):
+    """Short content hash of the loaded FAQ data, used to invalidate derived caches"""
+    serialized = json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(serialized).hexdigest()[:12]
 
 FAQ_DATA = load_faq_data()
+PROMPT_VIEWS = load_prompt_views()
+FAQ_VERSION = faq_fingerprint({'faq': FAQ_DATA, 'prompt_views': PROMPT_VIEWS})
+
+# ===== METRICS =====
+METRICS_PROVIDERS = {}
+
+def register_metrics(name, provider):
+    """Register a callable returning a JSON-serializable dict for /metrics"""
+    METRICS_PROVIDERS[name] = provider
+
+def collect_metrics():
+    """Snapshot every registered metrics provider"""
+    snapshot = {}
+    for name, provider in list(METRICS_PROVIDERS.items()):
+        try:
+            snapshot[name] = provider()
+        except Exception as e:
+            snapshot[name] = {'error': str(e)}
+    return snapshot
+
+
+class LatencyHistogram:
+    """Thread-safe fixed-bucket latency histogram (seconds)"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        with self._lock:
+            index = len(self.BUCKETS)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    index = i
+                    break
+            self._counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """Approximate quantile as the upper bound of the bucket containing it"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            seen = 0
+            for i, c in enumerate(self._counts):
+                seen += c
+                if seen >= target:
+                    return self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+            return self.max
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {f"le_{bound}": c for bound, c in zip(self.BUCKETS, self._counts)}
+            buckets['le_inf'] = self._counts[-1]
+            count, total, maximum = self.count, self.total, self.max
+        return {
+            'count': count,
+            'avg': round(total / count, 4) if count else 0.0,
+            'max': round(maximum, 4),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': buckets
+        }
+
+
+# ===== CONVERSATION STATE =====
+# Interned enums: a state stores indexes into these tuples, packed into one small int
+CONV_LANGUAGES = ('english', 'gujarati')
+CONV_LEAD_CAPTURE_MODES = (None, 'phone_for_brochure')
+_LANGUAGE_MASK = 0b0001
+_MODE_MASK = 0b0110
+_MODE_SHIFT = 1
+_ASKED_BROCHURE_MASK = 0b1000
+
+
+class ConversationState:
+    """One user's conversation state as a compact slotted record.
+
+    Language, lead capture mode and the brochure flag share one small int, the
+    history is a tuple of the last max_turns texts with the speaker of each turn
+    in a bitmask, and booking_info stays None until something is booked. For
+    shared backends it also carries the stored version and what was last saved,
+    so unsaved changes can be rebased onto a newer copy.
+    """
+    __slots__ = ('user_phone', 'flags', 'texts', 'roles', 'booking_info', 'max_turns',
+                 'unsaved', 'version', 'saved', 'last_seen', 'fetched_at')
+
+    def __init__(self, user_phone, max_turns=CONV_HISTORY_TURNS):
+        self.user_phone = user_phone
+        self.flags = 0
+        self.texts = ()
+        self.roles = 0
+        self.booking_info = None
+        self.max_turns = max_turns
+        self.unsaved = 0
+        self.version = 0
+        self.saved = None
+        self.last_seen = 0.0
+        self.fetched_at = 0.0
+
+    @property
+    def language(self):
+        return CONV_LANGUAGES[self.flags & _LANGUAGE_MASK]
+
+    @language.setter
+    def language(self, language):
+        self.flags = (self.flags & ~_LANGUAGE_MASK) | CONV_LANGUAGES.index(language)
+
+    @property
+    def lead_capture_mode(self):
+        return CONV_LEAD_CAPTURE_MODES[(self.flags & _MODE_MASK) >> _MODE_SHIFT]
+
+    @lead_capture_mode.setter
+    def lead_capture_mode(self, mode):
+        self.flags = (self.flags & ~_MODE_MASK) | (CONV_LEAD_CAPTURE_MODES.index(mode) << _MODE_SHIFT)
+
+    @property
+    def asked_about_brochure(self):
+        return bool(self.flags & _ASKED_BROCHURE_MASK)
+
+    @asked_about_brochure.setter
+    def asked_about_brochure(self, asked):
+        self.flags = self.flags | _ASKED_BROCHURE_MASK if asked else self.flags & ~_ASKED_BROCHURE_MASK
+
+    def add_turn(self, text, is_user):
+        """Append a (text, is_user) turn, dropping the oldest beyond max_turns"""
+        texts = self.texts + (text,)
+        roles = self.roles | (bool(is_user) << len(self.texts))
+        if len(texts) > self.max_turns:
+            drop = len(texts) - self.max_turns
+            texts = texts[drop:]
+            roles >>= drop
+        self.texts = texts
+        self.roles = roles
+        self.unsaved += 1
+
+    def chat_history(self):
+        """(text, is_user) turns, oldest first"""
+        roles = self.roles
+        return [(text, bool(roles >> i & 1)) for i, text in enumerate(self.texts)]
+
+    def to_json(self):
+        record = {
+            'lead_capture_mode': self.lead_capture_mode,
+            'user_phone': self.user_phone,
+            'language': self.language,
+            'asked_about_brochure': self.asked_about_brochure,
+            'booking_info': self.booking_info or {},
+            'chat_history': [[text, is_user] for text, is_user in self.chat_history()]
+        }
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_record(cls, record, from_phone, max_turns, version=0):
+        state = cls(record.get('user_phone') or from_phone, max_turns)
+        if record.get('language') in CONV_LANGUAGES:
+            state.language = record['language']
+        if record.get('lead_capture_mode') in CONV_LEAD_CAPTURE_MODES:
+            state.lead_capture_mode = record.get('lead_capture_mode')
+        state.asked_about_brochure = record.get('asked_about_brochure', False)
+        state.booking_info = record.get('booking_info') or None
+        for text, is_user in record.get('chat_history', ()):
+            state.add_turn(text, is_user)
+        state.mark_saved(version)
+        return state
+
+    def mark_saved(self, version):
+        self.version = version
+        self.unsaved = 0
+        # booking_info is compared as JSON so in-place edits count as changes
+        self.saved = (self.user_phone, self.flags, json.dumps(self.booking_info, sort_keys=True))
+
+    def has_unsaved_changes(self):
+        """True when turns or fields changed since the state was last loaded or saved"""
+        if self.unsaved:
+            return True
+        return self.saved is not None and self.saved != (
+            self.user_phone, self.flags, json.dumps(self.booking_info, sort_keys=True))
+
+    def rebase(self, latest):
+        """Replay this state's unsaved field changes and turns on top of latest, a newer copy of the user"""
+        saved_phone, saved_flags, saved_booking = self.saved
+        flags = latest.flags
+        for mask in (_LANGUAGE_MASK, _MODE_MASK, _ASKED_BROCHURE_MASK):
+            if (self.flags ^ saved_flags) & mask:
+                flags = (flags & ~mask) | (self.flags & mask)
+        new_turns = self.chat_history()[len(self.texts) - min(self.unsaved, len(self.texts)):]
+        if self.user_phone == saved_phone:
+            self.user_phone = latest.user_phone
+        if json.dumps(self.booking_info, sort_keys=True) == saved_booking:
+            self.booking_info = latest.booking_info
+        self.flags = flags
+        self.texts, self.roles = latest.texts, latest.roles
+        self.version, self.saved, self.unsaved = latest.version, latest.saved, 0
+        for text, is_user in new_turns:
+            self.add_turn(text, is_user)
+
+    def approx_bytes(self):
+        """Rough in-memory size: the record, its history tuple and texts, and booking_info"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.texts) + sum(sys.getsizeof(text) for text in self.texts)
+        return size + (sys.getsizeof(self.booking_info) if self.booking_info is not None else 0)
+
+
+class StateBackend:
+    """Shared store of conversation records (JSON text per phone number), versioned for optimistic locking.
+
+    A missing record has version 0; save() only succeeds when the stored version
+    still equals the one the caller loaded.
+    """
+
+    name = 'base'
+
+    def load(self, key):
+        """(record JSON or None, version)"""
+        raise NotImplementedError
+
+    def version(self, key):
+        raise NotImplementedError
+
+    def save(self, key, data, expected_version):
+        """New version, or None when someone else saved the key since expected_version"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        """{'location', 'rows', 'expired'}, the same keys for every backend"""
+        return {}
+
+
+class SQLiteStateBackend(StateBackend):
+    """Conversation records in a SQLite (WAL) file shared by the worker processes of one host"""
+
+    name = 'sqlite'
+
+    def __init__(self, path, idle_ttl=CONV_IDLE_TTL_SECONDS, cleanup_every=500):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.cleanup_every = cleanup_every
+        self.saves = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                key TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated)")
+
+    def load(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT version, data, updated FROM conversations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, 0
+        version, data, updated = row
+        # Idle records read as empty but keep their version, so the next save still applies
+        return (data if time.time() - updated <= self.idle_ttl else None), version
+
+    def version(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM conversations WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def save(self, key, data, expected_version):
+        now = time.time()
+        with self._lock:
+            if expected_version == 0:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO conversations (key, version, data, updated) VALUES (?, 1, ?, ?)",
+                    (key, data, now))
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE conversations SET version = version + 1, data = ?, updated = ? WHERE key = ? AND version = ?",
+                    (data, now, key, expected_version))
+            self.saves += 1
+            if self.saves % self.cleanup_every == 0:
+                self.expired += self._conn.execute(
+                    "DELETE FROM conversations WHERE updated < ?", (now - self.idle_ttl,)).rowcount
+        return expected_version + 1 if cursor.rowcount == 1 else None
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE key = ?", (key,))
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        return {'location': self.path, 'rows': rows, 'expired': self.expired}
+
+
+class RedisStateBackend(StateBackend):
+    """Conversation records in Redis (or anything speaking its protocol), one hash per phone number.
+
+    Saves are WATCH/MULTI/EXEC transactions, so no server-side scripting is
+    needed; every save refreshes the key's idle TTL.
+    """
+
+    name = 'redis'
+
+    def __init__(self, url, prefix=CONV_REDIS_PREFIX, idle_ttl=CONV_IDLE_TTL_SECONDS):
+        if redis is None:
+            raise RuntimeError("CONV_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self.prefix = prefix
+        self.idle_ttl = idle_ttl
+        # Host, port and db only, so the password in the URL never reaches /metrics
+        conn = self.client.connection_pool.connection_kwargs
+        if 'path' in conn:
+            self.location = f"{conn['path']}/{conn.get('db', 0)}"
+        else:
+            self.location = f"{conn.get('host')}:{conn.get('port')}/{conn.get('db', 0)}"
+        self.client.ping()
+
+    def load(self, key):
+        version, data = self.client.hmget(self.prefix + key, 'v', 'd')
+        return (data.decode('utf-8') if data is not None else None), int(version or 0)
+
+    def version(self, key):
+        return int(self.client.hget(self.prefix + key, 'v') or 0)
+
+    def save(self, key, data, expected_version):
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(name)
+                if int(pipe.hget(name, 'v') or 0) != expected_version:
+                    return None
+                pipe.multi()
+                pipe.hset(name, mapping={'v': expected_version + 1, 'd': data})
+                pipe.expire(name, self.idle_ttl)
+                pipe.execute()
+                return expected_version + 1
+            except redis.WatchError:
+                return None
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def stats(self):
+        # Redis expires idle keys itself and keeps no count per key prefix; counting
+        # would mean a SCAN of the shared keyspace on every /metrics scrape
+        return {'location': self.location, 'rows': None, 'expired': None}
+
+
+class ConversationStore:
+    """Per-user conversation state, bounded in users, idle time and history length.
+
+    Entries are kept in least-recently-used order: a new user beyond max_users
+    evicts the longest-idle one, and users idle for longer than idle_ttl are
+    dropped as the store is used. Each state keeps the last history_turns turns.
+
+    With a shared backend this LRU is a read-through cache: each message costs
+    one load (or, for a recently cached user, one version check) and one save of
+    the whole record. A save that lost a race reloads the winner's record,
+    re-applies this message's field changes and new turns, and tries again. If it
+    gives up, the changes stay on the cached state and are rebased onto the
+    record loaded for the user's next message.
+    """
+
+    def __init__(self, backend=None, max_users=CONV_MAX_USERS, idle_ttl=CONV_IDLE_TTL_SECONDS,
+                 history_turns=CONV_HISTORY_TURNS, cache_ttl=CONV_CACHE_TTL, commit_attempts=5):
+        self.backend = backend
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.history_turns = history_turns
+        self.cache_ttl = cache_ttl
+        self.commit_attempts = commit_attempts
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted_capacity = 0
+        self.evicted_idle = 0
+        self.cache_hits = 0
+        self.version_checks = 0
+        self.loads = 0
+        self.saves = 0
+        self.conflicts = 0
+        self.errors = 0
+
+    def new_state(self, from_phone):
+        state = ConversationState(from_phone, self.history_turns)
+        if self.backend is not None:
+            state.mark_saved(0)
+        return state
+
+    def _load_state(self, from_phone):
+        data, version = self.backend.load(from_phone)
+        return ConversationState.from_record(json.loads(data) if data else {}, from_phone, self.history_turns, version)
+
+    def _expire(self, now):
+        while self._entries:
+            if now - next(iter(self._entries.values())).last_seen <= self.idle_ttl:
+                break
+            self._entries.popitem(last=False)
+            self.evicted_idle += 1
+
+    def _remember(self, from_phone, state, now):
+        state.last_seen = now
+        with self._lock:
+            self._entries.pop(from_phone, None)
+            while len(self._entries) >= self.max_users:
+                self._entries.popitem(last=False)
+                self.evicted_capacity += 1
+            self._entries[from_phone] = state
+
+    def get(self, from_phone):
+        """State for a phone number, created on first contact; marks the user as active"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            state = self._entries.get(from_phone)
+            if state is not None and self.backend is None:
+                self._entries.move_to_end(from_phone)
+                state.last_seen = now
+                return state
+        
+        if self.backend is None:
+            state = self.new_state(from_phone)
+            self.created += 1
+        else:
+            state = self._fetch(from_phone, state, now)
+        self._remember(from_phone, state, now)
+        return state
+
+    def _fetch(self, from_phone, cached, now):
+        try:
+            if cached is not None:
+                if now - cached.fetched_at <= self.cache_ttl:
+                    self.cache_hits += 1
+                    return cached
+                self.version_checks += 1
+                if self.backend.version(from_phone) == cached.version:
+                    self.cache_hits += 1
+                    cached.fetched_at = now
+                    return cached
+            self.loads += 1
+            state = self._load_state(from_phone)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"❌ Could not load conversation state for {from_phone}: {e}")
+            return cached or self.new_state(from_phone)
+        if cached is not None and cached.has_unsaved_changes():
+            # A commit that gave up left changes behind; carry them onto the newer record
+            cached.rebase(state)
+            cached.fetched_at = now
+            return cached
+        if state.version == 0:
+            self.created += 1
+        state.fetched_at = now
+        return state
+
+    def commit(self, from_phone, state):
+        """Write a message's changes to the shared backend; False if they could not be saved"""
+        if self.backend is None:
+            state.unsaved = 0
+            return True
+        try:
+            for attempt in range(self.commit_attempts):
+                version = self.backend.save(from_phone, state.to_json(), state.version)
+                if version is not None:
+                    state.mark_saved(version)
+                    self.saves += 1
+                    state.fetched_at = time.monotonic()
+                    self._remember(from_phone, state, state.fetched_at)
+                    return True
+                self.conflicts += 1
+                # Jittered pause so workers racing on one user do not collide again in lockstep
+                time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+                state.rebase(self._load_state(from_phone))
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"❌ Could not save conversation state for {from_phone}: {e}")
+            return False
+        logging.warning(f"⚠️ Gave up saving conversation state for {from_phone} after {self.commit_attempts} conflicts")
+        return False
+
+    def peek(self, from_phone):
+        """Locally cached state for a phone number, without creating it or refreshing its idle timer, or None"""
+        with self._lock:
+            return self._entries.get(from_phone)
+
+    def pop(self, from_phone):
+        with self._lock:
+            state = self._entries.pop(from_phone, None)
+        if self.backend is not None:
+            self.backend.delete(from_phone)
+        return state
+
+    def __contains__(self, from_phone):
+        with self._lock:
+            return from_phone in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            states = list(self._entries.values())
+        total = sum(state.approx_bytes() for state in states)
+        stats = {
+            'backend': self.backend.name if self.backend is not None else 'memory',
+            'users': len(states),
+            'max_users': self.max_users,
+            'idle_ttl': self.idle_ttl,
+            'history_turns': self.history_turns,
+            'history_turns_stored': sum(len(state.texts) for state in states),
+            'approx_bytes': total,
+            'avg_bytes_per_user': round(total / len(states)) if states else 0,
+            'created': self.created,
+            'evicted_capacity': self.evicted_capacity,
+            'evicted_idle': self.evicted_idle
+        }
+        if self.backend is not None:
+            stats.update({
+                'cache_hits': self.cache_hits,
+                'version_checks': self.version_checks,
+                'loads': self.loads,
+                'saves': self.saves,
+                'conflicts': self.conflicts,
+                'errors': self.errors,
+                'shared': self.backend.stats()
+            })
+        return stats
+
+
+def open_state_backend():
+    if CONV_BACKEND == 'memory':
+        return None
+    try:
+        if CONV_BACKEND == 'sqlite':
+            return SQLiteStateBackend(CONV_SQLITE_PATH)
+        if CONV_BACKEND == 'redis':
+            return RedisStateBackend(CONV_REDIS_URL)
+        raise ValueError(f"unknown CONV_BACKEND {CONV_BACKEND!r}")
+    except Exception as e:
+        logging.error(f"❌ Could not open the {CONV_BACKEND} conversation backend, keeping state in this process: {e}")
+        return None
+
+
+CONV_STORE = ConversationStore(open_state_backend())
+register_metrics('conversations', CONV_STORE.stats)
 
-# ===== IN-MEMORY CONVERSATION STATE =====
-# For production, use Redis or a database
-CONV_STATE = {}
 
 # ===== LANGUAGE DETECTION =====
 def detect_language(text):
@@ -64,40 +781,32 @@ def detect_language(text):
     return 'english'
 
 # ===== WHATSAPP API FUNCTIONS =====
-def send_whatsapp_text(to_phone, message):
-    """Send a text message via WhatsApp Cloud API"""
-    url = f"https://graph.facebook.com/v23.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
+WHATSAPP_MESSAGES_URL = f"https://graph.facebook.com/v23.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+WHATSAPP_MEDIA_URL = f"https://graph.facebook.com/v23.0/{WHATSAPP_PHONE_NUMBER_ID}/media"
+BROCHURE_URL = "https://your-domain.com/static/Brookstone.pdf"  # 👈 Replace with your actual deployed URL
+
+
+def whatsapp_headers():
+    """Authorization headers for the WhatsApp Cloud API"""
+    # Content-Type is left to each request: JSON for messages, multipart for media uploads
+    return {
+        "Authorization": f"Bearer {WHATSAPP_TOKEN}"
     }
-    payload = {
+
+
+def text_message_payload(to_phone, message):
+    """Graph API payload for a text message"""
+    return {
         "messaging_product": "whatsapp",
         "to": to_phone,
         "type": "text",
         "text": {"body": message}
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
-        if response.status_code == 200:
-            logging.info(f"✅ Message sent to {to_phone}")
-            return True
-        else:
-            logging.error(f"❌ Failed to send message: {response.status_code} - {response.text}")
-            return False
-    except Exception as e:
-        logging.error(f"❌ Error sending message: {e}")
-        return False
-    
-def send_whatsapp_location(to_phone):
-    """Send Google Maps location via WhatsApp Cloud API"""
-    url = f"https://graph.facebook.com/v23.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
+
+
+def location_message_payload(to_phone):
+    """Graph API payload for the Brookstone location pin"""
+    return {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
         "to": to_phone,
@@ -110,14 +819,563 @@ def send_whatsapp_location(to_phone):
         }
     }
 
-    response = requests.post(url, headers=headers, json=payload)
-    if response.status_code == 200:
-        logging.info(f"✅ Location sent successfully to {to_phone}")
-        return True
+
+def document_message_payload(to_phone, caption, media_id=None, filename="Brookstone.pdf"):
+    """Graph API payload for a PDF, by uploaded media ID or else by public brochure link"""
+    document = {"caption": caption, "filename": filename}
+    if media_id:
+        document["id"] = media_id
     else:
-        logging.error(f"❌ Failed to send location: {response.status_code} - {response.text}")
+        # The file must be publicly accessible by WhatsApp (i.e., via HTTPS)
+        document["link"] = BROCHURE_URL
+    return {
+        "messaging_product": "whatsapp",
+        "to": to_phone,
+        "type": "document",
+        "document": document
+    }
+
+
+def read_receipt_payload(message_id):
+    """Graph API payload marking a message as read"""
+    return {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id
+    }
+
+
+class GraphApiClient:
+    """Shared keep-alive connection pool to graph.facebook.com with per-call latency histograms.
+
+    Uses httpx over HTTP/2 when httpx and h2 are installed, otherwise a pooled
+    requests.Session. Messages in both serving modes are posted from the
+    outbound scheduler's sender threads.
+    """
+
+    def __init__(self, pool_size=GRAPH_POOL_SIZE, connect_timeout=GRAPH_CONNECT_TIMEOUT, read_timeout=GRAPH_READ_TIMEOUT):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = HTTP2_AVAILABLE
+        self.latency = collections.defaultdict(LatencyHistogram)
+        self.responses = collections.Counter()
+        self._lock = threading.Lock()
+        self._session = None
+
+    def _timeout(self):
+        if httpx is not None and self.http2:
+            return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        return (self.connect_timeout, self.read_timeout)
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    if self.http2:
+                        self._session = httpx.Client(
+                            http2=True,
+                            headers=whatsapp_headers(),
+                            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                        )
+                    else:
+                        session = requests.Session()
+                        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                        session.mount('https://', adapter)
+                        session.headers.update(whatsapp_headers())
+                        self._session = session
+        return self._session
+
+    def _record(self, call, started, outcome):
+        self.latency[call].observe(time.monotonic() - started)
+        with self._lock:
+            self.responses[f"{call}:{outcome}"] += 1
+
+    def post(self, url, call, **kwargs):
+        """POST through the shared pool; returns the response (raises on transport errors)"""
+        started = time.monotonic()
+        outcome = 'error'
+        try:
+            response = self.session.post(url, timeout=self._timeout(), **kwargs)
+            outcome = response.status_code
+            return response
+        finally:
+            self._record(call, started, outcome)
+
+    def post_message(self, payload, call):
+        return self.post(WHATSAPP_MESSAGES_URL, call, json=payload)
+
+    def stats(self):
+        with self._lock:
+            responses = dict(self.responses)
+        return {
+            'http2': self.http2,
+            'pool_size': self.pool_size,
+            'timeouts': {'connect': self.connect_timeout, 'read': self.read_timeout},
+            'responses': responses,
+            'latency_seconds': {call: hist.snapshot() for call, hist in list(self.latency.items())}
+        }
+
+
+GRAPH_API = GraphApiClient()
+register_metrics('graph_api', GRAPH_API.stats)
+
+
+# ===== DURABLE OUTBOX =====
+class DurableOutbox:
+    """Append-only SQLite (WAL) log of outbound messages.
+
+    A row is written before a message is handed to the Graph API and marked
+    done after a 200. While a process holds a row it is 'inflight' under that
+    process's lease, which a background thread keeps renewing; rows whose lease
+    ran out (their owner crashed or was restarted) are claimed and replayed by
+    whichever process gets to them first. Finished rows are deleted by a
+    background compactor.
+    """
+
+    OPEN_STATUSES = ('pending', 'inflight')
+
+    def __init__(self, path, replay_max_age=OUTBOX_REPLAY_MAX_AGE, retention=OUTBOX_RETENTION_SECONDS,
+                 lease_seconds=OUTBOX_LEASE_SECONDS):
+        self.path = path
+        self.replay_max_age = replay_max_age
+        self.retention = retention
+        self.lease_seconds = lease_seconds
+        self.appended = 0
+        self.completed = 0
+        self.replayed = 0
+        self.expired = 0
+        self.compactions = 0
+        self._lock = threading.Lock()
+        self._compactor_pid = None
+        self._owner = None
+        self._owner_pid = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum only takes effect if set before the database file is initialized
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                call TEXT NOT NULL,
+                description TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0
+            )""")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        # Outboxes written before leases existed: their 'pending' rows have no owner and are claimable
+        if 'owner' not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN owner TEXT")
+        if 'lease_until' not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, id)")
+
+    @property
+    def owner(self):
+        # Unique per process: a restarted container keeps its hostname and often its
+        # PID, and a forked worker must not share a preloaded parent's identity
+        pid = os.getpid()
+        if self._owner_pid != pid:
+            self._owner = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex}"
+            self._owner_pid = pid
+        return self._owner
+
+    def append(self, recipient, call, description, payload):
+        """Durably record a message about to be sent, leased to this process; returns its outbox id"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (recipient, call, description, payload, status, created, updated, owner, lease_until) "
+                "VALUES (?, ?, ?, ?, 'inflight', ?, ?, ?, ?)",
+                (recipient, call, description, json.dumps(payload, separators=(',', ':'), ensure_ascii=False),
+                 now, now, self.owner, now + self.lease_seconds)
+            )
+            self.appended += 1
+            return cursor.lastrowid
+
+    def mark(self, outbox_id, status):
+        if outbox_id is None:
+            return
+        with self._lock:
+            self._conn.execute("UPDATE outbox SET status = ?, updated = ? WHERE id = ?", (status, time.time(), outbox_id))
+            if status == 'done':
+                self.completed += 1
+
+    def renew_leases(self):
+        """Extend the lease on every row this process still has in flight"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET lease_until = ? WHERE owner = ? AND status = 'inflight'",
+                (now + self.lease_seconds, self.owner)
+            )
+
+    def claim_expired(self):
+        """Atomically take over open rows whose lease ran out, in send order; rows too old to be useful are expired instead"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = 'expired', updated = ? "
+                "WHERE status IN ('pending', 'inflight') AND lease_until < ? AND created < ?",
+                (now, now, now - self.replay_max_age)
+            )
+            self.expired += cursor.rowcount
+            # One statement, so two processes replaying at once can never both claim a row
+            rows = self._conn.execute(
+                "UPDATE outbox SET status = 'inflight', owner = ?, lease_until = ?, updated = ? "
+                "WHERE status IN ('pending', 'inflight') AND lease_until < ? "
+                "RETURNING id, recipient, call, description, payload",
+                (self.owner, now + self.lease_seconds, now, now)
+            ).fetchall()
+        rows.sort(key=lambda row: row[0])
+        return [
+            {'id': row[0], 'recipient': row[1], 'call': row[2], 'description': row[3], 'payload': json.loads(row[4])}
+            for row in rows
+        ]
+
+    def compact(self):
+        """Delete finished rows past the retention window and shrink the WAL"""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE status NOT IN ('pending', 'inflight') AND updated < ?", (cutoff,))
+            # executescript steps the pragma to completion; execute() would free a single page
+            self._conn.executescript("PRAGMA incremental_vacuum;")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.compactions += 1
+
+    def start_compactor(self, interval=OUTBOX_COMPACT_INTERVAL):
+        with self._lock:
+            if self._compactor_pid == os.getpid():
+                return
+            self._compactor_pid = os.getpid()
+        
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact()
+                except Exception as e:
+                    logging.error(f"Error compacting outbox: {e}")
+        
+        threading.Thread(target=run, name="outbox-compactor", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            return {
+                'path': self.path,
+                'rows': counts,
+                'appended': self.appended,
+                'completed': self.completed,
+                'replayed': self.replayed,
+                'expired': self.expired,
+                'compactions': self.compactions,
+                'lease_seconds': self.lease_seconds
+            }
+
+
+def open_outbox():
+    if not OUTBOX_PATH:
+        return None
+    try:
+        return DurableOutbox(OUTBOX_PATH)
+    except Exception as e:
+        logging.error(f"❌ Could not open outbox at {OUTBOX_PATH}, sending without it: {e}")
+        return None
+
+
+OUTBOX = open_outbox()
+if OUTBOX is not None:
+    register_metrics('outbox', OUTBOX.stats)
+
+
+# ===== OUTBOUND SEND SCHEDULER =====
+# Graph API error codes that mean "slow down" even though they come back as HTTP 400
+GRAPH_RATE_LIMIT_ERROR_CODES = ('130429', '131056', '131048')
+
+
+class TokenBucket:
+    """Reservation-based token bucket shared by the sync and async senders"""
+
+    def __init__(self, rate, burst):
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return how many seconds the caller must wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def available(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._updated
+            return round(min(self.burst, self._tokens + elapsed * self.rate), 2)
+
+
+def is_retryable_response(response):
+    """429, 5xx and Graph throughput/pair-rate errors are worth retrying"""
+    if response.status_code == 429 or response.status_code >= 500:
+        return True
+    return response.status_code == 400 and any(code in response.text for code in GRAPH_RATE_LIMIT_ERROR_CODES)
+
+
+def backoff_delay(attempt, response=None):
+    """Full-jitter exponential backoff, honouring Retry-After when Graph sends one"""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), OUTBOUND_BACKOFF_MAX)
+    return random.uniform(0, min(OUTBOUND_BACKOFF_MAX, OUTBOUND_BACKOFF_BASE * (2 ** attempt)))
+
+
+class OutboundScheduler:
+    """Rate-limited, retrying sender for outbound WhatsApp messages.
+
+    Each recipient has its own FIFO lane and at most one message in flight, so
+    a retry never lets a later message overtake an earlier one. Ready lanes sit
+    in a heap ordered by the time they may next send; a shared token bucket
+    smooths bursts to OUTBOUND_RATE_PER_SECOND across all recipients. A message
+    is not retried once retry_window has passed since it was queued, and
+    callers stop waiting for the outcome after send_timeout.
+    """
+
+    def __init__(self, senders=OUTBOUND_SENDERS, max_queue=OUTBOUND_QUEUE_SIZE,
+                 rate=OUTBOUND_RATE_PER_SECOND, burst=OUTBOUND_BURST, max_retries=OUTBOUND_MAX_RETRIES, outbox=None,
+                 retry_window=OUTBOUND_RETRY_WINDOW, send_timeout=OUTBOUND_SEND_TIMEOUT):
+        self.senders = max(1, senders)
+        self.outbox = outbox
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_window = retry_window
+        self.send_timeout = send_timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.lanes = {}
+        self.ready = []
+        self.depth = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.dropped = 0
+        self.wait_timeouts = 0
+        self.send_latency = LatencyHistogram()
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._started_pid = None
+
+    def start(self):
+        """Start this process's sender threads and replay the outbox; cheap once started"""
+        if self._started_pid == os.getpid():
+            return
+        with self._cond:
+            if self._started_pid == os.getpid():
+                return
+            if self._started_pid is not None:
+                # Forked from a started parent: its threads did not come along, and its queued jobs are its own
+                self.lanes, self.ready, self.depth = {}, [], 0
+            for i in range(self.senders):
+                threading.Thread(target=self._run, name=f"outbound-{i}", daemon=True).start()
+            self._started_pid = os.getpid()
+        if self.outbox is not None:
+            self.replay_outbox()
+            self.outbox.start_compactor()
+            threading.Thread(target=self._run_leases, name="outbox-leases", daemon=True).start()
+
+    def replay_outbox(self):
+        """Re-queue messages whose owning process died before sending them"""
+        pending = self.outbox.claim_expired()
+        for row in pending:
+            self.submit(row['recipient'], row['payload'], row['call'], row['description'], outbox_id=row['id'])
+        self.outbox.replayed += len(pending)
+        if pending:
+            logging.info(f"📬 Replaying {len(pending)} pending outbound messages from the outbox")
+
+    def _run_leases(self):
+        # Keep our own rows leased and pick up rows orphaned by a peer that crashed
+        while True:
+            time.sleep(max(1, self.outbox.lease_seconds / 3))
+            try:
+                self.outbox.renew_leases()
+                self.replay_outbox()
+            except Exception as e:
+                logging.error(f"Error renewing outbox leases: {e}")
+
+    def _push_ready(self, recipient, ready_at):
+        self._seq += 1
+        heapq.heappush(self.ready, (ready_at, self._seq, recipient))
+        self._cond.notify()
+
+    def submit(self, to_phone, payload, call, description, outbox_id=None):
+        """Queue a message; returns a Future resolving to True once Graph accepted it"""
+        self.start()
+        if outbox_id is None and self.outbox is not None:
+            outbox_id = self.outbox.append(to_phone, call, description, payload)
+        future = Future()
+        job = {'payload': payload, 'call': call, 'description': description, 'outbox_id': outbox_id,
+               'attempts': 0, 'future': future, 'enqueued_at': time.monotonic()}
+        with self._cond:
+            if self.depth >= self.max_queue:
+                self.dropped += 1
+                logging.error(f"❌ Outbound queue full, dropping {description}")
+                if self.outbox is not None:
+                    self.outbox.mark(outbox_id, 'dropped')
+                future.set_result(False)
+                return future
+            self.depth += 1
+            lane = self.lanes.get(to_phone)
+            if lane is None:
+                self.lanes[to_phone] = collections.deque([job])
+                self._push_ready(to_phone, time.monotonic())
+            else:
+                lane.append(job)
+        return future
+
+    def _next_ready(self):
+        with self._cond:
+            while True:
+                if self.ready:
+                    ready_at, _, recipient = self.ready[0]
+                    wait = ready_at - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self.ready)
+                        return recipient, self.lanes[recipient][0]
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _finish(self, recipient, job, ok):
+        with self._cond:
+            lane = self.lanes[recipient]
+            lane.popleft()
+            self.depth -= 1
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            if lane:
+                self._push_ready(recipient, time.monotonic())
+            else:
+                del self.lanes[recipient]
+        if self.outbox is not None:
+            self.outbox.mark(job['outbox_id'], 'done' if ok else 'failed')
+        self.send_latency.observe(time.monotonic() - job['enqueued_at'])
+        job['future'].set_result(ok)
+
+    def _retry_later(self, recipient, job, response=None):
+        """Schedule another attempt; False when it would fall outside the retry window"""
+        delay = backoff_delay(job['attempts'], response)
+        retry_at = time.monotonic() + delay
+        if retry_at > job['enqueued_at'] + self.retry_window:
+            logging.error(f"❌ Giving up on {job['description']} after {job['attempts'] + 1} attempt(s): retry window used up")
+            return False
+        job['attempts'] += 1
+        with self._cond:
+            self.retries += 1
+            self._push_ready(recipient, retry_at)
+        logging.warning(f"⏳ Retrying {job['description']} in {delay:.1f}s (attempt {job['attempts']})")
+        return True
+
+    def _run(self):
+        while True:
+            recipient, job = self._next_ready()
+            self.bucket.acquire()
+            try:
+                response = GRAPH_API.post_message(job['payload'], job['call'])
+            except Exception as e:
+                logging.error(f"❌ Error sending {job['description']}: {e}")
+                response = None
+            
+            if response is not None and response.status_code == 200:
+                logging.info(f"✅ {job['description']} sent")
+                self._finish(recipient, job, True)
+            elif (job['attempts'] < self.max_retries and (response is None or is_retryable_response(response))
+                    and self._retry_later(recipient, job, response)):
+                continue
+            else:
+                if response is not None:
+                    logging.error(f"❌ Failed to send {job['description']}: {response.status_code} - {response.text}")
+                self._finish(recipient, job, False)
+
+    def _timed_out(self, description):
+        # The message stays queued and may still go out; the caller just stops waiting
+        with self._cond:
+            self.wait_timeouts += 1
+        logging.error(f"❌ No outcome for {description} within {self.send_timeout}s, treating it as failed")
         return False
 
+    def send(self, to_phone, payload, call, description):
+        """Queue a message and wait up to send_timeout for the outcome; True once Graph accepted it"""
+        try:
+            return self.submit(to_phone, payload, call, description).result(timeout=self.send_timeout)
+        except FutureTimeoutError:
+            return self._timed_out(description)
+
+    async def asend(self, to_phone, payload, call, description):
+        """send() for the ASGI runtime: same lanes, queue limit and retries, awaited without blocking the loop"""
+        outbox_id = None
+        if self.outbox is not None:
+            outbox_id = await asyncio.to_thread(self.outbox.append, to_phone, call, description, payload)
+        future = self.submit(to_phone, payload, call, description, outbox_id=outbox_id)
+        try:
+            # shield() keeps a timeout or cancelled handler from cancelling the queued job itself
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.send_timeout)
+        except asyncio.TimeoutError:
+            return self._timed_out(description)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': self.depth,
+                'queue_capacity': self.max_queue,
+                'active_recipients': len(self.lanes),
+                'sent': self.sent,
+                'retries': self.retries,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'wait_timeouts': self.wait_timeouts,
+                'tokens_available': self.bucket.available(),
+                'rate_per_second': self.bucket.rate,
+                'send_seconds': self.send_latency.snapshot()
+            }
+
+
+OUTBOUND = OutboundScheduler(outbox=OUTBOX)
+register_metrics('outbound', OUTBOUND.stats)
+
+
+def send_graph_message(to_phone, payload, call, description):
+    """Send a message through the outbound scheduler and wait for the outcome; True once delivered to Graph"""
+    return OUTBOUND.send(to_phone, payload, call, description)
+
+
+def send_whatsapp_text(to_phone, message):
+    """Send a text message via WhatsApp Cloud API"""
+    return send_graph_message(to_phone, text_message_payload(to_phone, message), 'text', f"Message to {to_phone}")
+    
+def send_whatsapp_location(to_phone):
+    """Send Google Maps location via WhatsApp Cloud API"""
+    return send_graph_message(to_phone, location_message_payload(to_phone), 'location', f"Location to {to_phone}")
+
 
 
 # def send_whatsapp_document(to_phone, document_id, caption="Here is your Brookstone Brochure 📄"):
@@ -152,58 +1410,272 @@ def send_whatsapp_location(to_phone):
 #         return False
 
 def send_whatsapp_document(to_phone, caption="Here is your Brookstone Brochure 📄"):
-    """Send WhatsApp document (PDF brochure) directly from static folder via public URL"""
-    url = f"https://graph.facebook.com/v23.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
+    """Send WhatsApp document (PDF brochure), by uploaded media ID when the PDF is available locally"""
+    if os.path.exists(BROCHURE_PATH):
+        return send_uploaded_document(to_phone, BROCHURE_PATH, caption)
+    # Without a local copy: a configured media ID, else the public brochure link
+    return send_graph_message(to_phone, document_message_payload(to_phone, caption, BROCHURE_MEDIA_ID), 'document', f"Document to {to_phone}")
 
-    # The file must be publicly accessible by WhatsApp (i.e., via HTTPS)
-    brochure_url = "https://your-domain.com/static/Brookstone.pdf"  # 👈 Replace with your actual deployed URL
 
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to_phone,
-        "type": "document",
-        "document": {
-            "link": brochure_url,
-            "caption": caption,
-            "filename": "Brookstone.pdf"
-        }
-    }
-
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
-        if response.status_code == 200:
-            logging.info(f"✅ Document sent to {to_phone}")
+def send_uploaded_document(to_phone, path, caption):
+    """Send a local PDF by media ID, re-uploading once if WhatsApp rejects a cached ID"""
+    description = f"Document {os.path.basename(path)} to {to_phone}"
+    for attempt in range(2):
+        try:
+            media_id, fresh = MEDIA.media_id(path)
+        except Exception as e:
+            logging.error(f"❌ Could not upload {path}: {e}")
+            return False
+        payload = document_message_payload(to_phone, caption, media_id, os.path.basename(path))
+        if send_graph_message(to_phone, payload, 'document', description):
             return True
-        else:
-            logging.error(f"❌ Failed to send document: {response.status_code} - {response.text}")
+        if fresh or attempt:
             return False
-    except Exception as e:
-        logging.error(f"❌ Error sending document: {e}")
-        return False
+        # A cached ID may have lapsed on WhatsApp's side; upload again and retry once
+        logging.warning(f"🔄 Re-uploading {path} after failed send with cached media ID")
+        MEDIA.invalidate(path)
+    return False
 
 
 
 def mark_message_as_read(message_id):
     """Mark a WhatsApp message as read"""
-    url = f"https://graph.facebook.com/v23.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "messaging_product": "whatsapp",
-        "status": "read",
-        "message_id": message_id
-    }
-    
     try:
-        requests.post(url, headers=headers, json=payload, timeout=10)
+        response = GRAPH_API.post_message(read_receipt_payload(message_id), 'read_receipt')
+        return response.status_code == 200
     except Exception as e:
         logging.error(f"Error marking message as read: {e}")
+        return False
+
+
+class ReadReceiptSender:
+    """Fire-and-forget read receipts, coalesced to the newest message per conversation.
+
+    Marking the latest message read marks everything before it, so a burst of
+    messages from one user costs a single Graph call. Receipts wait up to
+    READ_RECEIPT_DELAY seconds to coalesce and are sent by a background thread.
+    """
+
+    def __init__(self, delay=READ_RECEIPT_DELAY):
+        self.delay = delay
+        self.pending = collections.OrderedDict()
+        self.requested = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.failed = 0
+        self._cond = threading.Condition()
+        self._started = False
+
+    def mark(self, from_phone, message_id):
+        """Queue a read receipt; never blocks"""
+        if not message_id:
+            return
+        with self._cond:
+            if not self._started:
+                threading.Thread(target=self._run, name="read-receipts", daemon=True).start()
+                self._started = True
+            self.requested += 1
+            if from_phone in self.pending:
+                self.coalesced += 1
+            self.pending[from_phone] = message_id
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.pending:
+                    self._cond.wait()
+            # Give a burst a moment to collapse into one receipt
+            time.sleep(self.delay)
+            with self._cond:
+                batch = list(self.pending.values())
+                self.pending.clear()
+            for message_id in batch:
+                ok = mark_message_as_read(message_id)
+                with self._cond:
+                    if ok:
+                        self.sent += 1
+                    else:
+                        self.failed += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self.pending),
+                'requested': self.requested,
+                'coalesced': self.coalesced,
+                'sent': self.sent,
+                'failed': self.failed
+            }
+
+
+READ_RECEIPTS = ReadReceiptSender()
+register_metrics('read_receipts', READ_RECEIPTS.stats)
+
+
+# ===== MEDIA UPLOAD CACHE =====
+MEDIA_MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.webp': 'image/webp'
+}
+
+
+class MediaManager:
+    """Uploads local assets to WhatsApp once and caches their media IDs until shortly before expiry.
+
+    The cache is persisted to MEDIA_CACHE_PATH so restarts reuse existing IDs;
+    an entry is also dropped when the local file changes (mtime or size).
+    Concurrent requests for the same file share a single upload.
+    """
+
+    def __init__(self, cache_path=MEDIA_CACHE_PATH, ttl=MEDIA_TTL_SECONDS, refresh_margin=MEDIA_REFRESH_MARGIN):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.hits = 0
+        self.uploads = 0
+        self.upload_failures = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._refresher_started = False
+        self._uploading = {}
+        self._entries = self._load()
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading media cache: {e}")
+            return {}
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _is_fresh(self, entry, stat):
+        return (entry['expires_at'] - self.refresh_margin > time.time()
+                and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size)
+
+    def upload(self, path):
+        """Upload a local file to WhatsApp and cache the returned media ID"""
+        stat = os.stat(path)
+        mime_type = MEDIA_MIME_TYPES.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+        with open(path, 'rb') as f:
+            response = GRAPH_API.post(
+                WHATSAPP_MEDIA_URL,
+                'media_upload',
+                data={'messaging_product': 'whatsapp', 'type': mime_type},
+                files={'file': (os.path.basename(path), f, mime_type)}
+            )
+        if response.status_code != 200 or 'id' not in response.json():
+            with self._lock:
+                self.upload_failures += 1
+            raise RuntimeError(f"media upload failed: {response.status_code} - {response.text}")
+        
+        entry = {
+            'id': response.json()['id'],
+            'uploaded_at': time.time(),
+            'expires_at': time.time() + self.ttl,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size
+        }
+        with self._lock:
+            self._entries[path] = entry
+            self.uploads += 1
+            self._save()
+        logging.info(f"📤 Uploaded {path} as media {entry['id']}")
+        return entry['id']
+
+    def media_id(self, path):
+        """Return (media_id, freshly_uploaded) for a local asset, uploading when needed"""
+        self.start_refresher()
+        return self._upload_once(path, reuse_fresh=True)
+
+    def _upload_once(self, path, reuse_fresh=False):
+        """(media_id, freshly_uploaded), joining an upload of the same path that is already in flight"""
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if reuse_fresh and entry and self._is_fresh(entry, stat):
+                self.hits += 1
+                return entry['id'], False
+            pending = self._uploading.get(path)
+            leader = pending is None
+            if leader:
+                pending = self._uploading[path] = Future()
+        if not leader:
+            return pending.result(), True
+        try:
+            media_id = self.upload(path)
+            pending.set_result(media_id)
+            return media_id, True
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._uploading.pop(path, None)
+
+    def invalidate(self, path):
+        with self._lock:
+            if self._entries.pop(path, None) is not None:
+                self.invalidations += 1
+                self._save()
+
+    def refresh_expiring(self):
+        """Re-upload cached assets that are about to lapse"""
+        with self._lock:
+            paths = list(self._entries)
+        for path in paths:
+            try:
+                with self._lock:
+                    entry = self._entries.get(path)
+                if entry is None:
+                    continue
+                if not os.path.exists(path):
+                    self.invalidate(path)
+                elif not self._is_fresh(entry, os.stat(path)):
+                    self._upload_once(path)
+            except Exception as e:
+                logging.error(f"Error refreshing media {path}: {e}")
+
+    def start_refresher(self, interval=3600):
+        with self._lock:
+            if self._refresher_started:
+                return
+            self._refresher_started = True
+        
+        def run():
+            while True:
+                time.sleep(interval)
+                self.refresh_expiring()
+        
+        threading.Thread(target=run, name="media-refresher", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached': {path: {'id': e['id'], 'expires_in': int(e['expires_at'] - time.time())}
+                           for path, e in self._entries.items()},
+                'hits': self.hits,
+                'uploads': self.uploads,
+                'upload_failures': self.upload_failures,
+                'invalidations': self.invalidations
+            }
+
+
+MEDIA = MediaManager()
+register_metrics('media', MEDIA.stats)
 
 
 # ===== GOOGLE SHEETS FUNCTIONS =====
@@ -227,51 +1699,15 @@ def get_google_creds():
         logging.error(f"Error creating Google credentials: {e}")
         return None
 
-def check_new_bookings():
-    """Check for new entries in the Google Sheet and send confirmation messages"""
-    try:
-        # Get credentials from environment
-        creds = get_google_creds()
-        if not creds:
-            logging.error("Failed to get Google credentials")
-            return False
-        
-        client = gspread.authorize(creds)
-        
-        # Open the site visits sheet
-        sheet = client.open(SITE_VISITS_SHEET_NAME).sheet1
-        
-        # Get all records
-        all_records = sheet.get_all_records()
-        
-        for record in all_records:
-            # Check if this is a new record that hasn't been processed
-            if not record.get('Status'):  # New form submissions won't have a status
-                phone = record.get('Phone')
-                name = record.get('Name')
-                date = record.get('Preferred Date')
-                time = record.get('Preferred Time')
-                unit = record.get('Unit Type')
-                budget = record.get('Budget')
-                
-                # Format phone number if needed
-                if phone:
-                    # Remove any spaces, dashes or special characters
-                    phone = re.sub(r'[^0-9+]', '', phone)
-                    # Add +91 if not present and it's a 10-digit number
-                    if len(phone) == 10 and not phone.startswith('+'):
-                        phone = f"+91{phone}"
-                
-                if phone and name and date and time:
-                    # Format the confirmation message
-                    message = f"""🎉 *Site Visit Booking Confirmed!*
+def booking_confirmation_message(name, date, visit_time, unit, budget):
+    return f"""🎉 *Site Visit Booking Confirmed!*
 
 Dear {name},
 
 Thank you for booking a site visit at Brookstone. Your appointment details:
 
 📅 Date: {date}
-⏰ Time: {time}
+⏰ Time: {visit_time}
 🏠 Unit Interest: {unit}
 💰 Budget Range: {budget}
 
@@ -288,418 +1724,2031 @@ Looking forward to showing you your future home! 🌟
 
 _Note: You'll receive a reminder message 1 day before your visit._"""
 
-                    # Send WhatsApp confirmation
-                    if send_whatsapp_text(phone, message):
-                        # Update status to confirmed
-                        row_num = all_records.index(record) + 2  # +2 because sheet is 1-indexed and we have header row
-                        sheet.update_cell(row_num, sheet.find('Status').col, 'Confirmed')
-                        logging.info(f"✅ Site visit confirmed for {name} on {date} at {time}")
-                    else:
-                        sheet.update_cell(row_num, sheet.find('Status').col, 'Pending - WhatsApp Failed')
+
+class BookingSheetReader:
+    """Reads site visit bookings from the sheet incrementally and confirms new ones on WhatsApp.
+
+    The authorized client, worksheet and header-to-column map are kept between
+    checks and rebuilt after an error. The cursor file remembers the next unread
+    row, so a check only fetches rows appended since the last one, batch_rows at a
+    time. Rows still missing details are re-read with the new rows for up to
+    pending_ttl, in case they are being filled in by hand. Rows are assumed to be
+    appended by the booking form and never reordered or deleted.
+    """
+
+    def __init__(self, sheet_name=SITE_VISITS_SHEET_NAME, cursor_path=BOOKING_CURSOR_PATH,
+                 batch_rows=BOOKING_READ_BATCH, pending_ttl=BOOKING_PENDING_TTL):
+        self.sheet_name = sheet_name
+        self.cursor_path = cursor_path
+        self.batch_rows = batch_rows
+        self.pending_ttl = pending_ttl
+        self._lock = threading.Lock()
+        self._client = None
+        self._sheet = None
+        self.columns = {}
+        self.width = 0
+        cursor = self._load()
+        self.sheet_id = cursor.get('sheet_id')
+        self.next_row = cursor.get('next_row', 2)
+        self.pending = {int(row): first_seen for row, first_seen in cursor.get('pending', {}).items()}
+        self.checks = 0
+        self.authorizations = 0
+        self.reads = 0
+        self.rows_read = 0
+        self.confirmed = 0
+        self.whatsapp_failed = 0
+        self.errors = 0
+        self.last_check_seconds = None
+
+    def _load(self):
+        if not self.cursor_path or not os.path.exists(self.cursor_path):
+            return {}
+        try:
+            with open(self.cursor_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading booking cursor: {e}")
+            return {}
+
+    def _save(self):
+        if not self.cursor_path:
+            return
+        cursor = {'sheet_id': self.sheet_id, 'next_row': self.next_row, 'pending': self.pending}
+        tmp_path = f"{self.cursor_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cursor, f)
+        os.replace(tmp_path, self.cursor_path)
+
+    def _connect(self):
+        if self._client is None:
+            creds = get_google_creds()
+            if not creds:
+                raise RuntimeError("Failed to get Google credentials")
+            self._client = gspread.authorize(creds)
+            self.authorizations += 1
+        if self._sheet is None:
+            sheet = self._client.open(self.sheet_name).sheet1
+            header = sheet.row_values(1)
+            self.reads += 1
+            columns = {name.strip(): col for col, name in enumerate(header, 1) if name.strip()}
+            if 'Status' not in columns:
+                raise RuntimeError(f"'{self.sheet_name}' has no Status column")
+            sheet_id = f"{sheet.spreadsheet_id}:{sheet.id}"
+            if sheet_id != self.sheet_id:
+                # A different sheet (or no cursor yet): scan it from the first data row once
+                logging.info(f"📋 Reading bookings from '{self.sheet_name}' starting at row 2")
+                self.sheet_id, self.next_row, self.pending = sheet_id, 2, {}
+            self._sheet, self.columns, self.width = sheet, columns, len(header)
+        return self._sheet
+
+    def _read(self, sheet, rows):
+        """Fetch the given (first_row, last_row) ranges in one API call; a list of row lists per range"""
+        ranges = [f"A{first}:{gspread.utils.rowcol_to_a1(last, self.width)}" for first, last in rows]
+        values = sheet.batch_get(ranges)
+        self.reads += 1
+        self.rows_read += sum(len(value_range) for value_range in values)
+        return values
+
+    def _handle(self, sheet, row_num, row):
+        record = {name: (row[col - 1] if col <= len(row) else '') for name, col in self.columns.items()}
+        if str(record['Status']).strip():
+            self.pending.pop(row_num, None)
+            return
         
-        return True
-    
-    except Exception as e:
-        logging.error(f"Error checking new bookings: {e}")
-        return False
+        name = record.get('Name')
+        date = record.get('Preferred Date')
+        visit_time = record.get('Preferred Time')
+        # Remove any spaces, dashes or special characters, and add +91 to 10-digit numbers
+        phone = re.sub(r'[^0-9+]', '', str(record.get('Phone') or ''))
+        if len(phone) == 10 and not phone.startswith('+'):
+            phone = f"+91{phone}"
+        
+        if not (phone and name and date and visit_time):
+            if any(str(value).strip() for value in row):
+                self.pending.setdefault(row_num, time.time())
+            return
+        
+        self.pending.pop(row_num, None)
+        message = booking_confirmation_message(name, date, visit_time, record.get('Unit Type'), record.get('Budget'))
+        sent = send_whatsapp_text(phone, message)
+        # Persist that this row is done before touching the sheet, so a failed
+        # status write cannot make the next check send the confirmation again
+        self.next_row = max(self.next_row, row_num + 1)
+        self._save()
+        if sent:
+            sheet.update_cell(row_num, self.columns['Status'], 'Confirmed')
+            self.confirmed += 1
+            logging.info(f"✅ Site visit confirmed for {name} on {date} at {visit_time}")
+        else:
+            sheet.update_cell(row_num, self.columns['Status'], 'Pending - WhatsApp Failed')
+            self.whatsapp_failed += 1
+
+    def _pending_rows(self):
+        """Incomplete rows still worth re-reading, dropping those older than pending_ttl"""
+        now = time.time()
+        self.pending = {row: first_seen for row, first_seen in self.pending.items()
+                        if now - first_seen <= self.pending_ttl and row < self.next_row}
+        return sorted(self.pending)
+
+    def check(self):
+        """Confirm the bookings added since the last check; False if the sheet could not be read"""
+        with self._lock:
+            started = time.monotonic()
+            self.checks += 1
+            try:
+                sheet = self._connect()
+                recheck = self._pending_rows()
+                while True:
+                    # Incomplete rows ride along with the first read of new rows
+                    first = self.next_row
+                    values = self._read(sheet, [(row, row) for row in recheck] + [(first, first + self.batch_rows - 1)])
+                    for row_num, value_range in zip(recheck, values):
+                        self._handle(sheet, row_num, value_range[0] if value_range else [])
+                    recheck = []
+                    rows = values[-1]
+                    for offset, row in enumerate(rows):
+                        self._handle(sheet, first + offset, row)
+                    self.next_row = first + len(rows)
+                    self._save()
+                    # The API drops trailing empty rows, so a short batch is the end of the sheet
+                    if len(rows) < self.batch_rows:
+                        break
+                return True
+            except Exception as e:
+                self.errors += 1
+                self._client = self._sheet = None
+                logging.error(f"Error checking new bookings: {e}")
+                return False
+            finally:
+                self.last_check_seconds = round(time.monotonic() - started, 3)
+
+    def stats(self):
+        # Lock-free on purpose: check() holds the lock across sheet reads and sends
+        return {
+            'sheet': self.sheet_name,
+            'next_row': self.next_row,
+            'pending_rows': len(self.pending),
+            'checks': self.checks,
+            'authorizations': self.authorizations,
+            'reads': self.reads,
+            'rows_read': self.rows_read,
+            'confirmed': self.confirmed,
+            'whatsapp_failed': self.whatsapp_failed,
+            'errors': self.errors,
+            'last_check_seconds': self.last_check_seconds
+        }
+
+
+BOOKINGS = BookingSheetReader()
+register_metrics('bookings', BOOKINGS.stats)
+
+
+def check_new_bookings():
+    """Check for new entries in the Google Sheet and send confirmation messages"""
+    return BOOKINGS.check()
 
 
 def extract_budget_from_text(text):
-    """Extract budget information from user text"""
-    patterns = [
-        r'(\d+\.?\d*)\s*(?:cr|crore|crores)',
-        r'(\d+\.?\d*)\s*(?:lakh|lakhs)',
-        r'₹\s*(\d+\.?\d*)\s*(?:cr|crore|crores)',
-        r'₹\s*(\d+\.?\d*)\s*(?:lakh|lakhs)',
-    ]
-    
-    text_lower = text.lower()
-    
-    for pattern in patterns:
-        match = re.search(pattern, text_lower)
-        if match:
-            amount = float(match.group(1))
-            if 'cr' in pattern or 'crore' in pattern:
-                return f"{amount} Cr"
-            elif 'lakh' in pattern:
-                return f"{amount} Lakh"
-    
-    return None
+    """Extract budget information from user text (an amount in crores wins over one in lakhs)"""
+    return INTENT_ROUTER.route(text).budget
 
 
 # ===== GEMINI AI LOGIC (from appq_gemini.py) =====
-def extract_relevant_data(user_question, faq_data, language='english'):
-    """Extract only relevant data based on user question to reduce API payload"""
-    lang_data = faq_data.get(language, faq_data.get('english', {}))
+# Keyword rules for extract_relevant_data, compiled once into a single matcher.
+# A topic matches when any of its keywords occurs anywhere in the lowercased question.
+RELEVANCE_TOPICS = {
+    'ground_or_unit': [
+        # Ground floor and general facility queries
+        'ground floor', 'ground level', 'ground', 'facility', 'amenity',
+        'foyer', 'entrance', 'gym', 'library', 'toddler', 'children', 'play',
+        'lift', 'elevator', 'stair', 'parking', 'society office', 'reception',
+        'ગ્રાઉન્ડ', 'નીચલો માળ', 'ફોયર', 'પ્રવેશ', 'જીમ', 'લાઇબ્રેરી',
+        'બાળકો', 'રમત', 'લિફ્ટ', 'એલિવેટર', 'સીડી', 'પાર્કિંગ',
+        'સોસાયટી ઓફિસ', 'રિસેપ્શન', 'સુવિધા',
+        # Flat configurations
+        '3bhk', '3 bhk', '3-bhk', 'three bedroom', 'three bed',
+        '4bhk', '4 bhk', '4-bhk', 'four bedroom', 'four bed',
+        'ત્રણ બેડરૂમ', '૩ બીએચકે', 'ત્રણ બીએચકે',
+        'ચાર બેડરૂમ', '૪ બીએચકે', 'ચાર બીએચકે'
+    ],
+    'unit_3bhk': ['3bhk', '3 bhk', '3-bhk', 'three bedroom', 'ત્રણ બેડરૂમ', '૩ બીએચકે', 'ત્રણ બીએચકે'],
+    'unit_4bhk': ['4bhk', '4 bhk', '4-bhk', 'four bedroom', 'ચાર બેડરૂમ', '૪ બીએચકે', 'ચાર બીએચકે'],
+    'ground_floor': ['ground floor', 'ground level', 'ground', 'foyer', 'entrance', 'multipurpose', 'court', 'gym',
+                     'library', 'toddler', 'society', 'seating', 'lift', 'stair', 'amenity', 'facility', 'drop'],
+    'block_a': ['block a', 'society', 'toddler', 'right side', 'security'],
+    'block_b': ['block b', 'gym', 'library', 'left side'],
+    'central_amenities': ['central', 'amenity', 'court', 'sand pit', 'lawn', 'facility', 'fountain'],
+    'unit_details': ['3bhk', '3 bhk', 'price', 'cost', 'bhk', 'bedroom', 'size', 'sqft', 'configuration',
+                     'apartment', 'flat', 'carpet', 'area', 'dimension'],
+    '3bhk_details': ['3bhk', '3 bhk', 'carpet'],
+    '4bhk_details': ['4bhk', '4 bhk', 'carpet'],
+    'rooms': ['kitchen', 'room', 'bedroom', 'living', 'dining', 'bathroom', 'toilet', 'balcony'],
+    'elevator': ['elevator', 'lift'],
+    'parking': ['parking', 'car park', 'vehicle'],
+    'parking_or_cars': ['parking', 'car park', 'vehicle', 'cars'],
+    'specifications': ['structure', 'flooring', 'bathroom', 'kitchen', 'elevator', 'electrical', 'doors', 'windows',
+                       'security', 'water', 'specifications', 'features'],
+    'construction_specifications': ['structure', 'flooring', 'bathroom', 'kitchen', 'electrical', 'doors', 'windows',
+                                    'security', 'water', 'specifications', 'features'],
+    'amenities': ['amenity', 'amenities', 'facility', 'gym', 'pool', 'park', 'club'],
+    'location': ['location', 'address', 'connectivity', 'metro', 'nearby', 'landmark'],
+    'possession': ['possession', 'ready', 'completion', 'timeline', 'delivery'],
+    'developer': ['developer', 'shatranj', 'aarat', 'group', 'company', 'builder']
+}
+
+
+def trie_regex(words):
+    """Regex alternation for words, factored into a trie so matching never backtracks across siblings.
+
+    At every node the longer continuation is tried first, so a match is always the
+    longest word starting at that position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if '' in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Finds every topic whose keywords occur in a text with one regex scan.
+
+    The keywords are compiled into a trie regex inside a lookahead, so each text
+    position yields the longest keyword starting there. Keywords that are prefixes
+    of that match are credited as well, which keeps plain `keyword in text` semantics.
+    """
+
+    def __init__(self, topics):
+        keyword_topics = collections.defaultdict(set)
+        for topic, keywords in topics.items():
+            for keyword in keywords:
+                keyword_topics[keyword].add(topic)
+        self.credit = {
+            keyword: frozenset().union(*(t for other, t in keyword_topics.items() if keyword.startswith(other)))
+            for keyword in keyword_topics
+        }
+        self.pattern = re.compile(f"(?=({trie_regex(keyword_topics)}))")
+
+    def match(self, text):
+        """Set of matched topic names"""
+        credit = self.credit
+        return set().union(*(credit[keyword] for keyword in set(self.pattern.findall(text))))
+
+
+RELEVANCE_MATCHER = KeywordMatcher(RELEVANCE_TOPICS)
+
+
+def extract_relevant_data(user_question, language='english', broad_fallback=True, store=None):
+    """Extract only relevant data based on user question to reduce API payload.
+
+    Values are pre-serialized fragments from the section store of the current FAQ
+    snapshot (or the given store).
+    """
+    store = store or FAQ.store
+    sections = store.sections(language)
+    views = store.views(language)
     relevant_data = {}
     user_question_lower = user_question.lower()
     
     # Always include basic project info
-    if 'project_info' in lang_data:
-        relevant_data['project_info'] = lang_data['project_info']
+    if 'project_info' in sections:
+        relevant_data['project_info'] = sections['project_info']
         
-    # Check for ground floor and general facility queries
-    ground_floor_keywords = [
-        'ground floor', 'ground level', 'ground', 'facility', 'amenity', 
-        'foyer', 'entrance', 'gym', 'library', 'toddler', 'children', 'play',
-        'lift', 'elevator', 'stair', 'parking', 'society office', 'reception'
-    ]
-    
-    # Convert to Gujarati keywords for better matching
-    gujarati_keywords = [
-        'ગ્રાઉન્ડ', 'નીચલો માળ', 'ફોયર', 'પ્રવેશ', 'જીમ', 'લાઇબ્રેરી', 
-        'બાળકો', 'રમત', 'લિફ્ટ', 'એલિવેટર', 'સીડી', 'પાર્કિંગ', 
-        'સોસાયટી ઓફિસ', 'રિસેપ્શન', 'સુવિધા'
-    ]
-    
-    # Add keywords for flat configurations
-    flat_keywords = [
-        '3bhk', '3 bhk', '3-bhk', 'three bedroom', 'three bed', 
-        '4bhk', '4 bhk', '4-bhk', 'four bedroom', 'four bed'
-    ]
+    topics = RELEVANCE_MATCHER.match(user_question_lower)
     
-    # Gujarati flat keywords
-    gujarati_flat_keywords = [
-        'ત્રણ બેડરૂમ', '૩ બીએચકે', 'ત્રણ બીએચકે',
-        'ચાર બેડરૂમ', '૪ બીએચકે', 'ચાર બીએચકે'
-    ]
-    
-    all_keywords = ground_floor_keywords + gujarati_keywords + flat_keywords + gujarati_flat_keywords
-    
-    if any(word in user_question_lower for word in all_keywords):
-        if any(k in user_question_lower for k in ['3bhk', '3 bhk', '3-bhk', 'three bedroom', 'ત્રણ બેડરૂમ', '૩ બીએચકે', 'ત્રણ બીએચકે']):
-            if '3bhk_unit_plan' in lang_data:
-                relevant_data['unit_plan'] = lang_data['3bhk_unit_plan']
-                relevant_data['pricing'] = {'3bhk': lang_data.get('pricing', {}).get('box_price_2650')}
-                relevant_data['parking'] = {'3bhk': lang_data.get('parking', {}).get('3bhk_parking')}
+    if 'ground_or_unit' in topics:
+        for unit in ('3bhk', '4bhk'):
+            if f'unit_{unit}' in topics:
+                if f'{unit}_unit_plan' in sections:
+                    relevant_data['unit_plan'] = views[f'unit_plan_{unit}']
+                    relevant_data['pricing'] = views[f'pricing_{unit}']
+                    relevant_data['parking'] = views[f'parking_{unit}']
+                break
         
-        elif any(k in user_question_lower for k in ['4bhk', '4 bhk', '4-bhk', 'four bedroom', 'ચાર બેડરૂમ', '૪ બીએચકે', 'ચાર બીએચકે']):
-            if '4bhk_unit_plan' in lang_data:
-                relevant_data['unit_plan'] = lang_data['4bhk_unit_plan']
-                relevant_data['pricing'] = {'4bhk': lang_data.get('pricing', {}).get('box_price_3850')}
-                relevant_data['parking'] = {'4bhk': lang_data.get('parking', {}).get('4bhk_parking')}
-        
-        if 'ground_floor_plan' in lang_data:
-            relevant_data['ground_floor_plan'] = lang_data['ground_floor_plan']
-        if 'construction_specifications' in lang_data and 'elevator' in lang_data['construction_specifications']:
-            relevant_data['elevator'] = lang_data['construction_specifications']['elevator']
+        if 'ground_floor_plan' in sections:
+            relevant_data['ground_floor_plan'] = sections['ground_floor_plan']
+        if 'elevator' in views:
+            relevant_data['elevator'] = views['elevator']
     
     # Check for ground floor related queries
-    if any(word in user_question_lower for word in ['ground floor', 'ground level', 'ground', 'foyer', 'entrance', 'multipurpose', 'court', 'gym', 'library', 'toddler', 'society', 'seating', 'lift', 'stair', 'amenity', 'facility', 'drop']):
-        if 'ground_floor_plan' in lang_data:
-            # Add overall ground floor summary
-            relevant_data['ground_floor_summary'] = lang_data['ground_floor_plan'].get('summary', '')
-            relevant_data['ground_floor_overview'] = lang_data['ground_floor_plan'].get('site_overview', {})
-            
-            # Always include zone-specific details for comprehensive ground floor queries
-            block_a_zone = lang_data['ground_floor_plan'].get('block_a_zone', {})
-            block_b_zone = lang_data['ground_floor_plan'].get('block_b_zone', {})
-            central_zone = lang_data['ground_floor_plan'].get('central_amenities', {})
-            
-            # Right Side (Block A Zone) Details
-            if 'block a' in user_question_lower or any(word in user_question_lower for word in ['society', 'toddler', 'right side', 'security']):
-                relevant_data['block_a_zone'] = {
-                    'foyer': {
-                        'size': '14\'-9\" × 14\'-6\"',
-                        'function': 'Entry point into Block A',
-                        'features': 'Staircases (UP & DN) on both sides'
-                    },
-                    'lift_lobby': {
-                        'size': '8\'-5\" × 6\'-8\"',
-                        'lifts_count': '2 lifts'
-                    },
-                    'seating_space': {
-                        'size': '44\'-0\" × 21\'-7\"',
-                        'function': 'Large sitting lounge outside Block A'
-                    },
-                    'society_office': {
-                        'size': '10\'-3\" × 16\'-3\"',
-                        'location': 'Beside the seating lounge'
-                    },
-                    'store_society': {
-                        'size': '10\'-3\" × 5\'-0\"',
-                        'location': 'Near the Society Office'
-                    },
-                    'toddlers_space': {
-                        'size': '16\'-4\" × 15\'-9\"',
-                        'function': 'Play area for toddlers'
-                    },
-                    'store_toddlers': {
-                        'size': '11\'-0\" × 5\'-7\"',
-                        'location': 'Near the Toddler\'s Space'
-                    },
-                    'toilet_toddlers': {
-                        'size': '6\'-0\" × 6\'-7\"',
-                        'location': 'Near the Toddler\'s Space'
-                    },
-                    'other_utilities': {
-                        'security': 'Security Cabin with toilet at entry/exit gate',
-                        'meter_room': 'Dedicated space for electrical meters',
-                        'parking': 'Car parking spaces available',
-                        'drop_off': 'Kids drop-off area',
-                        'ramp': 'Basement ramp near Block A foyer',
-                        'water_feature': 'Decorative water body beside walkway'
-                    }
-                }
-            
-            # Left Side (Block B Zone) Details
-            if 'block b' in user_question_lower or any(word in user_question_lower for word in ['gym', 'library', 'left side']):
-                relevant_data['block_b_zone'] = {
-                    'foyer': {
-                        'size': '14\'-0\" × 19\'-6\"',
-                        'function': 'Entry point into Block B',
-                        'features': 'Staircases (UP & DN) on both sides'
-                    },
-                    'lift_lobby': {
-                        'size': '6\'-8\" × 8\'-0\"',
-                        'lifts_count': '2 lifts'
-                    },
-                    'gym': {
-                        'size': '17\'-9\" × 19\'-3\"',
-                        'function': 'Fitness and exercise area'
-                    },
-                    'library_lounge': {
-                        'size': '18\'-9\" × 26\'-5\"',
-                        'function': 'Library, Lounge, and Multi-Purpose Room'
-                    },
-                    'other_utilities': {
-                        'sand_pit': 'Children\'s play area',
-                        'postal': 'Dedicated space for postal services'
-                    }
-                }
-            
-            # Central Amenities Details
-            if any(word in user_question_lower for word in ['central', 'amenity', 'court', 'sand pit', 'lawn', 'facility', 'fountain']):
-                relevant_data['central_amenities'] = {
-                    'multipurpose_court': {
-                        'size': '40\'-8\" × 18\'-11\"',
-                        'location': 'Center of complex',
-                        'features': 'Surrounded by walkways'
-                    },
-                    'sand_pit': {
-                        'location': 'Adjacent to multipurpose court',
-                        'function': 'Children\'s play area'
-                    },
-                    'other_facilities': [
-                        'Internal Roads',
-                        'Drop-Off Plaza',
-                        'Lawn Area',
-                        'DG Set',
-                        'Seating Blocks',
-                        'Ramp Down to Basement',
-                        'Water Fountain with sculpture'
-                    ]
-                }
+    if 'ground_floor' in topics and 'ground_floor_plan' in sections:
+        # Add overall ground floor summary
+        relevant_data['ground_floor_summary'] = views['ground_floor_summary']
+        relevant_data['ground_floor_overview'] = views['ground_floor_overview']
+        
+        # Zone-specific details: right side (Block A), left side (Block B) and central amenities
+        for zone in ('block_a_zone', 'block_b_zone', 'central_amenities'):
+            if zone.replace('_zone', '') in topics and zone in views:
+                relevant_data[zone] = views[zone]
 
     # Check for unit configurations and sizes
-    if any(word in user_question_lower for word in ['3bhk', '3 bhk', 'price', 'cost', 'bhk', 'bedroom', 'size', 'sqft', 'configuration', 'apartment', 'flat', 'carpet', 'area', 'dimension']):
+    if 'unit_details' in topics:
         # Always include both configurations
-        if 'unit_configurations' in lang_data:
-            configs = lang_data['unit_configurations']
-            relevant_data['unit_details'] = {
-                '3bhk': {
-                    'total_size': next((config['size_sqft'] for config in configs if config['type'] == '3BHK'), ''),
-                    'carpet_area': next((config['carpet_area'] for config in configs if config['type'] == '3BHK'), ''),
-                    'size_yard': next((config['size_sq_yard'] for config in configs if config['type'] == '3BHK'), ''),
-                    'price': next((config['price_cr'] for config in configs if config['type'] == '3BHK'), '')
-                },
-                '4bhk': {
-                    'total_size': next((config['size_sqft'] for config in configs if config['type'] == '4BHK'), ''),
-                    'carpet_area': next((config['carpet_area'] for config in configs if config['type'] == '4BHK'), ''),
-                    'size_yard': next((config['size_sq_yard'] for config in configs if config['type'] == '4BHK'), ''),
-                    'price': next((config['price_cr'] for config in configs if config['type'] == '4BHK'), '')
-                }
-            }
+        if 'unit_details' in views:
+            relevant_data['unit_details'] = views['unit_details']
         
         # For detailed floor plans
-        if '3bhk_unit_plan' in lang_data and ('3bhk' in user_question_lower or '3 bhk' in user_question_lower or 'carpet' in user_question_lower):
-            relevant_data['3bhk_details'] = {
-                'overview': lang_data['3bhk_unit_plan']['overview'],
-                'special_features': lang_data['3bhk_unit_plan']['special_features'],
-                'area_breakdown': lang_data['3bhk_unit_plan']['area_breakdown']
-            }
+        for unit in ('3bhk', '4bhk'):
+            if f'{unit}_unit_plan' in sections and f'{unit}_details' in topics:
+                relevant_data[f'{unit}_details'] = views[f'{unit}_details']
         
-        if '4bhk_unit_plan' in lang_data and ('4bhk' in user_question_lower or '4 bhk' in user_question_lower or 'carpet' in user_question_lower):
-            relevant_data['4bhk_details'] = {
-                'overview': lang_data['4bhk_unit_plan']['overview'],
-                'special_features': lang_data['4bhk_unit_plan']['special_features'],
-                'area_breakdown': lang_data['4bhk_unit_plan']['area_breakdown']
-            }
-        
-        if 'pricing' in lang_data:
-            relevant_data['pricing'] = lang_data['pricing']
+        if 'pricing' in sections:
+            relevant_data['pricing'] = sections['pricing']
     
-    if any(word in user_question_lower for word in ['kitchen', 'room', 'bedroom', 'living', 'dining', 'bathroom', 'toilet', 'balcony']):
-        if '3bhk_unit_plan' in lang_data:
-            relevant_data['3bhk_unit_plan'] = lang_data['3bhk_unit_plan']
-        if '4bhk_unit_plan' in lang_data:
-            relevant_data['4bhk_unit_plan'] = lang_data['4bhk_unit_plan']
+    if 'rooms' in topics:
+        for plan in ('3bhk_unit_plan', '4bhk_unit_plan'):
+            if plan in sections:
+                relevant_data[plan] = sections[plan]
     
     # Check for elevator related queries
-    if any(word in user_question_lower for word in ['elevator', 'lift']):
-        if 'elevator' in lang_data:
-            relevant_data['elevator'] = lang_data['elevator']
+    if 'elevator' in topics and 'elevator' in sections:
+        relevant_data['elevator'] = sections['elevator']
 
     # Check for parking related queries
-    if any(word in user_question_lower for word in ['parking', 'car park', 'vehicle']):
-        if 'parking' in lang_data:
-            relevant_data['parking'] = lang_data['parking']
+    if 'parking' in topics and 'parking' in sections:
+        relevant_data['parking'] = sections['parking']
 
     # Check for specifications from the image
-    if any(word in user_question_lower for word in ['structure', 'flooring', 'bathroom', 'kitchen', 'elevator', 'electrical', 'doors', 'windows', 'security', 'water', 'specifications', 'features']):
-        if 'specifications' in lang_data:
-            relevant_data['specifications'] = lang_data['specifications']
+    if 'specifications' in topics and 'specifications' in sections:
+        relevant_data['specifications'] = sections['specifications']
 
     # Check for elevator related queries
-    if any(word in user_question_lower for word in ['elevator', 'lift', 'lifts']):
-        if 'construction_specifications' in lang_data and 'elevator' in lang_data['construction_specifications']:
-            relevant_data['elevator'] = lang_data['construction_specifications']['elevator']
-        if 'ground_floor_plan' in lang_data:
-            block_a_lifts = lang_data['ground_floor_plan']['block_a_zone'].get('lift_lobby', {})
-            block_b_lifts = lang_data['ground_floor_plan']['block_b_zone'].get('lift_lobby', {})
-            relevant_data['elevators_detail'] = {
-                'block_a': block_a_lifts,
-                'block_b': block_b_lifts
+    if 'elevator' in topics:
+        if 'elevator' in views:
+            relevant_data['elevator'] = views['elevator']
+        if 'elevators_detail' in views:
+            relevant_data['elevators_detail'] = views['elevators_detail']
+
+    # Check for parking related queries
+    if 'parking_or_cars' in topics and 'parking' in sections:
+        relevant_data['parking'] = sections['parking']
+
+    # Check for specifications from the image
+    if 'construction_specifications' in topics and 'specifications' in views:
+        relevant_data['specifications'] = views['specifications']
+
+    for topic, section in (('amenities', 'amenities'), ('location', 'location_details'),
+                           ('possession', 'possession_details'), ('developer', 'developer_portfolio')):
+        if topic in topics and section in sections:
+            relevant_data[section] = sections[section]
+    
+    # If minimal data, add more sections
+    if broad_fallback and len(relevant_data) <= 2:
+        for section in ['unit_configurations', 'pricing', '3bhk_unit_plan', '4bhk_unit_plan', 'amenities', 'location_details']:
+            if section in sections:
+                relevant_data[section] = sections[section]
+    
+    return relevant_data
+
+
+def build_system_instruction(language='english'):
+    """Static instructions for Gemini; identical for every call in a language"""
+    return f"""You are a helpful real estate chatbot for the Brookstone project. Answer user questions based on the provided project data and conversation context. {"Use Gujarati language for responses." if language == 'gujarati' else "Use English language for responses."}
+
+INSTRUCTIONS:
+1. ALWAYS use the PROJECT DATA provided to answer questions
+2. Consider the RECENT CONVERSATION context - if user says "yes", "sure", "please", they are responding to your previous question
+3. If any detail shows "TBD", say {"આ વિગત હજી નક્કી કરવાની બાકી છે" if language == 'gujarati' else "This detail is yet to be finalized"}
+4. Keep responses concise but comprehensive (max 1000 characters for WhatsApp)
+5. For possession date, mention {"મે 2027" if language == 'gujarati' else "May 2027"}
+6. After answering, ask 1 natural follow-up question to keep conversation going
+7. Be conversational and friendly like a real sales agent
+8. NEVER suggest WhatsApp links - only provide phone numbers
+9. For agent contact, ONLY provide phone number +91 1234567890
+10. Format your response for WhatsApp - use emojis and clear structure
+
+11. For ground floor questions:
+    - Always mention specific dimensions when available
+    - Describe the layout and connections between spaces
+    - Include details about amenities and facilities
+    - If size/dimension is asked but not available, acknowledge that and provide other relevant details
+
+12. When mentioning sizes or dimensions:
+    - Use the exact measurements as provided in the data
+    - Format dimensions clearly with proper units (e.g., "14'-9\" × 14'-6\"")
+    - For carpet area, specify it's carpet area (કાર્પેટ એરિયા in Gujarati)
+    - For total area, specify it's total built-up area (કુલ બિલ્ટ-અપ એરિયા in Gujarati)
+
+13. For BHK queries:
+    - Always mention both carpet area and total area
+    - Include price when available
+    - Specify number of bathrooms and balconies
+    - Mention key features of the layout
+    - If asking about 3BHK, provide 3BHK details first, then briefly mention 4BHK is also available
+    - If asking about 4BHK, provide 4BHK details first, then briefly mention 3BHK is also available
+
+14. Language-specific formatting:
+    - Use native number format for Gujarati (૧,૨,૩,૪,૫,૬,૭,૮,૯,૦)
+    - Use appropriate units: {'ચો.ફૂટ for sqft, કરોડ for crore' if language == 'gujarati' else 'sq ft for area, Cr for crore'}
+    - Use native terms for amenities and facilities when in Gujarati"""
+
+
+# Compiled once; sent as systemInstruction instead of being re-embedded in every prompt
+SYSTEM_INSTRUCTIONS = {language: build_system_instruction(language) for language in ('english', 'gujarati')}
+
+
+# ===== PROMPT PACKING =====
+# When a prompt is over budget, the lowest-priority sections are dropped first
+SECTION_PRIORITY = {
+    'project_info': 100,
+    'pricing': 90, 'unit_details': 90, 'unit_plan': 85,
+    'parking': 80, 'possession_details': 80, 'location_details': 75,
+    '3bhk_details': 70, '4bhk_details': 70,
+    'block_a_zone': 65, 'block_b_zone': 65, 'central_amenities': 65,
+    'ground_floor_summary': 60, 'ground_floor_overview': 55,
+    'elevator': 50, 'elevators_detail': 50, 'amenities': 50,
+    'unit_configurations': 45, 'specifications': 40, 'developer_portfolio': 40,
+    'ground_floor_plan': 30, '3bhk_unit_plan': 25, '4bhk_unit_plan': 25
+}
+DEFAULT_SECTION_PRIORITY = 50
+MENTIONED_SECTION_BOOST = 20
+
+# Rough characters per token before calibration against Gemini's usageMetadata
+ASCII_CHARS_PER_TOKEN = 4.0
+NATIVE_CHARS_PER_TOKEN = 2.5
+
+
+# One FAQ section or derived view: frozen value plus its serialized text and base token estimate
+Fragment = collections.namedtuple('Fragment', 'name value text tokens')
+
+
+def freeze(value):
+    """Read-only copy of nested FAQ data (mappings become mappingproxy, lists become tuples)"""
+    if isinstance(value, Mapping):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def is_empty_value(value):
+    return value is None or value == '' or (isinstance(value, (Mapping, list, tuple)) and not value)
+
+
+def serialize_compact(value, depth=0, lines=None):
+    """Indented "key: value" lines; no quotes, braces or escaped Unicode, empty values skipped"""
+    lines = [] if lines is None else lines
+    pad = ' ' * depth
+    if isinstance(value, Fragment):
+        value = value.value
+    if isinstance(value, Mapping):
+        for key, item in value.items():
+            if isinstance(item, Fragment):
+                item = item.value
+            if is_empty_value(item):
+                continue
+            if isinstance(item, (Mapping, list, tuple)):
+                lines.append(f"{pad}{key}:")
+                serialize_compact(item, depth + 1, lines)
+            else:
+                lines.append(f"{pad}{key}: {' '.join(str(item).split())}")
+    elif isinstance(value, (list, tuple)):
+        if not any(isinstance(item, (Mapping, list, tuple)) for item in value):
+            lines.append(pad + '; '.join(' '.join(str(item).split()) for item in value))
+        else:
+            for item in value:
+                lines.append(f"{pad}-")
+                serialize_compact(item, depth + 1, lines)
+    elif value not in ('', None):
+        lines.append(f"{pad}{' '.join(str(value).split())}")
+    return '\n'.join(lines) if depth == 0 else lines
+
+
+class PromptPacker:
+    """Serializes the selected FAQ sections compactly and keeps the prompt within a token budget.
+
+    Token counts are estimated per language (Gujarati script costs far more tokens per
+    character than ASCII) and the estimate is calibrated against the usageMetadata
+    Gemini reports for each call.
+    """
+
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self.calibration = {'english': 1.0, 'gujarati': 1.0}
+        self.packed = 0
+        self.trimmed = 0
+        self.dropped = collections.Counter()
+        self.estimated = collections.Counter()
+        self.usage = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def base_tokens(text):
+        """Uncalibrated token estimate; cached on every Fragment"""
+        ascii_chars = len(text.encode('ascii', 'ignore'))
+        return ascii_chars / ASCII_CHARS_PER_TOKEN + (len(text) - ascii_chars) / NATIVE_CHARS_PER_TOKEN
+
+    def estimate_tokens(self, text, language='english', calibrated=True, base=None):
+        tokens = self.base_tokens(text) if base is None else base
+        if calibrated:
+            tokens *= self.calibration.get(language, 1.0)
+        return int(tokens) + 1
+
+    @staticmethod
+    def priority(section, question):
+        # Retrieved chunks ("3bhk_unit_plan.room_details") rank with their top-level section
+        score = SECTION_PRIORITY.get(section, SECTION_PRIORITY.get(section.split('.')[0], DEFAULT_SECTION_PRIORITY))
+        words = [w for w in re.split(r'[._]', section) if len(w) > 3 and w not in ('details', 'plan', 'unit', 'zone')]
+        if any(w in question for w in words):
+            score += MENTIONED_SECTION_BOOST
+        return score
+
+    def pack(self, relevant_data, language='english', question='', reserved_text=''):
+        """PROJECT DATA text for the prompt, leaving room in the budget for reserved_text"""
+        blocks = {}
+        for name, value in relevant_data.items():
+            if isinstance(value, Fragment) and value.name == name:
+                text, base = value.text, value.tokens
+            else:
+                text, base = serialize_compact({name: value}), None
+            if text:
+                blocks[name] = (text, self.estimate_tokens(text, language, base=base))
+        available = self.budget - self.estimate_tokens(reserved_text, language)
+        total = sum(cost for _, cost in blocks.values())
+        question = question.lower()
+        ranked = sorted(blocks, key=lambda name: self.priority(name, question), reverse=True)
+        dropped = []
+        # The highest-priority section is always kept, even if it alone is over budget
+        while len(ranked) > 1 and total > available:
+            name = ranked.pop()
+            total -= blocks[name][1]
+            dropped.append(name)
+        with self._lock:
+            self.packed += 1
+            self.estimated[language] += total
+            if dropped:
+                self.trimmed += 1
+                self.dropped.update(dropped)
+        if dropped:
+            logging.info(f"✂️ Prompt over {self.budget} token budget, dropped: {', '.join(dropped)}")
+        return '\n'.join(text for name, (text, _) in blocks.items() if name not in dropped)
+
+    def observe_usage(self, language, body, usage):
+        """Record Gemini's usageMetadata for a call and recalibrate the token estimate"""
+        prompt_tokens = usage.get('promptTokenCount', 0)
+        cached_tokens = usage.get('cachedContentTokenCount', 0)
+        output_tokens = usage.get('candidatesTokenCount', 0)
+        sent = [part.get('text', '') for content in body.get('contents', []) for part in content.get('parts', [])]
+        sent += [part.get('text', '') for part in body.get('systemInstruction', {}).get('parts', [])]
+        estimate = self.estimate_tokens('\n'.join(sent), language, calibrated=False)
+        with self._lock:
+            if prompt_tokens > cached_tokens:
+                ratio = min(3.0, max(0.33, (prompt_tokens - cached_tokens) / estimate))
+                current = self.calibration.get(language, 1.0)
+                self.calibration[language] = round(0.8 * current + 0.2 * ratio, 4)
+            counters = self.usage[language]
+            counters['calls'] += 1
+            counters['prompt_tokens'] += prompt_tokens
+            counters['cached_tokens'] += cached_tokens
+            counters['output_tokens'] += output_tokens
+        logging.info(f"🧮 Gemini tokens ({language}): prompt={prompt_tokens} cached={cached_tokens} "
+                     f"output={output_tokens} estimated={estimate}")
+
+    def stats(self):
+        with self._lock:
+            usage = {}
+            for language, c in self.usage.items():
+                usage[language] = dict(c)
+                usage[language]['avg_prompt_tokens'] = round(c['prompt_tokens'] / c['calls'], 1) if c['calls'] else 0.0
+            return {
+                'budget': self.budget,
+                'packed': self.packed,
+                'trimmed': self.trimmed,
+                'dropped_sections': dict(self.dropped),
+                'estimated_tokens': dict(self.estimated),
+                'calibration': dict(self.calibration),
+                'usage': usage
+            }
+
+
+PROMPT_PACKER = PromptPacker()
+register_metrics('prompt_packer', PROMPT_PACKER.stats)
+
+
+# ===== FAQ SECTION STORE =====
+def make_fragment(name, value):
+    value = freeze(value)
+    text = serialize_compact({name: value})
+    return Fragment(name, value, text, PromptPacker.base_tokens(text))
+
+
+class FaqSectionStore:
+    """Every FAQ section and derived prompt view per language, frozen and pre-serialized once at load.
+
+    extract_relevant_data only picks fragments out of here, so building a prompt is
+    a concatenation of cached strings.
+    """
+
+    def __init__(self, faq_data, prompt_views):
+        self._sections = {}
+        self._views = {}
+        for language, lang_data in faq_data.items():
+            self._sections[language] = {name: make_fragment(name, value) for name, value in lang_data.items()}
+            self._views[language] = self._build_views(lang_data, prompt_views)
+
+    @staticmethod
+    def _build_views(lang_data, prompt_views):
+        views = {}
+        for unit, plan, price, parking in (('3bhk', '3bhk_unit_plan', 'box_price_2650', '3bhk_parking'),
+                                            ('4bhk', '4bhk_unit_plan', 'box_price_3850', '4bhk_parking')):
+            if plan in lang_data:
+                views[f'unit_plan_{unit}'] = make_fragment('unit_plan', lang_data[plan])
+                views[f'{unit}_details'] = make_fragment(f'{unit}_details', {
+                    key: lang_data[plan].get(key) for key in ('overview', 'special_features', 'area_breakdown')
+                })
+            views[f'pricing_{unit}'] = make_fragment('pricing', {unit: lang_data.get('pricing', {}).get(price)})
+            views[f'parking_{unit}'] = make_fragment('parking', {unit: lang_data.get('parking', {}).get(parking)})
+
+        if 'unit_configurations' in lang_data:
+            configs = lang_data['unit_configurations']
+            unit_details = {}
+            for unit, unit_type in (('3bhk', '3BHK'), ('4bhk', '4BHK')):
+                config = next((c for c in configs if c['type'] == unit_type), {})
+                unit_details[unit] = {
+                    'total_size': config.get('size_sqft', ''),
+                    'carpet_area': config.get('carpet_area', ''),
+                    'size_yard': config.get('size_sq_yard', ''),
+                    'price': config.get('price_cr', '')
+                }
+            views['unit_details'] = make_fragment('unit_details', unit_details)
+
+        specifications = lang_data.get('construction_specifications')
+        if specifications is not None:
+            views['specifications'] = make_fragment('specifications', specifications)
+            if 'elevator' in specifications:
+                views['elevator'] = make_fragment('elevator', specifications['elevator'])
+
+        ground_floor = lang_data.get('ground_floor_plan')
+        if ground_floor is not None:
+            views['ground_floor_summary'] = make_fragment('ground_floor_summary', ground_floor.get('summary', ''))
+            views['ground_floor_overview'] = make_fragment('ground_floor_overview', ground_floor.get('site_overview', {}))
+            views['elevators_detail'] = make_fragment('elevators_detail', {
+                'block_a': ground_floor.get('block_a_zone', {}).get('lift_lobby', {}),
+                'block_b': ground_floor.get('block_b_zone', {}).get('lift_lobby', {})
+            })
+            for name, zone in prompt_views.get('ground_floor_zones', {}).items():
+                views[name] = make_fragment(name, zone)
+        return views
+
+    def sections(self, language):
+        """Top-level FAQ sections of a language (English when the language is unknown)"""
+        return self._sections.get(language, self._sections.get('english', {}))
+
+    def views(self, language):
+        """Derived prompt views of a language, keyed by view id"""
+        return self._views.get(language, self._views.get('english', {}))
+
+    def stats(self):
+        return {
+            language: {
+                'fragments': len(sections) + len(self._views[language]),
+                'chars': sum(len(f.text) for f in sections.values()) + sum(len(f.text) for f in self._views[language].values())
+            }
+            for language, sections in self._sections.items()
+        }
+
+
+def create_gemini_prompt(user_question, language='english', chat_history=None, relevant_data=None, omit_sections=()):
+    """Create the per-message part of the Gemini prompt: relevant data, conversation context and question.
+
+    Sections in omit_sections are already part of a cached context and are not repeated.
+    """
+    if relevant_data is None:
+        relevant_data = select_relevant_data(user_question, language)
+    if omit_sections:
+        relevant_data = {k: v for k, v in relevant_data.items() if k.split('.')[0] not in omit_sections}
+    
+    # Build conversation context
+    conversation_context = ""
+    if chat_history and len(chat_history) > 0:
+        recent_history = chat_history[-4:] if len(chat_history) > 4 else chat_history
+        conversation_context = "\n\nRECENT CONVERSATION:\n"
+        for msg, is_user in recent_history:
+            role = "User" if is_user else "Bot"
+            conversation_context += f"{role}: {msg}\n"
+    
+    question_block = f"\n\nUSER QUESTION: {user_question}\n\nANSWER:"
+    project_data = PROMPT_PACKER.pack(relevant_data, language, user_question, conversation_context + question_block)
+    
+    prompt = f"""PROJECT DATA:
+{project_data}{conversation_context}
+
+USER QUESTION: {user_question}
+
+ANSWER:"""
+    
+    return prompt
+
+
+class GeminiContextCache:
+    """Keeps the system instruction plus the most common FAQ sections registered as Gemini
+    cached content (one per language) so calls only send the per-message remainder.
+
+    get() never blocks: creation and refresh run on a background thread and callers
+    use plain systemInstruction until a cache is ready.
+    """
+
+    def __init__(self, sections=GEMINI_CACHED_SECTIONS, ttl=GEMINI_CONTEXT_CACHE_TTL, enabled=GEMINI_CONTEXT_CACHE):
+        self.sections = tuple(sections)
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = {}
+        self._refreshing = set()
+        self._failed_at = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.failures = 0
+
+    def get(self, language):
+        """(cached content name, sections it contains) or (None, ()) when no cache is usable"""
+        if not self.enabled or not GEMINI_API_KEY:
+            return None, ()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(language)
+            # A cache created from an older FAQ snapshot is never handed out
+            if entry is not None and entry['faq_version'] != FAQ.version:
+                entry = None
+            needs_refresh = entry is None or entry['expires_at'] - now < self.ttl * 0.2
+            backing_off = now - self._failed_at.get(language, 0) < 300
+            if needs_refresh and not backing_off and language not in self._refreshing:
+                self._refreshing.add(language)
+                threading.Thread(target=self._create, args=(language,), daemon=True).start()
+            if entry is not None and entry['expires_at'] - now > 60:
+                return entry['name'], entry['sections']
+        return None, ()
+
+    def _create(self, language):
+        try:
+            faq = FAQ
+            fragments = faq.store.sections(language)
+            sections = tuple(s for s in self.sections if s in fragments)
+            common = '\n'.join(fragments[s].text for s in sections)
+            body = {
+                "model": f"models/{GEMINI_MODEL}",
+                "systemInstruction": {"parts": [{"text": SYSTEM_INSTRUCTIONS[language]}]},
+                "contents": [{"role": "user", "parts": [{"text": f"COMMON PROJECT DATA:\n{common}"}]}],
+                "ttl": f"{self.ttl}s"
+            }
+            response = requests.post(f"{GEMINI_API_BASE}/cachedContents?key={GEMINI_API_KEY}", json=body, timeout=30)
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.status_code} - {response.text[:200]}")
+            with self._lock:
+                self._entries[language] = {
+                    'name': response.json()['name'],
+                    'sections': sections,
+                    'faq_version': faq.version,
+                    'expires_at': time.time() + self.ttl
+                }
+                self.created += 1
+            logging.info(f"🧠 Gemini context cache ready for {language}")
+        except Exception as e:
+            with self._lock:
+                self._failed_at[language] = time.time()
+                self.failures += 1
+            logging.error(f"Error creating Gemini context cache for {language}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(language)
+
+    def invalidate(self, language=None):
+        with self._lock:
+            if language is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(language, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'active': {lang: e['name'] for lang, e in self._entries.items()},
+                'created': self.created,
+                'failures': self.failures
+            }
+
+
+GEMINI_CONTEXT = GeminiContextCache()
+register_metrics('gemini_context_cache', GEMINI_CONTEXT.stats)
+
+
+GEMINI_NOT_CONFIGURED_REPLY = "⚠️ Please configure your Gemini API key"
+GEMINI_FALLBACK_REPLY = "Sorry, I'm having trouble answering right now. Please try again or contact our agent at +91 1234567890."
+
+
+def gemini_request_body(prompt, language='english', cached_content=None):
+    """Request body for a Gemini generateContent call.
+
+    The static instructions travel either inside the referenced cached content
+    or as systemInstruction; the prompt itself only carries per-message context.
+    """
+    body = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": 0.3,
+            "maxOutputTokens": 800
+        }
+    }
+    if cached_content:
+        body["cachedContent"] = cached_content
+    else:
+        body["systemInstruction"] = {"parts": [{"text": SYSTEM_INSTRUCTIONS.get(language, SYSTEM_INSTRUCTIONS['english'])}]}
+    return body
+
+
+def parse_gemini_response(result):
+    """Extract the answer text from a Gemini response, or None"""
+    if 'candidates' in result and len(result['candidates']) > 0:
+        candidate = result['candidates'][0]
+        if 'content' in candidate and 'parts' in candidate['content']:
+            return candidate['content']['parts'][0]['text']
+    return None
+
+
+# ===== GEMINI RESILIENCE =====
+class Deadline:
+    """Latency budget for one message, handed down to every Gemini attempt made for it"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+class CircuitBreaker:
+    """Opens when too many of the recent calls failed or were slow, so callers fail fast.
+
+    After the cooldown a single probe is let through (half-open); its outcome closes
+    the circuit again or re-opens it for another cooldown. allow() hands out a permit
+    that the call passes back to record() or release(), so only the call holding the
+    probe can settle or free it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, window=GEMINI_BREAKER_WINDOW, min_calls=GEMINI_BREAKER_MIN_CALLS,
+                 failure_ratio=GEMINI_BREAKER_FAILURE_RATIO, slow_seconds=GEMINI_BREAKER_SLOW_SECONDS,
+                 cooldown=GEMINI_BREAKER_COOLDOWN):
+        self.name = name
+        self.outcomes = collections.deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe = None
+        self.transitions = collections.Counter()
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """A permit if a call may go out now (the probe's own object when half-open); None means fail fast"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and self.probe is None:
+                self.probe = object()
+                return self.probe
+            self.rejected += 1
+            return None
+
+    def record(self, healthy, seconds, permit=True):
+        """Feed back the outcome of an allowed call; slow calls count as failures"""
+        bad = not healthy or seconds > self.slow_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if permit is not True and permit is self.probe:
+                    self.probe = None
+                    self._transition(self.OPEN if bad else self.CLOSED)
+                return
+            if self.state == self.OPEN:
+                return
+            self.outcomes.append(bad)
+            if len(self.outcomes) >= self.min_calls and sum(self.outcomes) >= self.failure_ratio * len(self.outcomes):
+                self._transition(self.OPEN)
+
+    def release(self, permit):
+        """An allowed call was abandoned before it finished (e.g. a cancelled hedge)"""
+        with self._lock:
+            if permit is not True and permit is self.probe:
+                self.probe = None
+
+    def _transition(self, state):
+        if state == self.OPEN:
+            logging.warning(f"🔌 {self.name} circuit {self.state} -> open for {self.cooldown}s")
+            self.opened_at = time.monotonic()
+        else:
+            logging.info(f"🔌 {self.name} circuit {self.state} -> {state}")
+        self.transitions[f"{self.state}->{state}"] += 1
+        self.state = state
+        self.outcomes.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'recent_failures': sum(self.outcomes),
+                'recent_calls': len(self.outcomes),
+                'rejected': self.rejected,
+                'transitions': dict(self.transitions)
+            }
+
+
+class GeminiClient:
+    """Gemini generateContent calls bounded by the message's Deadline and guarded by a CircuitBreaker.
+
+    With hedging on, an attempt that outlives the observed p95 latency gets an identical
+    second request raced against it; the first usable answer wins.
+    """
+
+    RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+    HEDGE_MIN_SAMPLES = 20
+    MIN_ATTEMPT_SECONDS = 0.5
+
+    def __init__(self, breaker, attempt_timeout=GEMINI_ATTEMPT_TIMEOUT, max_attempts=GEMINI_MAX_ATTEMPTS,
+                 hedge=GEMINI_HEDGE, hedge_min_delay=GEMINI_HEDGE_MIN_DELAY):
+        self.breaker = breaker
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.attempt_latency = LatencyHistogram()
+        self.counters = collections.Counter()
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+
+    def count(self, name):
+        # Calls finish on worker, hedge and event-loop threads alike
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def counters_snapshot(self):
+        with self._counters_lock:
+            return dict(self.counters)
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = requests.Session()
+        return self._session
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=max(8, WORKER_COUNT * 4),
+                                                        thread_name_prefix='gemini-hedge')
+        return self._executor
+
+    @property
+    def url(self):
+        return f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
+
+    def hedge_delay(self, timeout):
+        """Seconds to wait before hedging, or None when this attempt should not be hedged"""
+        if not self.hedge or self.breaker.state != CircuitBreaker.CLOSED:
+            return None
+        if self.attempt_latency.count < self.HEDGE_MIN_SAMPLES:
+            return None
+        delay = max(self.hedge_min_delay, self.attempt_latency.quantile(0.95))
+        return delay if delay < timeout else None
+
+    def _finish(self, started, permit, status, payload=None, error=None, body=None, language='english'):
+        """Record one finished request and classify it as answer / retry / stale_cache / fatal"""
+        seconds = time.monotonic() - started
+        self.attempt_latency.observe(seconds)
+        if error is not None:
+            self.breaker.record(False, seconds, permit)
+            self.count('errors')
+            logging.error(f"Gemini API exception: {error}")
+            return 'retry', None
+        # 4xx other than 429 means Gemini is up and rejected this request
+        self.breaker.record(status not in self.RETRYABLE_STATUS, seconds, permit)
+        if status == 200:
+            if payload.get('usageMetadata'):
+                PROMPT_PACKER.observe_usage(language, body, payload['usageMetadata'])
+            answer = parse_gemini_response(payload)
+            if answer is not None:
+                return 'answer', answer
+            self.count('empty')
+            logging.warning("Gemini API returned no answer")
+            return 'retry', None
+        self.count(f"status_{status}")
+        logging.warning(f"Gemini API error: {status}")
+        if status in self.RETRYABLE_STATUS:
+            return 'retry', None
+        return ('stale_cache' if status in (400, 403, 404) else 'fatal'), None
+
+    def _request(self, body, timeout, language, permit=True):
+        started = time.monotonic()
+        try:
+            response = self.session.post(self.url, json=body, timeout=timeout)
+            payload = response.json() if response.status_code == 200 else None
+        except Exception as e:
+            return self._finish(started, permit, None, error=e)
+        return self._finish(started, permit, response.status_code, payload, body=body, language=language)
+
+    async def _arequest(self, client, body, timeout, language, permit=True):
+        started = time.monotonic()
+        try:
+            response = await client.post(self.url, json=body, timeout=timeout)
+            payload = response.json() if response.status_code == 200 else None
+        except asyncio.CancelledError:
+            self.breaker.release(permit)
+            raise
+        except Exception as e:
+            return self._finish(started, permit, None, error=e)
+        return self._finish(started, permit, response.status_code, payload, body=body, language=language)
+
+    def _race(self, body, timeout, deadline, language, permit=True):
+        delay = self.hedge_delay(timeout)
+        if delay is None:
+            return self._request(body, timeout, language, permit)
+        primary = self.executor.submit(self._request, body, timeout, language, permit)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        pending = [primary]
+        hedge_permit = self.breaker.allow()
+        if hedge_permit:
+            self.count('hedged')
+            pending.append(self.executor.submit(self._request, body, max(self.MIN_ATTEMPT_SECONDS, deadline.remaining()),
+                                                language, hedge_permit))
+        result = ('retry', None)
+        for future in as_completed(pending):
+            result = future.result()
+            if result[0] == 'answer':
+                if future is not primary:
+                    self.count('hedge_wins')
+                break
+        return result
+
+    async def _arace(self, client, body, timeout, deadline, language, permit=True):
+        delay = self.hedge_delay(timeout)
+        if delay is None:
+            return await self._arequest(client, body, timeout, language, permit)
+        primary = asyncio.ensure_future(self._arequest(client, body, timeout, language, permit))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        pending = {primary}
+        hedge_permit = self.breaker.allow()
+        if hedge_permit:
+            self.count('hedged')
+            pending.add(asyncio.ensure_future(
+                self._arequest(client, body, max(self.MIN_ATTEMPT_SECONDS, deadline.remaining()), language, hedge_permit)
+            ))
+        result = ('retry', None)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result[0] == 'answer':
+                        if task is not primary:
+                            self.count('hedge_wins')
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _next_attempt(self, attempt, deadline):
+        """(timeout, breaker permit) for the next attempt, or None when the budget or the breaker says stop"""
+        timeout = min(self.attempt_timeout, deadline.remaining())
+        if timeout < self.MIN_ATTEMPT_SECONDS:
+            self.count('budget_exhausted')
+            logging.warning(f"⏱️ Gemini budget of {deadline.seconds}s used up after {attempt} attempt(s)")
+            return None
+        permit = self.breaker.allow()
+        if not permit:
+            self.count('short_circuited')
+            return None
+        return timeout, permit
+
+    def _retry_delay(self, attempt, deadline):
+        delay = random.uniform(0, min(2.0, 0.5 * (2 ** attempt)))
+        return delay if deadline.remaining() - delay >= self.MIN_ATTEMPT_SECONDS else None
+
+    def _result(self, answer, deadline):
+        self.count('calls')
+        if answer is None:
+            self.count('fallbacks')
+        if deadline.elapsed() > deadline.seconds:
+            self.count('budget_overruns')
+        return answer if answer is not None else GEMINI_FALLBACK_REPLY
+
+    def generate(self, prompt, language='english', cached_content=None, deadline=None):
+        deadline = deadline or Deadline(GEMINI_MESSAGE_BUDGET)
+        body = gemini_request_body(prompt, language, cached_content)
+        for attempt in range(self.max_attempts):
+            if attempt:
+                delay = self._retry_delay(attempt, deadline)
+                if delay is None:
+                    self.count('budget_exhausted')
+                    break
+                time.sleep(delay)
+            allowed = self._next_attempt(attempt, deadline)
+            if allowed is None:
+                break
+            timeout, permit = allowed
+            outcome, answer = self._race(body, timeout, deadline, language, permit)
+            if outcome == 'answer':
+                return self._result(answer, deadline)
+            if outcome == 'stale_cache' and 'cachedContent' in body:
+                # Cached content expired or was deleted; retry with the plain system instruction
+                GEMINI_CONTEXT.invalidate(language)
+                body = gemini_request_body(prompt, language)
+            elif outcome != 'retry':
+                break
+        return self._result(None, deadline)
+
+    async def agenerate(self, client, prompt, language='english', cached_content=None, deadline=None):
+        deadline = deadline or Deadline(GEMINI_MESSAGE_BUDGET)
+        body = gemini_request_body(prompt, language, cached_content)
+        for attempt in range(self.max_attempts):
+            if attempt:
+                delay = self._retry_delay(attempt, deadline)
+                if delay is None:
+                    self.count('budget_exhausted')
+                    break
+                await asyncio.sleep(delay)
+            allowed = self._next_attempt(attempt, deadline)
+            if allowed is None:
+                break
+            timeout, permit = allowed
+            outcome, answer = await self._arace(client, body, timeout, deadline, language, permit)
+            if outcome == 'answer':
+                return self._result(answer, deadline)
+            if outcome == 'stale_cache' and 'cachedContent' in body:
+                GEMINI_CONTEXT.invalidate(language)
+                body = gemini_request_body(prompt, language)
+            elif outcome != 'retry':
+                break
+        return self._result(None, deadline)
+
+    def stats(self):
+        return {
+            'breaker': self.breaker.stats(),
+            'hedging': self.hedge,
+            'hedge_delay': self.hedge_delay(float('inf')),
+            'counters': self.counters_snapshot(),
+            'attempt_seconds': self.attempt_latency.snapshot()
+        }
+
+
+GEMINI = GeminiClient(CircuitBreaker('Gemini'))
+register_metrics('gemini', GEMINI.stats)
+
+
+def call_gemini_api(prompt, language='english', cached_content=None, deadline=None):
+    """Call Google Gemini API within the message's latency budget"""
+    if not GEMINI_API_KEY:
+        return GEMINI_NOT_CONFIGURED_REPLY
+    return GEMINI.generate(prompt, language, cached_content, deadline)
+
+
+# ===== GEMINI RESPONSE CACHE =====
+FOLLOW_UP_WORDS = {
+    'yes', 'yeah', 'yup', 'sure', 'ok', 'okay', 'please', 'more', 'it', 'that', 'this', 'those', 'them',
+    'same', 'also', 'and', 'what about', 'tell me more', 'go on', 'continue',
+    'હા', 'ઠીક', 'બરાબર', 'વધુ', 'આ', 'તે', 'પણ'
+}
+# Words that point back at an earlier turn ("how big is it"), unless the question names its own topic
+FOLLOW_UP_PRONOUNS = {
+    'it', 'its', 'that', 'this', 'these', 'those', 'them', 'they', 'same',
+    'આ', 'તે', 'તેની', 'તેનું', 'તેના', 'એ', 'એની', 'એનું', 'એના'
+}
+GUJARATI_DIGITS = str.maketrans('૦૧૨૩૪૫૬૭૮૯', '0123456789')
+
+
+def normalize_question(text):
+    """Lowercase, map Gujarati digits to ASCII and collapse punctuation and whitespace"""
+    text = text.lower().translate(GUJARATI_DIGITS)
+    # Gujarati vowel signs are not \w, so keep the whole Gujarati block explicitly
+    text = re.sub(r'[^\w\s\u0A80-\u0AFF]', ' ', text)
+    return ' '.join(text.split())
+
+
+def names_own_topic(normalized_question):
+    """True when the question mentions an FAQ topic or answerable intent by itself"""
+    if RELEVANCE_MATCHER.match(normalized_question):
+        return True
+    return any(_padded_contains(f" {normalized_question} ", intent['patterns']) for intent in FAQ_INTENTS)
+
+
+def depends_on_history(normalized_question, chat_history):
+    """True when the question only makes sense with the previous turns (e.g. "yes", "how big is it")"""
+    if not chat_history or len(chat_history) < 2:
+        return False
+    words = normalized_question.split()
+    if not words:
+        return False
+    leading = next((phrase for phrase in (words[0], ' '.join(words[:2]), ' '.join(words[:3]))
+                    if phrase in FOLLOW_UP_WORDS), None)
+    if leading is not None and leading not in FOLLOW_UP_PRONOUNS:
+        return True
+    if leading is None and not any(word in FOLLOW_UP_PRONOUNS for word in words):
+        return False
+    # "is it vastu compliant" stands alone; "what is the price of it" ends on what it refers back to
+    return words[-1] in FOLLOW_UP_PRONOUNS or not names_own_topic(normalized_question)
+
+
+def response_cache_key(normalized_question, language, relevant_data, faq_version=None):
+    """Cache key over question, language, the FAQ sections selected for it and the FAQ version"""
+    sections = ','.join(sorted(relevant_data))
+    raw = f"{language}|{normalized_question}|{sections}|{faq_version or FAQ_VERSION}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of Gemini answers bounded by total size in bytes"""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            answer, expires_at, _ = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return answer
+
+    def put(self, key, answer, ttl_seconds=None):
+        size = len(key) + len(answer.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (answer, expires_at, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+RESPONSE_CACHE = ResponseCache()
+register_metrics('response_cache', RESPONSE_CACHE.stats)
+
+WARM_CACHE_FORMAT = 1
+
+
+def load_warm_cache(path=WARM_CACHE_PATH, cache=RESPONSE_CACHE):
+    """Seed the answer cache from a warm_cache.py file; returns the number of keys loaded"""
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"❌ Could not read warm cache {path}: {e}")
+        return 0
+    if data.get('format') != WARM_CACHE_FORMAT or data.get('faq_version') != FAQ_VERSION:
+        logging.warning(f"⚠️ Ignoring warm cache {path}: built for FAQ version {data.get('faq_version')}, running {FAQ_VERSION}")
+        return 0
+    loaded = 0
+    for answer, keys in data.get('answers', []):
+        for key in keys:
+            cache.put(key, answer, WARM_CACHE_TTL_SECONDS)
+            loaded += 1
+    logging.info(f"🔥 Warm cache: {len(data.get('answers', []))} answers for {loaded} questions from {path}")
+    return loaded
+
+
+load_warm_cache()
+
+
+def is_cacheable_answer(answer):
+    return bool(answer) and answer not in (GEMINI_FALLBACK_REPLY, GEMINI_NOT_CONFIGURED_REPLY)
+
+
+# ===== FAQ SECTION RETRIEVER =====
+RETRIEVER_STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'be', 'do', 'does', 'did', 'what', 'which', 'who', 'when', 'where', 'how',
+    'there', 'any', 'of', 'in', 'on', 'at', 'to', 'for', 'with', 'and', 'or', 'it', 'its', 'this', 'that', 'me', 'my',
+    'i', 'you', 'your', 'we', 'can', 'tell', 'about', 'please', 'give', 'much', 'many', 'have', 'has', 'project',
+    'છે', 'શું', 'માં', 'ની', 'નો', 'ના', 'નું', 'ને', 'અને', 'પર', 'કે', 'આ', 'તે', 'માટે', 'કેટલા', 'કેટલી', 'કેટલું'
+}
+# Gujarati words mapped onto the English terms used in FAQ keys (and spelling variants onto each other)
+RETRIEVAL_SYNONYMS = {
+    'ત્રણ': '3', 'ચાર': '4', 'બીએચકે': 'bhk', 'બેડરૂમ': 'bedroom',
+    'કિંમત': 'price', 'ભાવ': 'price', 'કરોડ': 'price',
+    'જીમ': 'gym', 'જિમ': 'gym', 'લિફ્ટ': 'lift', 'પાર્કિંગ': 'parking', 'લાઇબ્રેરી': 'library',
+    'રસોડું': 'kitchen', 'કિચન': 'kitchen', 'બાથરૂમ': 'bathroom', 'બાલ્કની': 'balcony', 'બાલ્કોની': 'balcony',
+    'સ્કૂલ': 'school', 'શાળા': 'school', 'હોસ્પિટલ': 'hospital', 'મોલ': 'mall',
+    'કબજો': 'possession', 'પઝેશન': 'possession', 'સ્થાન': 'location', 'સરનામું': 'address',
+    'ફ્લોરિંગ': 'flooring', 'ટાઇલ્સ': 'tile', 'ડેવલપર': 'developer', 'સુવિધા': 'amenity', 'સુવિધાઓ': 'amenity'
+}
+RETRIEVAL_TOKEN_PATTERN = re.compile(r'(?:[^\W_]|[\u0A80-\u0AFF])+')
+UNIT_TYPE_PATTERN = re.compile(r'(\d)\s*(bhk)\b')
+
+
+def retrieval_tokens(text):
+    """Lowercased word tokens with stopwords removed, Gujarati synonyms mapped, "3 bhk" joined
+    and simple English plurals stripped"""
+    words = RETRIEVAL_TOKEN_PATTERN.findall(text.lower().translate(GUJARATI_DIGITS))
+    text = UNIT_TYPE_PATTERN.sub(r'\1\2', ' '.join(RETRIEVAL_SYNONYMS.get(word, word) for word in words))
+    tokens = []
+    for token in text.split():
+        if token in RETRIEVER_STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith('ies'):
+            token = token[:-3] + 'y'
+        elif len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def flatten_faq_chunks(lang_data, max_chars=RETRIEVER_CHUNK_CHARS):
+    """Split one language's FAQ data into addressable chunks such as "3bhk_unit_plan.room_details".
+
+    A section small enough to serialize within max_chars is one Fragment; larger
+    dicts are split into their children, recursively.
+    """
+    chunks = []
+
+    def visit(path, value):
+        fragment = make_fragment(path, value)
+        if len(fragment.text) <= max_chars or not isinstance(value, Mapping):
+            chunks.append(fragment)
+            return
+        for key, item in value.items():
+            if not is_empty_value(item):
+                visit(f"{path}.{key}", item)
+
+    for key, value in lang_data.items():
+        visit(key, value)
+    return chunks
+
+
+class SectionRetriever:
+    """BM25 ranking of flattened FAQ chunks, with one index per language.
+
+    The chunk path ("ground_floor_plan.block_a_zone") is indexed alongside its
+    content and weighted double, since the FAQ keys are English in both files.
+    """
+
+    def __init__(self, faq_data, store, chunk_chars=RETRIEVER_CHUNK_CHARS, k1=1.2, b=0.75):
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        self.chunk_chars = chunk_chars
+        self.indexes = {language: self._build(lang_data) for language, lang_data in faq_data.items() if lang_data}
+        self.searches = 0
+        self.selected_chars = 0
+
+    def _build(self, lang_data):
+        chunks = flatten_faq_chunks(lang_data, self.chunk_chars)
+        postings = collections.defaultdict(list)
+        lengths = []
+        for i, chunk in enumerate(chunks):
+            path_words = chunk.name.replace('.', ' ').replace('_', ' ')
+            counts = collections.Counter(retrieval_tokens(chunk.text) + 2 * retrieval_tokens(path_words))
+            for token, tf in counts.items():
+                postings[token].append((i, tf))
+            lengths.append(sum(counts.values()))
+        total = len(chunks)
+        idf = {token: math.log(1 + (total - len(p) + 0.5) / (len(p) + 0.5)) for token, p in postings.items()}
+        return {
+            'chunks': chunks,
+            'postings': dict(postings),
+            'idf': idf,
+            'lengths': lengths,
+            'avg_length': sum(lengths) / total if total else 1.0
+        }
+
+    def search(self, question, language='english', top_k=RETRIEVER_TOP_K, max_chars=RETRIEVER_MAX_CHARS, exclude=()):
+        """Best-scoring (fragment, score) chunks, at most top_k of them and max_chars in total"""
+        index = self.indexes.get(language) or self.indexes.get('english')
+        if index is None:
+            return []
+        lengths, avg_length, k1, b = index['lengths'], index['avg_length'], self.k1, self.b
+        scores = collections.defaultdict(float)
+        for token in set(retrieval_tokens(question)):
+            idf = index['idf'].get(token)
+            if idf is None:
+                continue
+            for i, tf in index['postings'][token]:
+                scores[i] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[i] / avg_length))
+
+        results = []
+        used = 0
+        for i, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+            chunk = index['chunks'][i]
+            if chunk.name.split('.')[0] in exclude or used + len(chunk.text) > max_chars:
+                continue
+            results.append((chunk, round(score, 3)))
+            used += len(chunk.text)
+            if len(results) >= top_k:
+                break
+        self.searches += 1
+        self.selected_chars += used
+        return results
+
+    def relevant_data(self, question, language='english', top_k=RETRIEVER_TOP_K, max_chars=RETRIEVER_MAX_CHARS):
+        """project_info plus the top-ranked chunks, keyed by chunk path"""
+        relevant_data = {}
+        project_info = self.store.sections(language).get('project_info')
+        if project_info is not None:
+            relevant_data['project_info'] = project_info
+        for chunk, _ in self.search(question, language, top_k, max_chars, exclude=('project_info',)):
+            relevant_data[chunk.name] = chunk
+        return relevant_data
+
+    def stats(self):
+        return {
+            'mode': RETRIEVER_MODE,
+            'chunks': {language: len(index['chunks']) for language, index in self.indexes.items()},
+            'searches': self.searches,
+            'avg_selected_chars': round(self.selected_chars / self.searches, 1) if self.searches else 0.0
+        }
+
+
+def select_relevant_data(user_question, language='english', snapshot=None):
+    """FAQ data for the prompt, chosen according to RETRIEVER_MODE from one FAQ snapshot (the current one by default)"""
+    snapshot = snapshot or FAQ
+    if RETRIEVER_MODE == 'bm25':
+        return snapshot.retriever.relevant_data(user_question, language)
+    if RETRIEVER_MODE == 'hybrid':
+        relevant_data = extract_relevant_data(user_question, language, broad_fallback=False, store=snapshot.store)
+        if len(relevant_data) <= 2:
+            relevant_data.update(snapshot.retriever.relevant_data(user_question, language))
+        return relevant_data
+    return extract_relevant_data(user_question, language, store=snapshot.store)
+
+
+# ===== FAQ HOT RELOAD =====
+FAQ_REQUIRED_SECTIONS = ('project_info', 'unit_configurations', 'pricing')
+
+
+class FaqSnapshot:
+    """One generation of the FAQ data plus everything derived from it (section store, BM25 indexes).
+
+    Message handling reads FAQ once and works from that snapshot, so a reload
+    never mixes old and new data within one answer.
+    """
+
+    def __init__(self, data, prompt_views, version=None):
+        self.data = data
+        self.prompt_views = prompt_views
+        self.version = version or faq_fingerprint({'faq': data, 'prompt_views': prompt_views})
+        self.store = FaqSectionStore(data, prompt_views)
+        self.retriever = SectionRetriever(data, self.store)
+        self.loaded_at = time.time()
+
+
+FAQ = FaqSnapshot(FAQ_DATA, PROMPT_VIEWS, FAQ_VERSION)
+# Module-level aliases of the current snapshot, kept for scripts and older callers
+SECTION_STORE = FAQ.store
+RETRIEVER = FAQ.retriever
+register_metrics('section_store', lambda: FAQ.store.stats())
+register_metrics('retriever', lambda: FAQ.retriever.stats())
+
+
+def validate_faq_data(data, prompt_views):
+    """Raise ValueError when freshly loaded FAQ data is not fit to answer from"""
+    for language in FAQ_FILES:
+        lang_data = data.get(language)
+        if not isinstance(lang_data, dict) or not lang_data:
+            raise ValueError(f"{language} FAQ is empty or not a JSON object")
+        missing = [section for section in FAQ_REQUIRED_SECTIONS if section not in lang_data]
+        if missing:
+            raise ValueError(f"{language} FAQ is missing {', '.join(missing)}")
+        configs = lang_data['unit_configurations']
+        if not isinstance(configs, list) or not all(isinstance(c, dict) and 'type' in c for c in configs):
+            raise ValueError(f"{language} unit_configurations must be a list of objects with a 'type'")
+        # Every local answer template must still render from the new data
+        for intent in LOCAL_ANSWER_TEMPLATES[language]:
+            render_local_intent(intent, lang_data, language, [])
+    if not isinstance(prompt_views, dict):
+        raise ValueError("prompt views must be a JSON object")
+
+
+def install_faq_snapshot(snapshot):
+    """Make snapshot the current FAQ generation and drop the caches derived from the previous one"""
+    global FAQ, FAQ_DATA, PROMPT_VIEWS, FAQ_VERSION, SECTION_STORE, RETRIEVER
+    previous = FAQ
+    FAQ_DATA, PROMPT_VIEWS, FAQ_VERSION = snapshot.data, snapshot.prompt_views, snapshot.version
+    SECTION_STORE, RETRIEVER = snapshot.store, snapshot.retriever
+    # A single rebinding: readers see either the old or the new snapshot, never a mix
+    FAQ = snapshot
+    RESPONSE_CACHE.clear()
+    GEMINI_CONTEXT.invalidate()
+    load_warm_cache()
+    logging.info(f"🔄 FAQ data reloaded: version {previous.version} -> {snapshot.version}")
+    return previous
+
+
+class FaqReloader:
+    """Polls the FAQ files and hot-swaps in a validated, fully rebuilt snapshot when they change.
+
+    Loading, validation and index building all happen on the watcher thread; a
+    broken edit is logged and the bot keeps answering from the previous data.
+    """
+
+    def __init__(self, paths, interval=FAQ_RELOAD_INTERVAL):
+        self.paths = tuple(paths)
+        self.interval = interval
+        self._signature = self.signature()
+        self._lock = threading.Lock()
+        self._started = False
+        self.reloads = 0
+        self.rejected = 0
+        self.last_error = None
+        self.last_build_seconds = None
+
+    def signature(self):
+        """(mtime, size) of every watched file, None for missing ones"""
+        signature = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def check(self):
+        """Reload if any file changed since the last attempt; True when a new snapshot went live"""
+        signature = self.signature()
+        if signature == self._signature:
+            return False
+        with self._lock:
+            if signature == self._signature:
+                return False
+            self._signature = signature
+            return self._reload(signature)
+
+    def reload(self):
+        """Reload unconditionally; True when a new snapshot went live"""
+        with self._lock:
+            self._signature = self.signature()
+            return self._reload(self._signature)
+
+    def _reload(self, signature):
+        started = time.monotonic()
+        try:
+            data = {}
+            for language, path in FAQ_FILES.items():
+                with open(path, 'r', encoding='utf-8') as f:
+                    data[language] = json.load(f)
+            with open(PROMPT_VIEWS_PATH, 'r', encoding='utf-8') as f:
+                prompt_views = json.load(f)
+            validate_faq_data(data, prompt_views)
+            snapshot = FaqSnapshot(data, prompt_views)
+        except Exception as e:
+            self.rejected += 1
+            self.last_error = str(e)
+            logging.error(f"❌ FAQ reload rejected, still serving version {FAQ.version}: {e}")
+            return False
+        
+        if self.signature() != signature:
+            # Written to again while we read it; the next poll loads the finished file
+            self._signature = None
+            return False
+        self.last_build_seconds = round(time.monotonic() - started, 3)
+        if snapshot.version == FAQ.version:
+            return False
+        install_faq_snapshot(snapshot)
+        self.reloads += 1
+        self.last_error = None
+        return True
+
+    def start(self):
+        if self._started or self.interval <= 0:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        
+        def run():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    logging.error(f"Error checking FAQ files: {e}")
+        
+        threading.Thread(target=run, name="faq-reloader", daemon=True).start()
+
+    def stats(self):
+        return {
+            'version': FAQ.version,
+            'loaded_at': int(FAQ.loaded_at),
+            'interval': self.interval,
+            'reloads': self.reloads,
+            'rejected': self.rejected,
+            'last_error': self.last_error,
+            'last_build_seconds': self.last_build_seconds
+        }
+
+
+FAQ_RELOADER = FaqReloader(list(FAQ_FILES.values()) + [PROMPT_VIEWS_PATH])
+register_metrics('faq', FAQ_RELOADER.stats)
+
+
+# ===== LOCAL FAQ ANSWER ENGINE =====
+# Factual one-liners (possession date, prices, unit counts, RERA, ...) are answered
+# straight from the FAQ JSON; anything ambiguous or open-ended falls through to Gemini.
+UNIT_ENTITY_PATTERNS = {
+    '3BHK': ['3bhk', '3 bhk', 'three bedroom', 'three bhk', '3 bedroom', 'ત્રણ બેડરૂમ', '3 બીએચકે', 'ત્રણ બીએચકે'],
+    '4BHK': ['4bhk', '4 bhk', 'four bedroom', 'four bhk', '4 bedroom', 'ચાર બેડરૂમ', '4 બીએચકે', 'ચાર બીએચકે']
+}
+
+OPEN_ENDED_PATTERNS = [
+    ' why ', 'compare', 'comparison', 'difference', 'explain', 'better', ' vs ', 'versus', 'suggest',
+    'recommend', ' emi ', 'negotia', 'discount', 'offer', 'breakdown', 'layout', 'plan ', 'detail',
+    'શા માટે', 'તફાવત', 'સરખામણી', 'વિગત', 'ડિસ્કાઉન્ટ', 'ઓફર'
+]
+
+# Words that say the question is about a unit, which the generic price/size words need
+UNIT_MENTION_PATTERNS = [' flat', ' unit', 'apartment', 'bhk', 'ફ્લેટ', 'યુનિટ', 'બીએચકે']
+
+# Costs and topics no template answers: their presence always sends the question to Gemini
+LOCAL_ANSWER_NEGATIVE_CUES = [
+    'maintenance', 'down payment', 'booking amount', 'token amount', 'gst', 'stamp', 'registration charge',
+    'registration fee', 'interior', 'club', 'membership', 'deposit', ' tax', 'legal', 'extra charge',
+    'મેન્ટેનન્સ', 'ડાઉન પેમેન્ટ', 'બુકિંગ રકમ', 'જીએસટી', 'સ્ટેમ્પ', 'ઇન્ટિરિયર', 'ક્લબ', 'ટેક્સ'
+]
+
+# patterns match on their own; unit_patterns only when the question also mentions a unit;
+# negative cues on a matched intent send the whole question to Gemini
+FAQ_INTENTS = [
+    {'name': 'price_per_sqft', 'patterns': ['per sq', 'per sqft', 'sqft rate', 'rate per', 'પ્રતિ ચો', 'ચો ફૂટ ભાવ', 'ચોરસ ફૂટ ભાવ']},
+    {'name': 'unit_price',
+     'patterns': ['flat price', 'unit price', 'price of flat', 'price of the flat', 'price of a flat', 'cost of flat',
+                  'cost of the flat', 'how much is the flat', 'how much is a flat', 'how much for a flat',
+                  'ફ્લેટની કિંમત', 'ફ્લેટ ની કિંમત', 'ફ્લેટનો ભાવ'],
+     'unit_patterns': ['price', ' cost', ' rate ', 'how much', 'કિંમત', 'ભાવ'],
+     'negative': ['parking', 'પાર્કિંગ'],
+     'overridden_by': ['price_per_sqft']},
+    {'name': 'unit_size',
+     'patterns': ['carpet', 'built up', 'super built', 'કાર્પેટ'],
+     'unit_patterns': ['sq ft', 'sqft', 'size of', 'how big', 'area of', 'સાઇઝ', 'ચો ફૂટ'],
+     'negative': ['kitchen', 'bathroom', 'toilet', 'balcony', 'living room', 'drawing room', 'master bed', 'gym',
+                  'garden', 'terrace', 'lobby', 'parking', 'plot', 'કિચન', 'રસોડ', 'બાથરૂમ', 'બાલ્કની', 'પાર્કિંગ'],
+     'overridden_by': ['price_per_sqft']},
+    {'name': 'possession_date', 'patterns': ['possession', 'handover', 'hand over', 'ready to move', 'completion date', 'when will it be ready', 'પઝેશન', 'કબજો', 'ક્યારે તૈયાર'],
+     'negative': ['charge', 'ચાર્જ']},
+    {'name': 'total_units', 'patterns': ['total units', 'how many units', 'how many flats', 'number of units', 'number of flats', 'કેટલા યુનિટ', 'કુલ યુનિટ', 'કેટલા ફ્લેટ']},
+    {'name': 'towers', 'patterns': ['how many tower', 'number of tower', 'how many blocks', 'કેટલા ટાવર']},
+    {'name': 'rera', 'patterns': ['rera', 'રેરા'],
+     'negative': [' number', ' no ', ' id ', 'certificate', 'website', 'નંબર']},
+    {'name': 'vastu', 'patterns': ['vastu', 'વાસ્તુ']},
+    {'name': 'parking_count', 'patterns': ['how many parking', 'parking spaces', 'parking slots', 'car parking', 'parking for', 'કેટલા પાર્કિંગ', 'પાર્કિંગ જગ્યા'],
+     'negative': ['price', ' cost', 'charge', 'visitor', ' ev ', 'charging', 'two wheeler', 'કિંમત', 'ચાર્જ']},
+    {'name': 'bhk_options', 'patterns': ['1bhk', '1 bhk', '2bhk', '2 bhk', 'which bhk', 'what bhk', 'configurations available', 'options available', '2 બીએચકે', 'કયા બીએચકે']},
+    {'name': 'loan', 'patterns': ['loan', 'લોન'],
+     'negative': ['bank', 'interest', 'which', ' emi ', 'eligib', 'document', 'બેંક', 'વ્યાજ']},
+    {'name': 'floor_rise', 'patterns': ['floor rise', 'ફ્લોર રાઇઝ']}
+]
+
+LOCAL_ANSWER_FOLLOW_UP = {
+    'english': "Would you like the brochure or to book a site visit? 🏠",
+    'gujarati': "શું તમે બ્રોશર મેળવવા અથવા સાઇટ વિઝિટ બુક કરવા માંગો છો? 🏠"
+}
+
+LOCAL_ANSWER_TEMPLATES = {
+    'english': {
+        'unit_price': "💰 *{type}* at Brookstone: *{price_cr}* ({size_sqft})",
+        'price_per_sqft': "💰 Price per sq ft: *{value}*",
+        'unit_size': "📐 *{type}*: carpet area *{carpet_area}*, total built-up area *{size_sqft}* ({size_sq_yard})",
+        'possession_date': "🗓️ Possession is planned for *{value}*.",
+        'total_units': "🏢 Brookstone has *{value}* units in total across {towers} towers.",
+        'towers': "🏢 Brookstone has *{value}* towers with {total_units} units in total.",
+        'rera': "✅ RERA registered: *{value}*",
+        'vastu': "🧭 Vastu compliant: *{value}*",
+        'parking_count': "🚗 *{type}*: {description}",
+        'bhk_options': "🏠 {value}",
+        'loan': "🏦 Home loan facility available: *{value}*",
+        'floor_rise': "🏗️ {value}"
+    },
+    'gujarati': {
+        'unit_price': "💰 બ્રૂકસ્ટોનમાં *{type}*: *{price_cr}* ({size_sqft})",
+        'price_per_sqft': "💰 પ્રતિ ચો.ફૂટ ભાવ: *{value}*",
+        'unit_size': "📐 *{type}*: કાર્પેટ એરિયા *{carpet_area}*, કુલ બિલ્ટ-અપ એરિયા *{size_sqft}* ({size_sq_yard})",
+        'possession_date': "🗓️ પઝેશન *{value}* માં આપવાનું આયોજન છે.",
+        'total_units': "🏢 બ્રૂકસ્ટોનમાં {towers} ટાવરમાં કુલ *{value}* યુનિટ છે.",
+        'towers': "🏢 બ્રૂકસ્ટોનમાં *{value}* ટાવર અને કુલ {total_units} યુનિટ છે.",
+        'rera': "✅ રેરા રજિસ્ટર્ડ: *{value}*",
+        'vastu': "🧭 વાસ્તુ મુજબ: *{value}*",
+        'parking_count': "🚗 *{type}*: {description}",
+        'bhk_options': "🏠 {value}",
+        'loan': "🏦 હોમ લોન સુવિધા ઉપલબ્ધ: *{value}*",
+        'floor_rise': "🏗️ {value}"
+    }
+}
+
+
+def _padded_contains(text, patterns):
+    return [p for p in patterns if p in text]
+
+
+def _unit_configs(lang_data, units):
+    configs = lang_data.get('unit_configurations', [])
+    wanted = units or ['3BHK', '4BHK']
+    return [c for c in configs if c.get('type') in wanted]
+
+
+def render_local_intent(intent, lang_data, language, units):
+    """Render one intent from FAQ data; returns None when the data needed is missing or TBD"""
+    template = LOCAL_ANSWER_TEMPLATES[language][intent]
+    info = lang_data.get('project_info', {})
+    pricing = lang_data.get('pricing', {})
+    
+    if intent in ('unit_price', 'unit_size'):
+        configs = _unit_configs(lang_data, units)
+        lines = [template.format(**config) for config in configs]
+    elif intent == 'parking_count':
+        parking = lang_data.get('parking', {})
+        lines = []
+        for unit in units or ['3BHK', '4BHK']:
+            entry = parking.get(f"{unit.lower()}_parking", {})
+            description = entry.get('description') or entry.get('વિગત')
+            if description:
+                lines.append(template.format(type=unit, description=description))
+    else:
+        value = {
+            'price_per_sqft': pricing.get('price_per_sqft'),
+            'possession_date': info.get('possession_date'),
+            'total_units': info.get('total_units'),
+            'towers': info.get('towers'),
+            'rera': info.get('rera_registered'),
+            'vastu': info.get('vastu_compliant'),
+            'bhk_options': lang_data.get('available_options', {}).get('bhk_types'),
+            'loan': pricing.get('loan_facility'),
+            'floor_rise': pricing.get('floor_rise_charges')
+        }[intent]
+        if not value or value == 'TBD':
+            return None
+        lines = [template.format(value=value, towers=info.get('towers', ''), total_units=info.get('total_units', ''))]
+    
+    return '\n'.join(lines) if lines else None
+
+
+class LocalAnswerEngine:
+    """Answers high-confidence factual questions from the FAQ data without calling Gemini"""
+
+    def __init__(self, min_confidence=LOCAL_ANSWER_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self.answered = 0
+        self.fell_through = 0
+        self.by_intent = collections.Counter()
+        self._lock = threading.Lock()
+
+    def classify(self, normalized_question):
+        """Return (intents, units, confidence) for a normalized question"""
+        text = f" {normalized_question} "
+        units = [unit for unit, patterns in UNIT_ENTITY_PATTERNS.items() if _padded_contains(text, patterns)]
+        if _padded_contains(text, LOCAL_ANSWER_NEGATIVE_CUES):
+            return [], units, 0.0
+        
+        mentions_unit = bool(units or _padded_contains(text, UNIT_MENTION_PATTERNS))
+        hits = {}
+        for intent in FAQ_INTENTS:
+            found = _padded_contains(text, intent['patterns'])
+            if mentions_unit:
+                found += _padded_contains(text, intent.get('unit_patterns', []))
+            if not found:
+                continue
+            if _padded_contains(text, intent.get('negative', [])):
+                return [], units, 0.0
+            hits[intent['name']] = found
+        overrides = {intent['name']: intent.get('overridden_by', []) for intent in FAQ_INTENTS}
+        intents = [name for name in hits if not any(o in hits for o in overrides[name])]
+        
+        if not intents:
+            return [], units, 0.0
+        
+        words = len(normalized_question.split())
+        confidence = 0.7
+        if words <= 8:
+            confidence += 0.2
+        elif words <= 14:
+            confidence += 0.1
+        else:
+            confidence -= 0.2
+        if _padded_contains(text, OPEN_ENDED_PATTERNS):
+            confidence -= 0.5
+        confidence -= 0.1 * (len(intents) - 1)
+        # A lone keyword ("price", "rera") is weaker evidence than a phrase
+        if any(all(len(p.split()) == 1 for p in hits[name]) for name in intents):
+            confidence -= 0.1
+        return intents, units, round(max(confidence, 0.0), 2)
+
+    def answer(self, normalized_question, faq_data, language):
+        """Rendered answer when confident, otherwise None (caller falls through to Gemini)"""
+        intents, units, confidence = self.classify(normalized_question)
+        answer = None
+        if intents and confidence >= self.min_confidence:
+            lang_data = faq_data.get(language, faq_data.get('english', {}))
+            parts = [render_local_intent(intent, lang_data, language, units) for intent in intents]
+            if all(parts):
+                answer = '\n\n'.join(parts + [LOCAL_ANSWER_FOLLOW_UP[language]])
+        
+        with self._lock:
+            if answer is None:
+                self.fell_through += 1
+            else:
+                self.answered += 1
+                for intent in intents:
+                    self.by_intent[intent] += 1
+        return answer
+
+    def stats(self):
+        with self._lock:
+            total = self.answered + self.fell_through
+            return {
+                'answered_locally': self.answered,
+                'fell_through': self.fell_through,
+                'local_fraction': round(self.answered / total, 4) if total else 0.0,
+                'min_confidence': self.min_confidence,
+                'by_intent': dict(self.by_intent)
             }
 
-    # Check for parking related queries
-    if any(word in user_question_lower for word in ['parking', 'car park', 'vehicle', 'cars']):
-        if 'parking' in lang_data:
-            relevant_data['parking'] = lang_data['parking']
 
-    # Check for specifications from the image
-    if any(word in user_question_lower for word in ['structure', 'flooring', 'bathroom', 'kitchen', 'electrical', 'doors', 'windows', 'security', 'water', 'specifications', 'features']):
-        if 'construction_specifications' in lang_data:
-            relevant_data['specifications'] = lang_data['construction_specifications']
+LOCAL_ANSWERS = LocalAnswerEngine()
+register_metrics('local_answers', LOCAL_ANSWERS.stats)
 
-    if any(word in user_question_lower for word in ['amenity', 'amenities', 'facility', 'gym', 'pool', 'park', 'club']):
-        if 'amenities' in lang_data:
-            relevant_data['amenities'] = lang_data['amenities']
-    
-    if any(word in user_question_lower for word in ['location', 'address', 'connectivity', 'metro', 'nearby', 'landmark']):
-        if 'location_details' in lang_data:
-            relevant_data['location_details'] = lang_data['location_details']
-    
-    if any(word in user_question_lower for word in ['possession', 'ready', 'completion', 'timeline', 'delivery']):
-        if 'possession_details' in lang_data:
-            relevant_data['possession_details'] = lang_data['possession_details']
-    
-    if any(word in user_question_lower for word in ['developer', 'shatranj', 'aarat', 'group', 'company', 'builder']):
-        if 'developer_portfolio' in lang_data:
-            relevant_data['developer_portfolio'] = lang_data['developer_portfolio']
-    
-    # If minimal data, add more sections
-    if len(relevant_data) <= 2:
-        for section in ['unit_configurations', 'pricing', '3bhk_unit_plan', '4bhk_unit_plan', 'amenities', 'location_details']:
-            if section in lang_data:
-                relevant_data[section] = lang_data[section]
-    
-    return relevant_data
 
+# ===== MESSAGE INTENT ROUTER =====
+# Canned-reply intents of plan_incoming_message, in precedence order. An intent
+# matches when any of its keywords occurs anywhere in the lowercased message.
+MESSAGE_INTENTS = {
+    'brochure': ['brochure', 'pdf', 'download', 'send brochure', 'share brochure', 'floor plan', 'send pdf'],
+    # Only acted on right after the bot offered the brochure
+    'brochure_affirmative': ['yes', 'yeah', 'yup', 'sure', 'ok', 'okay', 'please', 'send', 'want', 'need'],
+    'location': ['location', 'address', 'site address', 'google map', 'map', 'direction', 'where is', 'reach'],
+    'contact': ['whatsapp chat', 'whatsapp number', 'agent whatsapp', 'contact agent', 'agent contact', 'talk to agent'],
+    'site_visit': [
+        'book site visit', 'schedule visit', 'site visit', 'book appointment', 'visit booking',
+        'સાઇટ વિઝિટ', 'એપોઇન્ટમેન્ટ', 'વિઝિટ બુક', 'મુલાકાત', 'સાઇટ જોવા'
+    ]
+}
 
-def create_gemini_prompt(user_question, faq_data, language='english', chat_history=None):
-    """Create an optimized prompt for Gemini with only relevant data and conversation context"""
-    relevant_data = extract_relevant_data(user_question, faq_data, language)
-    
-    # Build conversation context
-    conversation_context = ""
-    if chat_history and len(chat_history) > 0:
-        recent_history = chat_history[-4:] if len(chat_history) > 4 else chat_history
-        conversation_context = "\n\nRECENT CONVERSATION:\n"
-        for msg, is_user in recent_history:
-            role = "User" if is_user else "Bot"
-            conversation_context += f"{role}: {msg}\n"
-    
-    prompt = f"""
-You are a helpful real estate chatbot for the Brookstone project. Answer user questions based on the provided project data and conversation context. {"Use Gujarati language for responses." if language == 'gujarati' else "Use English language for responses."}
+# Entities picked up in the same scan: name -> (regex, formatter); the first match of each wins
+MESSAGE_ENTITIES = {
+    'phone': (r'\b(?:\+91[\s-]?)?[6-9]\d{9}\b', lambda value: value.replace(' ', '').replace('-', '')),
+    'budget_cr': (r'\d+\.?\d*(?=\s*(?:cr|crore|crores))', lambda value: f"{float(value)} Cr"),
+    'budget_lakh': (r'\d+\.?\d*(?=\s*(?:lakh|lakhs))', lambda value: f"{float(value)} Lakh")
+}
+# First character of every entity match; elsewhere the scan only tries the keyword trie
+MESSAGE_ENTITY_START = r'[\d+]'
 
-PROJECT DATA:
-{json.dumps(relevant_data, indent=2)}{conversation_context}
 
-USER QUESTION: {user_question}
+class MessageRoute(collections.namedtuple('MessageRoute', 'intents entities')):
+    """Matched (intent, confidence) pairs in precedence order plus the extracted entities"""
+    __slots__ = ()
 
-INSTRUCTIONS:
-1. ALWAYS use the PROJECT DATA provided above to answer questions
-2. Consider the RECENT CONVERSATION context - if user says "yes", "sure", "please", they are responding to your previous question
-3. If any detail shows "TBD", say {"આ વિગત હજી નક્કી કરવાની બાકી છે" if language == 'gujarati' else "This detail is yet to be finalized"}
-4. Keep responses concise but comprehensive (max 1000 characters for WhatsApp)
-5. For possession date, mention {"મે 2027" if language == 'gujarati' else "May 2027"}
-6. After answering, ask 1 natural follow-up question to keep conversation going
-7. Be conversational and friendly like a real sales agent
-8. NEVER suggest WhatsApp links - only provide phone numbers
-9. For agent contact, ONLY provide phone number +91 1234567890
-10. Format your response for WhatsApp - use emojis and clear structure
+    def has(self, intent):
+        return any(name == intent for name, _ in self.intents)
 
-11. For ground floor questions:
-    - Always mention specific dimensions when available
-    - Describe the layout and connections between spaces
-    - Include details about amenities and facilities
-    - If size/dimension is asked but not available, acknowledge that and provide other relevant details
+    @property
+    def budget(self):
+        return self.entities.get('budget_cr') or self.entities.get('budget_lakh')
 
-12. When mentioning sizes or dimensions:
-    - Use the exact measurements as provided in the data
-    - Format dimensions clearly with proper units (e.g., "14'-9\" × 14'-6\"")
-    - For carpet area, specify it's carpet area (કાર્પેટ એરિયા in Gujarati)
-    - For total area, specify it's total built-up area (કુલ બિલ્ટ-અપ એરિયા in Gujarati)
 
-13. For BHK queries:
-    - Always mention both carpet area and total area
-    - Include price when available
-    - Specify number of bathrooms and balconies
-    - Mention key features of the layout
-    - If asking about 3BHK, provide 3BHK details first, then briefly mention 4BHK is also available
-    - If asking about 4BHK, provide 4BHK details first, then briefly mention 3BHK is also available
+class IntentRouter:
+    """Classifies a message against every intent and extracts its entities in one regex scan.
 
-14. Language-specific formatting:
-    - Use native number format for Gujarati (૧,૨,૩,૪,૫,૬,૭,૮,૯,૦)
-    - Use appropriate units: {'ચો.ફૂટ for sqft, કરોડ for crore' if language == 'gujarati' else 'sq ft for area, Cr for crore'}
-    - Use native terms for amenities and facilities when in Gujarati
+    Entity regexes and a lookahead over the trie of all intent keywords are
+    compiled into a single alternation, so new intents or entities add table rows,
+    not passes over the message. Like KeywordMatcher, keywords that are prefixes
+    of the longest match at a position are credited too (`keyword in text` semantics).
+    """
 
-ANSWER:"""
-    
-    return prompt
+    def __init__(self, intents, entities, entity_start=MESSAGE_ENTITY_START):
+        self.order = list(intents)
+        keyword_intents = collections.defaultdict(set)
+        for intent, keywords in intents.items():
+            for keyword in keywords:
+                keyword_intents[keyword].add(intent)
+        # keyword -> (intent, matched on a phrase) for it and every keyword that is a prefix of it
+        self.credit = {
+            keyword: tuple({(intent, ' ' in other) for other, names in keyword_intents.items()
+                            if keyword.startswith(other) for intent in names})
+            for keyword in keyword_intents
+        }
+        self.formatters = {name: formatter for name, (_, formatter) in entities.items()}
+        entity_alternatives = '|'.join(f"(?P<{name}>{regex})" for name, (regex, _) in entities.items())
+        self.pattern = re.compile(
+            f"(?={entity_start})(?:{entity_alternatives})|(?=(?P<keyword>{trie_regex(keyword_intents)}))"
+        )
+        self.routed = collections.Counter()
+        self._lock = threading.Lock()
 
+    def route(self, text):
+        """MessageRoute for a raw message"""
+        text = text.lower()
+        found = set()
+        entities = {}
+        for match in self.pattern.finditer(text):
+            kind = match.lastgroup
+            if kind == 'keyword':
+                found.add(match.group(kind))
+            elif kind not in entities:
+                entities[kind] = self.formatters[kind](match.group(kind))
+        
+        phrase_matched = {}
+        for keyword in found:
+            for intent, phrase in self.credit[keyword]:
+                phrase_matched[intent] = phrase_matched.get(intent, False) or phrase
+        
+        intents = []
+        if phrase_matched:
+            # Phrases are stronger evidence than single words; competing intents weaken each other
+            base = (0.1 if len(text.split()) <= 6 else 0.0) - 0.1 * (len(phrase_matched) - 1)
+            for intent in self.order:
+                if intent in phrase_matched:
+                    confidence = base + (0.9 if phrase_matched[intent] else 0.7)
+                    intents.append((intent, round(min(max(confidence, 0.0), 1.0), 2)))
+        
+        with self._lock:
+            self.routed[intents[0][0] if intents else 'none'] += 1
+        return MessageRoute(intents, entities)
 
-def call_gemini_api(prompt, language='english'):
-    """Call Google Gemini API with retry logic"""
-    if not GEMINI_API_KEY:
-        return "⚠️ Please configure your Gemini API key"
-    
-    headers = {'Content-Type': 'application/json'}
-    data = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "temperature": 0.3,
-            "maxOutputTokens": 800
-        }
-    }
-    
-    for attempt in range(2):
-        try:
-            if attempt > 0:
-                time.sleep(2)
-            
-            response = requests.post(
-                f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'candidates' in result and len(result['candidates']) > 0:
-                    candidate = result['candidates'][0]
-                    if 'content' in candidate and 'parts' in candidate['content']:
-                        return candidate['content']['parts'][0]['text']
-            
-            logging.warning(f"Gemini API error: {response.status_code}")
-                    
-        except Exception as e:
-            logging.error(f"Gemini API exception: {e}")
-            continue
-    
-    return "Sorry, I'm having trouble answering right now. Please try again or contact our agent at +91 1234567890."
+    def stats(self):
+        with self._lock:
+            return {'intents': len(self.order), 'keywords': len(self.credit), 'routed': dict(self.routed)}
+
+
+INTENT_ROUTER = IntentRouter(MESSAGE_INTENTS, MESSAGE_ENTITIES)
+register_metrics('intents', INTENT_ROUTER.stats)
 
 
 # ===== MESSAGE PROCESSING LOGIC =====
@@ -1036,95 +4085,85 @@ def call_gemini_api(prompt, language='english'):
 #     state['chat_history'].append((ai_response, False))
 #     return ai_response
 
-def process_incoming_message(from_phone, message_text, message_id): 
-    """Process incoming WhatsApp message and generate response"""
-    
-    # Get or create user state
-    if from_phone not in CONV_STATE:
-        CONV_STATE[from_phone] = {
-            'chat_history': [],
-            'lead_capture_mode': None,
-            'user_phone': from_phone,
-            'language': 'english',
-            'asked_about_brochure': False,
-            'booking_info': {}
-        }
-    
-    state = CONV_STATE[from_phone]
-    user_lower = message_text.lower().strip()
+def get_conversation_state(from_phone):
+    """Get or create the conversation state for a phone number"""
+    return CONV_STORE.get(from_phone)
+
+
+def plan_incoming_message(from_phone, message_text):
+    """Update conversation state and decide how to answer, without doing any network I/O.
+
+    Returns a dict with the canned 'reply' (or None), outbound 'actions' to run
+    (each optionally carrying an 'on_failure' reply), the Gemini 'prompt'
+    when the answer has to come from the model and the conversation 'state'.
+    """
+    state = get_conversation_state(from_phone)
+    plan = {'reply': None, 'actions': [], 'prompt': None, 'state': state}
+    # Every canned-reply intent and entity (phone, budget) in one scan
+    route = INTENT_ROUTER.route(message_text)
     
     # Detect language from user's message
     detected_lang = detect_language(message_text)
-    state['language'] = detected_lang  # Update user's preferred language
+    state.language = detected_lang  # Update user's preferred language
+    plan['language'] = detected_lang
     
     # Add user message to history
-    state['chat_history'].append((message_text, True))
+    state.add_turn(message_text, True)
     
     # ===== HANDLE PHONE NUMBER FOR BROCHURE =====
-    if state.get('lead_capture_mode') == 'phone_for_brochure':
-        phone_pattern = r'\b(?:\+91[\s-]?)?[6-9]\d{9}\b'
-        phone_match = re.search(phone_pattern, message_text)
+    if state.lead_capture_mode == 'phone_for_brochure':
+        phone_number = route.entities.get('phone')
         
-        if phone_match:
-            phone_number = phone_match.group().replace(' ', '').replace('-', '')
-            state['user_phone'] = phone_number
-            state['lead_capture_mode'] = None
-            
-            success = send_whatsapp_document(phone_number, BROCHURE_MEDIA_ID)
+        if phone_number:
+            state.user_phone = phone_number
+            state.lead_capture_mode = None
             
-            if not success:
-                reply = """I apologize, but there was an issue sending the brochure to your WhatsApp. 
+            plan['actions'].append({
+                'type': 'document',
+                'to': phone_number,
+                'on_failure': """I apologize, but there was an issue sending the brochure to your WhatsApp. 
 
 Please try again later or contact our agent directly at +91 1234567890."""
-                state['chat_history'].append((reply, False))
-                return reply
-                
-            return None
+            })
+            return plan
         else:
             reply = """I didn't find a valid phone number. Please share your *10-digit mobile number* to send the brochure.
 
 For example: 9876543210 or +91 9876543210"""
-            state['chat_history'].append((reply, False))
-            return reply
+            state.add_turn(reply, False)
+            plan['reply'] = reply
+            return plan
     
     # ===== DETECT BROCHURE REQUEST =====
-    brochure_keywords = ['brochure', 'pdf', 'download', 'send brochure', 'share brochure', 'floor plan', 'send pdf']
-    if any(kw in user_lower for kw in brochure_keywords):
-        state['asked_about_brochure'] = True
+    if route.has('brochure'):
+        state.asked_about_brochure = True
         
         # Send brochure directly to the phone number that messaged us
-        success = send_whatsapp_document(from_phone)
-        
-        if not success:
-            reply = """I apologize, but there was an issue sending the brochure.
+        plan['actions'].append({
+            'type': 'document',
+            'to': from_phone,
+            'on_failure': """I apologize, but there was an issue sending the brochure.
 
 Please contact our agent at +91 1234567890 for assistance."""
-            state['chat_history'].append((reply, False))
-            return reply
-            
-        return None
+        })
+        return plan
     
     # ===== HANDLE AFFIRMATIVE RESPONSE TO BROCHURE =====
-    if state.get('asked_about_brochure', False):
-        state['asked_about_brochure'] = False
-        
-        affirmative_patterns = ['yes', 'yeah', 'yup', 'sure', 'ok', 'okay', 'please', 'send', 'want', 'need']
+    if state.asked_about_brochure:
+        state.asked_about_brochure = False
         
-        if any(a in user_lower for a in affirmative_patterns):
-            success = send_whatsapp_document(from_phone)
-            
-            if not success:
-                reply = """❌ There was an issue sending your brochure on WhatsApp.
+        if route.has('brochure_affirmative'):
+            plan['actions'].append({
+                'type': 'document',
+                'to': from_phone,
+                'on_failure': """❌ There was an issue sending your brochure on WhatsApp.
 Please contact our agent at +91 1234567890."""
-                state['chat_history'].append((reply, False))
-                return reply
-                
-            return None
+            })
+            return plan
 
     # ===== HANDLE LOCATION REQUEST =====
-    location_keywords = ['location', 'address', 'site address', 'google map', 'map', 'direction', 'where is', 'reach']
-    if any(kw in user_lower for kw in location_keywords):
-        send_whatsapp_location(from_phone)
+    if route.has('location'):
+        plan['actions'].append({'type': 'location', 'to': from_phone})
         reply = """📍 *Brookstone Location:*
 
 Brookstone, Vaikunth Bungalows,
@@ -1132,13 +4171,12 @@ Beside DPS Bopal Rd, next to A. Shridhar Oxygen Park,
 Bopal, Shilaj, Ahmedabad, Gujarat 380058
 
 I've also shared the location pin above 👆."""
-        state['chat_history'].append((reply, False))
-        return reply
+        state.add_turn(reply, False)
+        plan['reply'] = reply
+        return plan
     
     # ===== HANDLE WHATSAPP CONTACT REQUEST =====
-    contact_patterns = ['whatsapp chat', 'whatsapp number', 'agent whatsapp', 'contact agent', 'agent contact', 'talk to agent']
-    
-    if any(phrase in user_lower for phrase in contact_patterns):
+    if route.has('contact'):
         reply = f"""Great! You can reach our agent, Shatranj, directly on WhatsApp at:
 
 📱 *WhatsApp Number:* +91 1234567890
@@ -1149,18 +4187,16 @@ You can also call on the same number for a phone conversation.
 
 Is there anything else about Brookstone I can help you with? 🏠"""
         
-        state['chat_history'].append((reply, False))
-        return reply
+        state.add_turn(reply, False)
+        plan['reply'] = reply
+        return plan
     
     # ===== HANDLE SITE VISIT BOOKING =====
-    booking_keywords_english = ['book site visit', 'schedule visit', 'site visit', 'book appointment', 'visit booking']
-    booking_keywords_gujarati = ['સાઇટ વિઝિટ', 'એપોઇન્ટમેન્ટ', 'વિઝિટ બુક', 'મુલાકાત', 'સાઇટ જોવા']
-    
-    if any(kw in user_lower for kw in booking_keywords_english + booking_keywords_gujarati):
+    if route.has('site_visit'):
         english_form_url = "https://docs.google.com/forms/d/e/1FAIpQLSceds-nIr9vTLHJ0Jl1TOv0DNYGQhb0CtEa2R3mA9Ae3iP8Lg/viewform"
         gujarati_form_url = "https://docs.google.com/forms/d/e/1FAIpQLSdmWOyIDKZ5KU47LhzKUJXwITN40Fn8tV8swuX7IIWFvB72qQ/viewform"
         
-        if state['language'] == 'gujarati':
+        if state.language == 'gujarati':
             reply = f"""🏠 *બ્રૂકસ્ટોન સાઇટ વિઝિટ બુકિંગ*
 
 તમારી સાઇટ વિઝિટ શેડ્યૂલ કરવા માટે, નીચેની લિંક પર ક્લિક કરો અને ફોર્મ ભરો:
@@ -1199,32 +4235,376 @@ Need help with the form? Feel free to ask! 😊
 
 _Tip: Make sure to provide accurate contact details in the form as we'll send the confirmation on the same WhatsApp number._ 📱"""
         
-        state['chat_history'].append((reply, False))
-        return reply
+        state.add_turn(reply, False)
+        plan['reply'] = reply
+        return plan
     
     # ===== EXTRACT AND SAVE BUDGET =====
-    budget = extract_budget_from_text(message_text)
-    if budget and state.get('booking_info'):
+    budget = route.budget
+    if budget and state.booking_info:
         logging.info(f"Budget indicated by {from_phone}: {budget}")
     
     # ===== DEFAULT: USE GEMINI FOR GENERAL QUESTIONS =====
-    chat_history = state.get('chat_history', [])
-    prompt = create_gemini_prompt(message_text, FAQ_DATA, state['language'], chat_history)
-    ai_response = call_gemini_api(prompt, state['language'])
+    # One FAQ snapshot for the whole answer, even if a reload lands meanwhile
+    faq = FAQ
+    chat_history = state.chat_history()
+    normalized = normalize_question(message_text)
+    follow_up = depends_on_history(normalized, chat_history[:-1])
+    
+    # Factual lookups are answered straight from the FAQ data
+    if not follow_up:
+        local_answer = LOCAL_ANSWERS.answer(normalized, faq.data, state.language)
+        if local_answer is not None:
+            state.add_turn(local_answer, False)
+            plan['reply'] = local_answer
+            return plan
+    
+    relevant_data = select_relevant_data(message_text, state.language, faq)
+    
+    # Serve repeated standalone questions from the answer cache
+    if follow_up:
+        RESPONSE_CACHE.record_bypass()
+    else:
+        cache_key = response_cache_key(normalized, state.language, relevant_data, faq.version)
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            state.add_turn(cached, False)
+            plan['reply'] = cached
+            return plan
+        plan['cache_key'] = cache_key
     
-    state['chat_history'].append((ai_response, False))
-    return ai_response
+    cached_content, cached_sections = GEMINI_CONTEXT.get(state.language)
+    plan['cached_content'] = cached_content
+    plan['prompt'] = create_gemini_prompt(message_text, state.language, chat_history, relevant_data, cached_sections)
+    return plan
 
 
+def run_outbound_action(action):
+    """Perform a planned outbound WhatsApp action (brochure, location pin)"""
+    if action['type'] == 'document':
+        return send_whatsapp_document(action['to'])
+    if action['type'] == 'location':
+        return send_whatsapp_location(action['to'])
+    logging.error(f"Unknown outbound action: {action['type']}")
+    return False
 
-# ===== WEBHOOK ROUTES =====
-@app.route('/webhook', methods=['GET'])
-def verify_webhook():
-    """Webhook verification endpoint for Meta"""
-    mode = request.args.get('hub.mode')
-    token = request.args.get('hub.verify_token')
-    challenge = request.args.get('hub.challenge')
+
+def process_incoming_message(from_phone, message_text, message_id):
+    """Process incoming WhatsApp message and generate response"""
+    deadline = Deadline(GEMINI_MESSAGE_BUDGET)
+    plan = plan_incoming_message(from_phone, message_text)
+    state = plan['state']
+    reply = plan['reply']
+    
+    for action in plan['actions']:
+        if not run_outbound_action(action) and action.get('on_failure'):
+            reply = action['on_failure']
+            state.add_turn(reply, False)
+    
+    if plan['prompt'] is not None:
+        reply = call_gemini_api(plan['prompt'], plan['language'], plan.get('cached_content'), deadline)
+        state.add_turn(reply, False)
+        if plan.get('cache_key') and is_cacheable_answer(reply):
+            RESPONSE_CACHE.put(plan['cache_key'], reply)
+    
+    CONV_STORE.commit(from_phone, state)
+    return reply
+
+
+
+def extract_incoming_messages(data):
+    """Yield (from_phone, message_id, text) for every text-bearing message in a webhook payload"""
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            
+            # Get messages
+            messages = value.get('messages', [])
+            for message in messages:
+                from_phone = message.get('from')
+                message_id = message.get('id')
+                msg_type = message.get('type')
+                
+                text = ''
+                
+                if msg_type == 'text':
+                    text = message.get('text', {}).get('body', '')
+                elif msg_type == 'button':
+                    text = message.get('button', {}).get('text', '')
+                elif msg_type == 'interactive':
+                    interactive = message.get('interactive', {})
+                    if 'button_reply' in interactive:
+                        text = interactive['button_reply'].get('title', '')
+                    elif 'list_reply' in interactive:
+                        text = interactive['list_reply'].get('title', '')
+                
+                if not text:
+                    logging.warning(f"No text found in message type: {msg_type}")
+                    continue
+                
+                yield from_phone, message_id, text
+
+
+def handle_incoming_message(from_phone, message_id, text):
+    """Generate the reply to a message and send it back"""
+    logging.info(f"📱 Message from {from_phone}: {text}")
+    # Read receipts go out in the background, coalesced per conversation
+    READ_RECEIPTS.mark(from_phone, message_id)
     
+    # Process the message and get response
+    response_text = process_incoming_message(from_phone, text, message_id)
+    
+    # Send response back; nothing depends on the outcome, so don't hold the request
+    # (or worker) while a rate-limited send retries. The recipient's lane keeps it in order.
+    if response_text:
+        OUTBOUND.submit(from_phone, text_message_payload(from_phone, response_text), 'text', f"Message to {from_phone}")
+
+
+# ===== WEBHOOK PAYLOAD CLASSIFICATION =====
+STATUS_VALUE_PATTERN = re.compile(rb'"status"\s*:\s*"([a-z_]+)"')
+
+
+class WebhookStats:
+    """Counters for webhook payload kinds and delivery status callbacks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.payloads = collections.Counter()
+        self.statuses = collections.Counter()
+
+    def record_payload(self, kind):
+        with self._lock:
+            self.payloads[kind] += 1
+
+    def record_statuses(self, raw):
+        found = STATUS_VALUE_PATTERN.findall(raw)
+        with self._lock:
+            for status in found:
+                self.statuses[status.decode('ascii')] += 1
+
+    def stats(self):
+        with self._lock:
+            return {'payloads': dict(self.payloads), 'delivery_statuses': dict(self.statuses)}
+
+
+WEBHOOK_STATS = WebhookStats()
+register_metrics('webhook', WEBHOOK_STATS.stats)
+
+
+def classify_webhook_payload(raw):
+    """Cheaply classify a raw webhook body as 'messages', 'statuses' or 'other' without parsing it"""
+    if b'"messages"' in raw:
+        return 'messages'
+    if b'"statuses"' in raw:
+        return 'statuses'
+    return 'other'
+
+
+def log_webhook_payload(raw, kind):
+    """Log a sampled, truncated copy of the raw payload only when DEBUG logging is on"""
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= WEBHOOK_LOG_SAMPLE_RATE:
+        return
+    logging.debug(f"Incoming webhook ({kind}): {raw[:500].decode('utf-8', 'replace')}...")
+
+
+# ===== WEBHOOK DEDUPLICATION =====
+class MessageDedupCache:
+    """Fixed-size TTL/LRU set of recently seen WhatsApp message IDs"""
+
+    def __init__(self, max_entries=DEDUP_CACHE_SIZE, ttl_seconds=DEDUP_TTL_SECONDS):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._seen = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.duplicates = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expire(self, now):
+        # Entries are kept in insertion order, so expired ones are always at the front
+        while self._seen:
+            message_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl_seconds:
+                break
+            self._seen.popitem(last=False)
+            self.expirations += 1
+
+    def check_and_add(self, message_id):
+        """Return True if message_id was already seen, otherwise remember it"""
+        if not message_id:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self.checks += 1
+            self._expire(now)
+            if message_id in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[message_id] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+                self.evictions += 1
+            return False
+
+    def discard(self, message_id):
+        """Forget a message ID so a later redelivery is processed (e.g. after a 503)"""
+        with self._lock:
+            self._seen.pop(message_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._seen),
+                'capacity': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'checks': self.checks,
+                'duplicates': self.duplicates,
+                'hit_rate': round(self.duplicates / self.checks, 4) if self.checks else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+MESSAGE_DEDUP = MessageDedupCache()
+register_metrics('dedup', MESSAGE_DEDUP.stats)
+
+
+# ===== BACKGROUND WORKER POOL =====
+class WorkerShard:
+    """One ordered lane of the worker pool: a bounded FIFO drained by a single thread"""
+
+    def __init__(self, index, handler, max_queue):
+        self.index = index
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.wait_time = LatencyHistogram()
+        self.pending_by_sender = collections.Counter()
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def put(self, key, args):
+        # Count before enqueueing so the worker's decrement can never run first
+        with self._lock:
+            self.pending_by_sender[key] += 1
+            try:
+                self.queue.put_nowait((time.monotonic(), key, args))
+            except queue.Full:
+                self.pending_by_sender[key] -= 1
+                if self.pending_by_sender[key] <= 0:
+                    del self.pending_by_sender[key]
+                raise
+
+    def run(self):
+        while True:
+            enqueued_at, key, args = self.queue.get()
+            started = time.monotonic()
+            self.wait_time.observe(started - enqueued_at)
+            try:
+                self.handler(*args)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                logging.exception(f'❌ Error processing queued message on shard {self.index}')
+            finally:
+                with self._lock:
+                    self.processed += 1
+                    self.pending_by_sender[key] -= 1
+                    if self.pending_by_sender[key] <= 0:
+                        del self.pending_by_sender[key]
+                self.queue.task_done()
+
+    def oldest_wait(self):
+        """Age in seconds of the oldest message still waiting on this shard"""
+        with self.queue.mutex:
+            if not self.queue.queue:
+                return 0.0
+            enqueued_at = self.queue.queue[0][0]
+        return time.monotonic() - enqueued_at
+
+    def stats(self):
+        with self._lock:
+            hot_senders = self.pending_by_sender.most_common(3)
+            processed, failed = self.processed, self.failed
+        wait = self.wait_time.snapshot()
+        return {
+            'depth': self.queue.qsize(),
+            'processed': processed,
+            'failed': failed,
+            'lag_seconds': round(self.oldest_wait(), 3),
+            'wait_p95': wait['p95'],
+            'wait_max': wait['max'],
+            'hot_senders': [{'sender': k, 'pending': n} for k, n in hot_senders]
+        }
+
+
+class MessageWorkerPool:
+    """Shards messages by sender so each conversation is processed strictly in order.
+
+    Every sender hashes to one shard and each shard has a single worker thread,
+    so two messages from the same phone never run concurrently or out of order,
+    while different senders spread across all shards in parallel.
+    """
+
+    def __init__(self, handler, workers=WORKER_COUNT, max_queue=WORKER_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        per_shard = max(1, -(-max_queue // self.workers))
+        self.shards = [WorkerShard(i, handler, per_shard) for i in range(self.workers)]
+        self.submitted = 0
+        self.rejected = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start one worker thread per shard (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            for shard in self.shards:
+                threading.Thread(target=shard.run, name=f"msg-shard-{shard.index}", daemon=True).start()
+            self._started = True
+        logging.info(f"🧵 Started {self.workers} message shards")
+
+    def shard_for(self, key):
+        return self.shards[zlib.crc32(str(key).encode('utf-8')) % self.workers]
+
+    def submit(self, key, *args):
+        """Enqueue a job on the sender's shard without blocking; False when that shard is full"""
+        self.start()
+        try:
+            self.shard_for(key).put(key, args)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def stats(self):
+        shards = [shard.stats() for shard in self.shards]
+        return {
+            'mode': WEBHOOK_PROCESSING_MODE,
+            'workers': self.workers,
+            'queue_depth': sum(s['depth'] for s in shards),
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'failed': sum(s['failed'] for s in shards),
+            'max_lag_seconds': max(s['lag_seconds'] for s in shards),
+            'shards': shards
+        }
+
+
+MESSAGE_WORKERS = MessageWorkerPool(handle_incoming_message)
+register_metrics('workers', MESSAGE_WORKERS.stats)
+
+
+# ===== WEBHOOK HANDLING (shared by the WSGI and ASGI apps) =====
+def verify_webhook_request(mode, token, challenge):
+    """Meta webhook verification handshake; returns (body, status)"""
     logging.info(f"Webhook verification: mode={mode}, token={token}")
     
     if mode == 'subscribe' and token == VERIFY_TOKEN:
@@ -1235,88 +4615,349 @@ def verify_webhook():
         return 'Forbidden', 403
 
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Webhook endpoint to receive messages from WhatsApp"""
-    data = request.get_json()
+def accept_webhook(raw, dispatch):
+    """Classify, deduplicate and dispatch a raw webhook body; returns (response dict, status).
+
+    dispatch(from_phone, message_id, text) returns False when the message
+    cannot be accepted right now, which turns into a 503 so Meta redelivers.
+    """
+    FAQ_RELOADER.start()
+    kind = classify_webhook_payload(raw)
+    WEBHOOK_STATS.record_payload(kind)
+    log_webhook_payload(raw, kind)
     
-    logging.info(f"Incoming webhook: {json.dumps(data, indent=2)[:500]}...")
+    # Delivery receipts (sent/delivered/read) are only counted, never parsed
+    if kind == 'statuses':
+        WEBHOOK_STATS.record_statuses(raw)
+        return {'status': 'ok'}, 200
     
     try:
-        # Parse WhatsApp Cloud API webhook structure
-        for entry in data.get('entry', []):
-            for change in entry.get('changes', []):
-                value = change.get('value', {})
-                
-                # Get messages
-                messages = value.get('messages', [])
-                for message in messages:
-                    from_phone = message.get('from')
-                    message_id = message.get('id')
-                    msg_type = message.get('type')
-                    
-                    text = ''
-                    
-                    if msg_type == 'text':
-                        text = message.get('text', {}).get('body', '')
-                    elif msg_type == 'button':
-                        text = message.get('button', {}).get('text', '')
-                    elif msg_type == 'interactive':
-                        interactive = message.get('interactive', {})
-                        if 'button_reply' in interactive:
-                            text = interactive['button_reply'].get('title', '')
-                        elif 'list_reply' in interactive:
-                            text = interactive['list_reply'].get('title', '')
-                    
-                    if not text:
-                        logging.warning(f"No text found in message type: {msg_type}")
-                        continue
-                    
-                    logging.info(f"📱 Message from {from_phone}: {text}")
-                    
-                    # Mark message as read
-                    mark_message_as_read(message_id)
-                    
-                    # Process the message and get response
-                    response_text = process_incoming_message(from_phone, text, message_id)
-                    
-                    # Send response back
-                    send_whatsapp_text(from_phone, response_text)
+        data = json.loads(raw)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return {'status': 'error', 'message': 'invalid payload'}, 400
+    
+    try:
+        for from_phone, message_id, text in extract_incoming_messages(data):
+            if MESSAGE_DEDUP.check_and_add(message_id):
+                logging.info(f"🔁 Dropping redelivered message {message_id}")
+                continue
+            
+            # The handler queues the read receipt as it starts, so a rejected message stays unread
+            if not dispatch(from_phone, message_id, text):
+                # Let Meta redeliver instead of silently dropping the message
+                MESSAGE_DEDUP.discard(message_id)
+                logging.error(f"❌ Server busy, rejecting message {message_id}")
+                return {'status': 'busy'}, 503
     
     except Exception as e:
         logging.exception('❌ Error processing webhook')
     
-    return jsonify({'status': 'ok'}), 200
+    return {'status': 'ok'}, 200
 
 
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check endpoint"""
-    return jsonify({
+def dispatch_message(from_phone, message_id, text):
+    """Process a message inline or hand it to the worker pool, per WEBHOOK_PROCESSING_MODE"""
+    if WEBHOOK_PROCESSING_MODE == 'background':
+        return MESSAGE_WORKERS.submit(from_phone, from_phone, message_id, text)
+    handle_incoming_message(from_phone, message_id, text)
+    return True
+
+
+def health_status():
+    return {
         'status': 'healthy',
         'whatsapp_configured': bool(WHATSAPP_TOKEN and WHATSAPP_PHONE_NUMBER_ID),
         'gemini_configured': bool(GEMINI_API_KEY)
-    }), 200
+    }
 
 
-@app.route('/', methods=['GET'])
-def home():
-    """Home endpoint"""
-    return jsonify({
+def home_info():
+    return {
         'message': 'Brookstone WhatsApp Bot is running!',
         'endpoints': {
             'webhook': '/webhook',
-            'health': '/health'
+            'health': '/health',
+            'metrics': '/metrics'
+        }
+    }
+
+
+# ===== WEBHOOK ROUTES =====
+@app.before_request
+def start_outbound():
+    """Start this worker's outbound senders, replaying the outbox, on its first request.
+
+    Under gunicorn the module is imported without running __main__, and each
+    forked worker needs its own sender threads.
+    """
+    OUTBOUND.start()
+
+
+@app.route('/webhook', methods=['GET'])
+def verify_webhook():
+    """Webhook verification endpoint for Meta"""
+    return verify_webhook_request(
+        request.args.get('hub.mode'),
+        request.args.get('hub.verify_token'),
+        request.args.get('hub.challenge')
+    )
+
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    """Webhook endpoint to receive messages from WhatsApp"""
+    body, status = accept_webhook(request.get_data(), dispatch_message)
+    return jsonify(body), status
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check endpoint"""
+    return jsonify(health_status()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics (queues, latencies, counters)"""
+    return jsonify(collect_metrics()), 200
+
+
+@app.route('/', methods=['GET'])
+def home():
+    """Home endpoint"""
+    return jsonify(home_info()), 200
+
+
+# ===== ASYNC (ASGI) SERVING MODE =====
+class AsyncWhatsAppBot:
+    """Non-blocking runtime for the ASGI app: one event loop, pooled HTTP, no threads per message.
+
+    Messages from the same sender are serialized with a per-sender lock; everything
+    else overlaps, so a single process can keep hundreds of Gemini calls in flight.
+    """
+
+    def __init__(self, max_inflight=ASYNC_MAX_INFLIGHT):
+        self.max_inflight = max_inflight
+        self.client = None
+        self.tasks = set()
+        self.sender_locks = {}
+        self.sender_pending = collections.Counter()
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.message_latency = LatencyHistogram()
+
+    async def startup(self):
+        if httpx is None:
+            raise RuntimeError("SERVING_MODE=asgi requires the 'httpx' package")
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_inflight, max_keepalive_connections=100)
+        )
+        # Replays anything a previous process left in the outbox
+        OUTBOUND.start()
+        logging.info(f"⚡ Async runtime started (max {self.max_inflight} in-flight messages)")
+
+    async def shutdown(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.client is not None:
+            await self.client.aclose()
+
+    # ----- WhatsApp Graph API -----
+    async def graph_post(self, to_phone, payload, call, description):
+        return await OUTBOUND.asend(to_phone, payload, call, description)
+
+    async def send_text(self, to_phone, message):
+        return await self.graph_post(to_phone, text_message_payload(to_phone, message), 'text', f"Message to {to_phone}")
+
+    async def send_location(self, to_phone):
+        return await self.graph_post(to_phone, location_message_payload(to_phone), 'location', f"Location to {to_phone}")
+
+    async def send_document(self, to_phone, caption="Here is your Brookstone Brochure 📄"):
+        description = f"Document to {to_phone}"
+        if not os.path.exists(BROCHURE_PATH):
+            # Without a local copy: a configured media ID, else the public brochure link
+            return await self.graph_post(to_phone, document_message_payload(to_phone, caption, BROCHURE_MEDIA_ID), 'document', description)
+        
+        for attempt in range(2):
+            try:
+                # Uploads happen at most once per refresh period, so a worker thread is fine
+                media_id, fresh = await asyncio.to_thread(MEDIA.media_id, BROCHURE_PATH)
+            except Exception as e:
+                logging.error(f"❌ Could not upload {BROCHURE_PATH}: {e}")
+                return False
+            payload = document_message_payload(to_phone, caption, media_id, os.path.basename(BROCHURE_PATH))
+            if await self.graph_post(to_phone, payload, 'document', description):
+                return True
+            if fresh:
+                return False
+            MEDIA.invalidate(BROCHURE_PATH)
+        return False
+
+    async def run_action(self, action):
+        if action['type'] == 'document':
+            return await self.send_document(action['to'])
+        if action['type'] == 'location':
+            return await self.send_location(action['to'])
+        logging.error(f"Unknown outbound action: {action['type']}")
+        return False
+
+    # ----- Gemini -----
+    async def call_gemini(self, prompt, language='english', cached_content=None, deadline=None):
+        if not GEMINI_API_KEY:
+            return GEMINI_NOT_CONFIGURED_REPLY
+        return await GEMINI.agenerate(self.client, prompt, language, cached_content, deadline)
+
+    # ----- Message flow -----
+    async def handle_message(self, from_phone, message_id, text):
+        logging.info(f"📱 Message from {from_phone}: {text}")
+        READ_RECEIPTS.mark(from_phone, message_id)
+        started = time.monotonic()
+        deadline = Deadline(GEMINI_MESSAGE_BUDGET)
+        lock = self.sender_locks.setdefault(from_phone, asyncio.Lock())
+        self.sender_pending[from_phone] += 1
+        try:
+            async with lock:
+                side_tasks = []
+                if CONV_STORE.backend is None:
+                    plan = plan_incoming_message(from_phone, text)
+                else:
+                    # Loading shared state is blocking I/O
+                    plan = await asyncio.to_thread(plan_incoming_message, from_phone, text)
+                state = plan['state']
+                reply = plan['reply']
+                
+                for action in plan['actions']:
+                    if action.get('on_failure'):
+                        # The reply depends on the outcome, so wait for it
+                        if not await self.run_action(action):
+                            reply = action['on_failure']
+                            state.add_turn(reply, False)
+                    else:
+                        side_tasks.append(asyncio.create_task(self.run_action(action)))
+                
+                if plan['prompt'] is not None:
+                    reply = await self.call_gemini(plan['prompt'], plan['language'], plan.get('cached_content'), deadline)
+                    state.add_turn(reply, False)
+                    if plan.get('cache_key') and is_cacheable_answer(reply):
+                        RESPONSE_CACHE.put(plan['cache_key'], reply)
+                
+                if CONV_STORE.backend is None:
+                    CONV_STORE.commit(from_phone, state)
+                else:
+                    await asyncio.to_thread(CONV_STORE.commit, from_phone, state)
+                
+                if reply:
+                    side_tasks.append(asyncio.create_task(self.send_text(from_phone, reply)))
+                await asyncio.gather(*side_tasks, return_exceptions=True)
+        except Exception:
+            self.failed += 1
+            logging.exception('❌ Error processing message')
+        finally:
+            self.sender_pending[from_phone] -= 1
+            if self.sender_pending[from_phone] <= 0:
+                del self.sender_pending[from_phone]
+                self.sender_locks.pop(from_phone, None)
+            self.message_latency.observe(time.monotonic() - started)
+
+    def submit(self, from_phone, message_id, text):
+        """Schedule a message on the event loop; False when max_inflight is reached"""
+        if len(self.tasks) >= self.max_inflight:
+            self.rejected += 1
+            return False
+        task = asyncio.get_running_loop().create_task(self.handle_message(from_phone, message_id, text))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        self.accepted += 1
+        return True
+
+    def stats(self):
+        return {
+            'in_flight': len(self.tasks),
+            'max_in_flight': self.max_inflight,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'active_senders': len(self.sender_locks),
+            'message_seconds': self.message_latency.snapshot()
         }
-    }), 200
+
+
+ASYNC_BOT = AsyncWhatsAppBot()
+if SERVING_MODE == 'asgi':
+    register_metrics('async', ASYNC_BOT.stats)
+
+
+async def _asgi_respond(send, status, body, content_type='application/json'):
+    if not isinstance(body, (bytes, str)):
+        body = json.dumps(body)
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('ascii')), (b'content-length', str(len(body)).encode('ascii'))]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _asgi_lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            try:
+                await ASYNC_BOT.startup()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            await ASYNC_BOT.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point (e.g. `uvicorn whatsapp_bot:asgi_app`) serving the same routes as the Flask app"""
+    if scope['type'] == 'lifespan':
+        await _asgi_lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    
+    method, path = scope['method'], scope['path']
+    body = b''
+    more_body = True
+    while more_body:
+        event = await receive()
+        body += event.get('body', b'')
+        more_body = event.get('more_body', False)
+    
+    if path == '/webhook' and method == 'GET':
+        args = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode('utf-8')).items()}
+        text, status = verify_webhook_request(args.get('hub.mode'), args.get('hub.verify_token'), args.get('hub.challenge'))
+        await _asgi_respond(send, status, text or '', 'text/plain; charset=utf-8')
+    elif path == '/webhook' and method == 'POST':
+        result, status = accept_webhook(body, ASYNC_BOT.submit)
+        await _asgi_respond(send, status, result)
+    elif path == '/health' and method == 'GET':
+        await _asgi_respond(send, 200, health_status())
+    elif path == '/metrics' and method == 'GET':
+        await _asgi_respond(send, 200, collect_metrics())
+    elif path == '/' and method == 'GET':
+        await _asgi_respond(send, 200, home_info())
+    else:
+        await _asgi_respond(send, 404, {'status': 'error', 'message': 'not found'})
 
 
 def check_bookings_periodically():
-    """Check for new bookings every 5 minutes"""
+    """Check for new bookings every BOOKING_CHECK_INTERVAL seconds"""
     while True:
         try:
             check_new_bookings()
-            time.sleep(300)  # Sleep for 5 minutes
+            time.sleep(BOOKING_CHECK_INTERVAL)
         except Exception as e:
             logging.error(f"Error in periodic booking check: {e}")
             time.sleep(60)  # If error occurs, retry after 1 minute
@@ -1328,8 +4969,16 @@ if __name__ == '__main__':
     logging.info(f"Gemini configured: {bool(GEMINI_API_KEY)}")
     
     # Start booking checker in a separate thread
-    import threading
     booking_checker = threading.Thread(target=check_bookings_periodically, daemon=True)
     booking_checker.start()
     
-    app.run(host='0.0.0.0', port=port, debug=False)
+    # Replay the outbox now rather than on the first outbound message
+    OUTBOUND.start()
+    
+    if SERVING_MODE == 'asgi':
+        import uvicorn
+        uvicorn.run(asgi_app, host='0.0.0.0', port=port)
+    else:
+        if WEBHOOK_PROCESSING_MODE == 'background':
+            MESSAGE_WORKERS.start()
+        app.run(host='0.0.0.0', port=port, debug=False)